@@ -0,0 +1,97 @@
+"""pytest-benchmark suite for the ELO, leaderboard and search hot paths.
+
+    pip install pytest-benchmark
+    python -m benchmarks.generate
+    python -m pytest benchmarks --benchmark-json=benchmark_results.json
+
+Run from the repository root so that settings and modules import. Results can be compared between releases with
+--benchmark-compare or pytest-benchmark compare. Anything that writes (declare_winner, recalculate_elo_since,
+LeaderboardSnapshot.write) runs inside a transaction that is rolled back.
+
+Every benchmark is skipped unless the database named in config.ini (psql_db) contains 'bench' or 'test' and has games in it.
+"""
+import random
+from itertools import cycle
+
+import pytest
+from peewee import fn
+
+import settings
+from benchmarks.generate import database_allowed, NAME_WORDS
+from modules.models import db, DiscordMember, EloEvent, Game, Lineup, Player
+
+SEED = 1
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    # Record what the timings were measured against alongside pytest-benchmark's own machine and commit info
+    if database_allowed():
+        output_json['database'] = settings.psql_db
+        output_json['counts'] = {model.__name__: model.select().count() for model in (DiscordMember, Player, Game, Lineup, EloEvent)}
+
+
+def sample(items, k: int):
+    # Up to k of items. Fixtures cycle over these so that repeated rounds do not just measure a warm cache
+    if not items:
+        pytest.skip('Not enough generated data for this benchmark - run python -m benchmarks.generate first')
+    return random.Random(SEED).sample(items, min(k, len(items)))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    if not database_allowed():
+        pytest.skip(f'Not benchmarking against database "{settings.psql_db}" - point psql_db in config.ini at a database '
+                    f'whose name contains "bench" or "test".')
+    db.connect(reuse_if_open=True)
+    if not Game.select().exists():
+        pytest.skip('Database has no games - run python -m benchmarks.generate first')
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='session')
+def rolled_back():
+    # Wraps fn so that each call runs in a transaction that is rolled back, leaving the database as generated
+    def wrap(fn):
+        def wrapper(*args):
+            with db.atomic() as transaction:
+                result = fn(*args)
+                transaction.rollback()
+            return result
+        return wrapper
+    return wrap
+
+
+@pytest.fixture(scope='session')
+def guild_id():
+    # The guild with the most games
+    return Game.select(Game.guild_id).group_by(Game.guild_id).order_by(fn.COUNT(Game.id).desc()).scalar()
+
+
+@pytest.fixture(scope='session')
+def players(guild_id):
+    return cycle(sample(list(Player.select().where(Player.guild_id == guild_id).order_by(Player.id).limit(5000)), 200))
+
+
+@pytest.fixture(scope='session')
+def members():
+    return cycle(sample(list(DiscordMember.select().order_by(DiscordMember.id).limit(5000)), 200))
+
+
+@pytest.fixture(scope='session')
+def open_games():
+    # (game, side) pairs for ranked games still in progress, to declare that side the winner
+    rng = random.Random(SEED)
+    games = Game.select().where((Game.is_ranked == 1) & (Game.is_completed == 0) & (Game.is_pending == 0) & Game.winner.is_null())
+    return cycle([(game, rng.choice(list(game.gamesides))) for game in sample(list(games.order_by(Game.id).limit(2000)), 50)])
+
+
+@pytest.fixture(scope='session')
+def recent_games():
+    return cycle(sample(list(Game.select().where((Game.is_confirmed == 1) & (Game.is_ranked == 1)).order_by(-Game.completed_ts).limit(500))[::10], 50))
+
+
+@pytest.fixture
+def words():
+    # The same words in the same order for each benchmark that takes one, so that their timings can be compared
+    return cycle(NAME_WORDS)
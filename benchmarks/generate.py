@@ -0,0 +1,162 @@
+"""Synthetic data generator for the benchmarks in this directory.
+
+    python -m benchmarks.generate [--members 100000] [--games 500000] [--guilds 4] [--seed 1]
+
+Fills the database with fake members, players, teams and a mix of 1v1 / 2v2 / 3v3 / FFA games, then runs the in-memory
+ELO recalculation so ratings, lineups, checkpoints and the ELO ledger all look like a long-running server.
+The benchmarks themselves are pytest-benchmark tests - see benchmarks/conftest.py.
+
+Refuses to run unless the database named in config.ini (psql_db) contains 'bench' or 'test'.
+"""
+import argparse
+import datetime
+import logging
+import random
+import statistics
+import sys
+
+import settings
+from modules import recalculation
+from modules.models import db, DiscordMember, Game, GameSide, Lineup, Player, Squad, SquadMember, Team
+
+logger = logging.getLogger('polybot.' + __name__)
+
+DISCORD_ID_BASE = 900000000000000000  # fake discord ids start here, well clear of real snowflakes for years to come
+BATCH_SIZE = 2000
+
+# (side sizes, relative weight)
+GAME_SHAPES = [([1, 1], 45), ([2, 2], 25), ([3, 3], 15), ([1, 1, 1], 5), ([1, 1, 1, 1], 4), ([1, 2], 4), ([2, 2, 2], 2)]
+NAME_WORDS = ['Lakes', 'Drylands', 'Archipelago', 'Pangea', 'Continents', 'Might', 'Domination', 'Glory', 'Water', 'World',
+              'Crazy', 'Speed', 'Bardur', 'Imperius', 'Oumaji', 'Kickoo', 'Hoodrick', 'Luxidoor', 'Vengir', 'Zebasi']
+
+
+def database_allowed():
+    return any(word in settings.psql_db.lower() for word in ('bench', 'test'))
+
+
+def check_database():
+    if not database_allowed():
+        sys.exit(f'Refusing to run against database "{settings.psql_db}". Point psql_db in config.ini at a database '
+                 f'whose name contains "bench" or "test".')
+
+
+def insert_returning_ids(model, rows):
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        ids.extend(row[0] for row in model.insert_many(rows[start:start + BATCH_SIZE]).execute())
+    return ids
+
+
+def generate(members: int, games: int, guilds: int, seed: int):
+    rng = random.Random(seed)
+    guild_ids = [int(g) for g in settings.servers_included_in_global_lb()][:guilds]
+    guild_ids += [DISCORD_ID_BASE + n for n in range(guilds - len(guild_ids))]
+    start = datetime.datetime.now()
+
+    with db.atomic():
+        member_ids = insert_returning_ids(DiscordMember, [{'discord_id': DISCORD_ID_BASE + n, 'name': f'bench{n}'} for n in range(members)])
+
+        team_ids = {}
+        for guild_id in guild_ids:
+            team_ids[guild_id] = insert_returning_ids(Team, [{'name': f'Bench Team {n}', 'guild_id': guild_id, 'emoji': ''} for n in range(8)])
+
+        # Everyone plays in the first guild most of the time, with some members active in several guilds
+        player_rows, player_guilds = [], []
+        for member_id in member_ids:
+            for guild_index, guild_id in enumerate(guild_ids):
+                if (guild_index == 0 and rng.random() < .8) or rng.random() < .25:
+                    player_rows.append({'discord_member': member_id, 'guild_id': guild_id, 'name': f'bench{member_id}',
+                                        'team': rng.choice(team_ids[guild_id]) if rng.random() < .3 else None})
+                    player_guilds.append(guild_id)
+        player_ids = insert_returning_ids(Player, player_rows)
+        players_by_guild = {guild_id: [] for guild_id in guild_ids}
+        for player_id, guild_id in zip(player_ids, player_guilds):
+            players_by_guild[guild_id].append(player_id)
+        skill = {player_id: rng.gauss(0, 200) for player_id in player_ids}  # hidden strength that decides winners
+        print(f'Inserted {len(member_ids)} members, {len(player_ids)} players in {datetime.datetime.now() - start}')
+
+    shapes, weights = zip(*GAME_SHAPES)
+    guild_weights = [len(players_by_guild[guild_id]) for guild_id in guild_ids]
+    squads = {}
+    first_ts = datetime.datetime.now() - datetime.timedelta(days=3 * 365)
+    step = datetime.timedelta(days=3 * 365) / games
+
+    for batch_start in range(0, games, BATCH_SIZE):
+        with db.atomic():
+            batch = []
+            for n in range(batch_start, min(batch_start + BATCH_SIZE, games)):
+                guild_id = rng.choices(guild_ids, guild_weights)[0]
+                shape = rng.choices(shapes, weights)[0]
+                roll = rng.random()
+                status = 'pending' if roll < .02 else 'incomplete' if roll < .05 else 'complete'
+                completed_ts = first_ts + step * n
+                sides = [rng.sample(players_by_guild[guild_id], sum(shape))]
+                sides = [sides[0][sum(shape[:i]):sum(shape[:i + 1])] for i in range(len(shape))]
+                if status == 'pending':
+                    # open game waiting for players - the host's side is full, the others partly filled
+                    sides = sides[:1] + [side[:rng.randint(0, len(side))] for side in sides[1:]]
+                batch.append((guild_id, shape, status, completed_ts, sides))
+
+            new_squads = {}  # frozenset of player ids: guild id, for allied players who have not played together yet
+            for guild_id, _, _, _, sides in batch:
+                for side in sides:
+                    if len(side) > 1 and frozenset(side) not in squads:
+                        new_squads[frozenset(side)] = guild_id
+            squad_ids = insert_returning_ids(Squad, [{'guild_id': guild_id} for guild_id in new_squads.values()])
+            squads.update(zip(new_squads, squad_ids))
+            if new_squads:
+                SquadMember.insert_many([{'squad': squad_id, 'player': player_id} for key, squad_id in zip(new_squads, squad_ids) for player_id in key]).execute()
+
+            game_ids = insert_returning_ids(Game, [{
+                'name': ' '.join(rng.sample(NAME_WORDS, 3)), 'guild_id': guild_id, 'size': shape, 'date': completed_ts.date(),
+                'is_ranked': rng.random() < .97, 'is_mobile': rng.random() < .8,
+                'is_pending': status == 'pending', 'is_completed': False, 'is_confirmed': False,
+                'completed_ts': completed_ts if status == 'complete' else None,
+                'expiration': completed_ts + datetime.timedelta(days=30) if status == 'pending' else None
+            } for guild_id, shape, status, completed_ts, sides in batch])
+
+            side_rows, side_players = [], []
+            for game_id, (guild_id, shape, status, completed_ts, sides) in zip(game_ids, batch):
+                for position, (size, side) in enumerate(zip(shape, sides), start=1):
+                    side_rows.append({'game': game_id, 'size': size, 'position': position,
+                                      'squad': squads.get(frozenset(side)) if len(side) > 1 else None,
+                                      'team': rng.choice(team_ids[guild_id]) if size > 1 else None})
+                    side_players.append(side)
+            side_ids = insert_returning_ids(GameSide, side_rows)
+            Lineup.insert_many([{'game': side_row['game'], 'gameside': side_id, 'player': player_id}
+                                for side_row, side_id, side in zip(side_rows, side_ids, side_players) for player_id in side]).execute()
+
+            # Winner is the side with the highest hidden skill plus noise. recalculate_all_elo() picks these games up
+            # because they are ranked, have a winner and completed_ts, and are not yet marked completed
+            winners, side_index = [], 0
+            for game_id, (guild_id, shape, status, completed_ts, sides) in zip(game_ids, batch):
+                ids = side_ids[side_index:side_index + len(sides)]
+                side_index += len(sides)
+                if status == 'complete':
+                    strength = [statistics.mean(skill[p] for p in side) + rng.gauss(0, 250) for side in sides]
+                    winners.append(Game(id=game_id, winner=ids[strength.index(max(strength))]))
+            Game.bulk_update(winners, fields=['winner'], batch_size=500)
+        if batch_start % (BATCH_SIZE * 25) == 0:
+            print(f'Inserted {batch_start + len(batch)} of {games} games ({datetime.datetime.now() - start})')
+
+    print(f'Indexed {Game.backfill_search_vectors()} game names for search')
+    print('Replaying ELO over the generated history')
+    recalculation.recalculate_all_elo()
+    recalculation.check_game_counts(rebuild=True)
+    print(f'Generation complete - took {datetime.datetime.now() - start}')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic data for the benchmarks. Only runs against a database named *bench* or *test*.')
+    parser.add_argument('--members', type=int, default=100000)
+    parser.add_argument('--games', type=int, default=500000)
+    parser.add_argument('--guilds', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    check_database()
+    db.connect(reuse_if_open=True)
+    if Game.select().count():
+        sys.exit('Database already has games - generate expects an empty database.')
+    generate(members=args.members, games=args.games, guilds=args.guilds, seed=args.seed)
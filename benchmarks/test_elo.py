@@ -0,0 +1,23 @@
+# ELO write paths. Each round runs in a transaction that is rolled back, so every round starts from the generated ratings
+from modules.models import Game
+
+
+def test_declare_winner(benchmark, rolled_back, open_games):
+    def declare_winner():
+        game, side = next(open_games)
+        full_game = Game.load_full_game(game.id)
+        full_game.declare_winner(winning_side=side, confirm=True)
+        return full_game
+
+    game = benchmark(rolled_back(declare_winner))
+    assert game.is_confirmed
+
+
+def test_recalculate_elo_since(benchmark, rolled_back, recent_games):
+    # As $unwin does it - scoped to the game's guild and to the ratings the game reaches
+    def recalculate_elo_since():
+        game = next(recent_games)
+        return Game.recalculate_elo_since(timestamp=game.completed_ts, seed=game.influence_seed(), guild_id=game.guild_id)
+
+    replayed, naive_count = benchmark(rolled_back(recalculate_elo_since))
+    assert 0 < replayed <= naive_count
@@ -0,0 +1,41 @@
+# Leaderboards, rank lookups and the $player card
+import settings
+from modules import player_card, rating_index
+from modules.models import leaderboard_rows, DiscordMember, LeaderboardSnapshot, Player
+
+
+def test_player_leaderboard(benchmark, guild_id):
+    assert benchmark(lambda: list(Player.leaderboard(date_cutoff=settings.date_cutoff, guild_id=guild_id).tuples()))
+
+
+def test_discordmember_leaderboard(benchmark):
+    assert benchmark(lambda: list(DiscordMember.leaderboard(date_cutoff=settings.date_cutoff).tuples()))
+
+
+def test_player_leaderboard_rows(benchmark, guild_id):
+    assert benchmark(lambda: leaderboard_rows(Player.leaderboard(date_cutoff=settings.date_cutoff, guild_id=guild_id), Player.record_counts(guild_id=guild_id)))
+
+
+def test_discordmember_leaderboard_rows(benchmark):
+    assert benchmark(lambda: leaderboard_rows(DiscordMember.leaderboard(date_cutoff=settings.date_cutoff), DiscordMember.record_counts()))
+
+
+def test_leaderboard_snapshot_write(benchmark, rolled_back):
+    benchmark(rolled_back(LeaderboardSnapshot.write))
+
+
+def test_player_leaderboard_rank(benchmark, players):
+    benchmark(lambda: next(players).leaderboard_rank(settings.date_cutoff))
+
+
+def test_discordmember_leaderboard_rank(benchmark, members):
+    benchmark(lambda: next(members).leaderboard_rank(settings.date_cutoff))
+
+
+def test_rating_index_rank(benchmark, guild_id, players):
+    benchmark(lambda: rating_index.rank(guild_id, next(players).id))
+
+
+def test_player_card(benchmark, players):
+    # The queries behind the $player card, minus rendering
+    benchmark(lambda: player_card.PlayerCardStats(next(players)).build())
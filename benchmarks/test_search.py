@@ -0,0 +1,32 @@
+# Game search. title_match_* count matches over the whole table with the search_vector index and with the lookahead regex
+# that Game.search() used before it (which scans every row), for the same words
+from modules.models import Game
+
+
+def title_match_count(word: str, regex: bool):
+    if regex:
+        search_regexp = f'^(?=.*{word}).+'
+        condition = Game.notes.iregexp(search_regexp) | Game.name.iregexp(search_regexp)
+    else:
+        condition = Game.search_vector.match(f'{word}:*', language=Game.SEARCH_CONFIG)
+    return Game.select(Game.id).where(condition).count()
+
+
+def test_game_search_title(benchmark, guild_id, words):
+    benchmark(lambda: list(Game.search(title_filter=[next(words)], guild_id=guild_id).limit(500)))
+
+
+def test_title_match_fulltext(benchmark, words):
+    benchmark(lambda: title_match_count(next(words), regex=False))
+
+
+def test_title_match_regex(benchmark, words):
+    benchmark(lambda: title_match_count(next(words), regex=True))
+
+
+def test_game_search_player(benchmark, players):
+    benchmark(lambda: list(Game.search(player_filter=[next(players)], status_filter=1)))
+
+
+def test_search_pending(benchmark, guild_id):
+    benchmark(lambda: list(Game.search_pending(guild_id=guild_id)))
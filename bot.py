@@ -12,7 +12,7 @@
 
 import settings
 import modules.exceptions as exceptions
-from modules import initialize_data, models, utilities
+from modules import initialize_data, leaderboard_cache, models, rating_index, recalculation, tuning, utilities
 
 
 # Logger config is a bit of a mess and probably could be simplified a lot, but works. debug and above sent to file / error above sent to stderr
@@ -63,6 +63,13 @@ def main(args: List[str] = None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--add_default_data', action='store_true')
     parser.add_argument('--recalc_elo', action='store_true')
+    parser.add_argument('--recalc_elo_legacy', action='store_true')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for --recalc_elo and --tune_elo')
+    parser.add_argument('--recalc_elo_check', action='store_true')
+    parser.add_argument('--check_game_counts', action='store_true')
+    parser.add_argument('--rebuild_game_counts', action='store_true')
+    parser.add_argument('--tune_elo', action='store_true')
+    parser.add_argument('--burn_in', type=int, default=0, help='number of games to replay before --tune_elo starts scoring predictions')
     parser.add_argument('--game_export', action='store_true')
     parser.add_argument('--skip_tasks', action='store_true')
     # Ignore extra args from uvicorn.
@@ -73,10 +80,48 @@ def main(args: List[str] = None):
     if args.recalc_elo:
         print('Recalculating all ELO')
         start = timer()
+        if args.workers > 1:
+            timings = recalculation.parallel_recalculate_all_elo(workers=args.workers)
+            for label, game_count, seconds in sorted(timings, key=lambda t: t[2], reverse=True):
+                print(f'{label}: {game_count} games in {seconds:.2f} seconds')
+        else:
+            recalculation.recalculate_all_elo()
+        end = timer()
+        print(f'Recalculation complete - took {end - start} seconds.')
+        exit(0)
+    if args.recalc_elo_legacy:
+        print('Recalculating all ELO one game at a time')
+        start = timer()
         models.Game.recalculate_all_elo()
         end = timer()
         print(f'Recalculation complete - took {end - start} seconds.')
         exit(0)
+    if args.recalc_elo_check:
+        print('Comparing in-memory ELO recalculation against the legacy recalculation (no changes will be saved)')
+        start = timer()
+        mismatches = recalculation.parity_check()
+        for mismatch in mismatches[:50]:
+            print(mismatch)
+        print(f'Parity check complete - {len(mismatches)} mismatches - took {timer() - start} seconds.')
+        exit(1 if mismatches else 0)
+    if args.check_game_counts or args.rebuild_game_counts:
+        print('Checking maintained ranked game counts against game history')
+        mismatches = recalculation.check_game_counts(rebuild=args.rebuild_game_counts)
+        for mismatch in mismatches[:50]:
+            print(mismatch)
+        print(f'{len(mismatches)} mismatched records{" rebuilt" if args.rebuild_game_counts else ""}.')
+        exit(0)
+    if args.tune_elo:
+        print('Scoring ELO parameter sets against game history (no changes will be saved)')
+        start = timer()
+        results = tuning.tune(workers=max(args.workers, 1), burn_in=args.burn_in)
+        for result in results:
+            baseline = ' (current)' if result['params'] == tuning.elo.DEFAULT_PARAMS else ''
+            log_loss = 'n/a' if result['log_loss'] is None else f'{result["log_loss"]:.5f}'
+            brier = 'n/a' if result['brier'] is None else f'{result["brier"]:.5f}'
+            print(f'log loss {log_loss}  brier {brier}  {result["params"]}{baseline}')
+        print(f'Tuning complete - {len(results)} parameter sets over {results[0]["games"]} games - took {timer() - start} seconds.')
+        exit(0)
     if args.game_export:
         print('Exporting game data to file')
         start = timer()
@@ -101,6 +146,10 @@ def main(args: List[str] = None):
             )
             logger.info(f'{query.execute()} polytopia IDs are banned')
 
+        # banned members are left off leaderboards
+        models.db.on_commit(lambda: leaderboard_cache.invalidate(reason='Discord ID ban list reset'))
+        models.db.on_commit(rating_index.invalidate)
+
 
 def get_prefix(bot, message):
     # Guild-specific command prefixes
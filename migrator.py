@@ -4,6 +4,7 @@
 import logging
 from logging.handlers import RotatingFileHandler
 import modules.models as models
+from modules import recalculation
 
 # http://docs.peewee-orm.com/en/latest/peewee/playhouse.html#schema-migrations
 handler = RotatingFileHandler(filename='discord.log', encoding='utf-8', maxBytes=500 * 1024, backupCount=1)
@@ -70,14 +71,25 @@
 # elo_after_game_alltime = SmallIntegerField(default=None, null=True)  # snapshot of what local alltime elo was after game concluded
 # elo_after_game_global_alltime = SmallIntegerField(default=None, null=True)
 
-elo_moonrise = SmallIntegerField(default=1000)
-elo_max_moonrise = SmallIntegerField(default=1000)
+# elo_moonrise = SmallIntegerField(default=1000)
+# elo_max_moonrise = SmallIntegerField(default=1000)
 
-elo_change_player_moonrise = SmallIntegerField(default=0)
-elo_change_discordmember_moonrise = SmallIntegerField(default=0)
+# elo_change_player_moonrise = SmallIntegerField(default=0)
+# elo_change_discordmember_moonrise = SmallIntegerField(default=0)
 
-elo_after_game_moonrise = SmallIntegerField(default=None, null=True)
-elo_after_game_global_moonrise = SmallIntegerField(default=None, null=True)
+# elo_after_game_moonrise = SmallIntegerField(default=None, null=True)
+# elo_after_game_global_moonrise = SmallIntegerField(default=None, null=True)
+
+# ranked_game_count = IntegerField(default=0)  # x2
+# ranked_game_count_moonrise = IntegerField(default=0)  # x2
+
+# rating_version = IntegerField(default=0)
+
+# season = SmallIntegerField(null=True, default=None)
+# league = TextField(null=True, default=None)
+# is_postseason = BooleanField(default=False)
+
+search_vector = TSVectorField(null=True, index=False)  # GIN index added below
 
 
 migrate(
@@ -104,26 +116,62 @@
     # migrator.drop_column('gamelog', 'game_id'),
     # migrator.alter_column_type('gamelog', 'game_id', ForeignKeyField(Game))
     # migrator.drop_constraint('gamelog', 'gamelog_game_id_fkey')
-    migrator.add_column('discordmember', 'elo_moonrise', elo_moonrise),
-    migrator.add_column('player', 'elo_moonrise', elo_moonrise),
+    # migrator.add_column('discordmember', 'elo_moonrise', elo_moonrise),
+    # migrator.add_column('player', 'elo_moonrise', elo_moonrise),
+
+    # migrator.add_column('discordmember', 'elo_max_moonrise', elo_max_moonrise),
+    # migrator.add_column('player', 'elo_max_moonrise', elo_max_moonrise),
+
+    # migrator.add_column('lineup', 'elo_change_player_moonrise', elo_change_player_moonrise),
+    # migrator.add_column('lineup', 'elo_change_discordmember_moonrise', elo_change_discordmember_moonrise),
+    # migrator.add_column('lineup', 'elo_after_game_moonrise', elo_after_game_moonrise),
+    # migrator.add_column('lineup', 'elo_after_game_global_moonrise', elo_after_game_global_moonrise),
+
+    # migrator.add_column('player', 'ranked_game_count', ranked_game_count),
+    # migrator.add_column('player', 'ranked_game_count_moonrise', ranked_game_count_moonrise),
+    # migrator.add_column('discordmember', 'ranked_game_count', ranked_game_count),
+    # migrator.add_column('discordmember', 'ranked_game_count_moonrise', ranked_game_count_moonrise),
+
+    # migrator.add_index('squad', ('guild_id', 'elo'), False),
 
-    migrator.add_column('discordmember', 'elo_max_moonrise', elo_max_moonrise),
-    migrator.add_column('player', 'elo_max_moonrise', elo_max_moonrise),
+    # migrator.add_column('discordmember', 'rating_version', rating_version),
 
-    migrator.add_column('lineup', 'elo_change_player_moonrise', elo_change_player_moonrise),
-    migrator.add_column('lineup', 'elo_change_discordmember_moonrise', elo_change_discordmember_moonrise),
-    migrator.add_column('lineup', 'elo_after_game_moonrise', elo_after_game_moonrise),
-    migrator.add_column('lineup', 'elo_after_game_global_moonrise', elo_after_game_global_moonrise),
+    # migrator.add_column('game', 'season', season),
+    # migrator.add_column('game', 'league', league),
+    # migrator.add_column('game', 'is_postseason', is_postseason),
+    # migrator.add_index('game', ('season', 'league', 'is_postseason'), False),
 
+    migrator.add_column('game', 'search_vector', search_vector),
+    migrator.add_index('game', ('search_vector',), False, using='GIN'),
 )
 models.db.connect(reuse_if_open=True)
 
-bot_members = models.DiscordMember.select().where(
-    models.DiscordMember.discord_id.in_([settings.bot_id, settings.bot_id_beta])
-)
-bot_update1 = models.Player.update(elo=0, elo_max=0, elo_alltime=0, elo_max_alltime=0, elo_moonrise=0, elo_max_moonrise=0).where(models.Player.discord_member_id.in_(bot_members))
-bot_update2 = models.DiscordMember.update(elo=0, elo_max=0, elo_alltime=0, elo_max_alltime=0, elo_moonrise=0, elo_max_moonrise=0).where(models.DiscordMember.id.in_(bot_members))
-print(f'Updating {bot_update1.execute()} bot Player records with 0 elo and {bot_update2.execute()} bot DiscordMember records with 0 elo.')
+# bot_members = models.DiscordMember.select().where(
+#     models.DiscordMember.discord_id.in_([settings.bot_id, settings.bot_id_beta])
+# )
+# bot_update1 = models.Player.update(elo=0, elo_max=0, elo_alltime=0, elo_max_alltime=0, elo_moonrise=0, elo_max_moonrise=0).where(models.Player.discord_member_id.in_(bot_members))
+# bot_update2 = models.DiscordMember.update(elo=0, elo_max=0, elo_alltime=0, elo_max_alltime=0, elo_moonrise=0, elo_max_moonrise=0).where(models.DiscordMember.id.in_(bot_members))
+# print(f'Updating {bot_update1.execute()} bot Player records with 0 elo and {bot_update2.execute()} bot DiscordMember records with 0 elo.')
+
+# print(f'Populated ranked game counts for {len(recalculation.check_game_counts(rebuild=True))} records')
+
+# elo_event table is created by models.py, and backfilled there from the Lineup/GameSide change columns if it is empty - to rebuild it:
+# print(f'Inserted {models.EloEvent.rebuild()} elo_event records')
+
+# squad_stats table is created by models.py, and backfilled there if it is empty - to rebuild every squad's row:
+# print(f'Populated squad_stats for {models.SquadStats.refresh()} squads')
+
+# member_stats table is created by models.py - backfill it (or use the rebuild_member_stats command)
+# print(f'Populated member_stats for {models.MemberStats.rebuild()} members')
+
+# season tag columns on game - backfill them from the names of existing games
+# print(f'Tagged {models.Game.backfill_season_tags()} season games')
+
+# tribe_usage table is created by models.py - backfill it from lineups (or use the rebuild_member_stats command)
+# print(f'Populated {models.TribeUsage.rebuild()} tribe_usage counters')
+
+# search_vector column on game - backfill it from the names and notes of existing games
+print(f'Indexed names and notes of {models.Game.backfill_search_vectors()} games for search')
 
 # query = models.DiscordMember.update(elo_alltime=models.DiscordMember.elo, elo_max_alltime=models.DiscordMember.elo_max)
 # print(f'models.DiscordMember.elo {query.execute()}')
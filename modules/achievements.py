@@ -4,8 +4,8 @@
 # import asyncio
 import modules.models as models
 import settings
-import peewee
 import modules.utilities as utilities
+import modules.rating_index as rating_index
 logger = logging.getLogger('polybot.' + __name__)
 
 
@@ -19,9 +19,11 @@
 async def set_champion_role():
 
     # global_champion = models.DiscordMember.select().order_by(-models.DiscordMember.elo).limit(1).get()
-    global_champion = models.DiscordMember.leaderboard(date_cutoff=settings.date_cutoff, guild_id=None, max_flag=False).limit(1).get()
-    if global_champion.elo_field == 1000:
+    global_top = rating_index.top(guild_id=None)
+    if not global_top or global_top[0][1] == 1000:
         global_champion = None
+    else:
+        global_champion = models.DiscordMember.get_by_id(global_top[0][0])
 
     for guild in settings.bot.guilds:
         log_message = ''
@@ -32,9 +34,10 @@ async def set_champion_role():
             continue
 
         # local_champion = models.Player.select().where(models.Player.guild_id == guild.id).order_by(-models.Player.elo).limit(1).get()
-        local_champion = models.Player.leaderboard(date_cutoff=settings.date_cutoff, guild_id=guild.id, max_flag=False).limit(1).get()
-        if local_champion.elo_field == 1000:
+        local_top = rating_index.top(guild_id=guild.id)
+        if not local_top or local_top[0][1] == 1000:
             continue
+        local_champion = models.Player.select(models.Player, models.DiscordMember).join(models.DiscordMember).where(models.Player.id == local_top[0][0]).get()
 
         local_champion_member = guild.get_member(local_champion.discord_member.discord_id)
         global_champion_member = guild.get_member(global_champion.discord_id) if global_champion else None
@@ -159,9 +162,6 @@ async def set_experience_role(discord_member):
         else:
             logger.debug('No achievement roles to change')
 
-        max_local_elo = models.Player.select(peewee.fn.Max(models.Player.elo_moonrise)).where(models.Player.guild_id == guild.id).scalar()
-        max_global_elo = models.DiscordMember.select(peewee.fn.Max(models.DiscordMember.elo_moonrise)).scalar()
-
-        if discord_member.elo_moonrise >= max_global_elo or guildmember.elo_moonrise >= max_local_elo:
+        if rating_index.rank(guild.id, guildmember.id)[0] == 1 or rating_index.rank(None, discord_member.id)[0] == 1:
             # This player has #1 spot in either local OR global leaderboard. Apply ELO Champion role on any server where the player is:
             await set_champion_role()
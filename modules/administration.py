@@ -11,6 +11,9 @@
 import re
 from modules.games import PolyGame, post_win_messaging
 import modules.achievements as achievements
+import modules.recalculation as recalculation
+import modules.leaderboard_cache as leaderboard_cache
+import modules.player_card as player_card
 
 logger = logging.getLogger('polybot.' + __name__)
 elo_logger = logging.getLogger('polybot.elo')
@@ -22,6 +25,8 @@ def __init__(self, bot):
         if settings.run_tasks:
             self.bg_task = bot.loop.create_task(self.task_confirm_auto())
             self.bg_task2 = bot.loop.create_task(self.task_purge_incomplete())
+            self.bg_task3 = bot.loop.create_task(self.task_rating_checkpoint())
+            self.bg_task4 = bot.loop.create_task(self.task_leaderboard_snapshot())
 
     async def cog_check(self, ctx):
 
@@ -286,6 +291,45 @@ async def task_confirm_auto(self):
 
             await asyncio.sleep(sleep_cycle)
 
+    async def task_rating_checkpoint(self):
+        await self.bot.wait_until_ready()
+        sleep_cycle = (60 * 60 * 24)  # daily cycle
+
+        while not self.bot.is_closed():
+            await asyncio.sleep(30)
+            logger.debug('Task running: task_rating_checkpoint')
+
+            if settings.recalculation_mode:
+                logger.debug('Skipping task_rating_checkpoint since settings.recalculation_mode is set to True.')
+            else:
+                def async_checkpoint():
+                    utilities.connect()
+                    recalculation.create_checkpoint()
+                    recalculation.prune_checkpoints()
+
+                await self.bot.loop.run_in_executor(None, async_checkpoint)
+
+            await asyncio.sleep(sleep_cycle)
+
+    async def task_leaderboard_snapshot(self):
+        await self.bot.wait_until_ready()
+        sleep_cycle = (60 * 60 * 24)  # daily cycle
+
+        while not self.bot.is_closed():
+            await asyncio.sleep(60)
+            logger.debug('Task running: task_leaderboard_snapshot')
+
+            if settings.recalculation_mode:
+                logger.debug('Skipping task_leaderboard_snapshot since settings.recalculation_mode is set to True.')
+            else:
+                def async_snapshot():
+                    utilities.connect()
+                    models.LeaderboardSnapshot.write()
+
+                await self.bot.loop.run_in_executor(None, async_snapshot)
+
+            await asyncio.sleep(sleep_cycle)
+
     async def task_purge_incomplete(self):
         await self.bot.wait_until_ready()
         sleep_cycle = (60 * 60 * 2)  # 2 hour cycle
@@ -448,6 +492,7 @@ async def unstart(self, ctx, game: PolyGame = None):
         tomorrow = (datetime.datetime.now() + datetime.timedelta(hours=24))
         game.expiration = tomorrow if game.expiration < tomorrow else game.expiration
         game.save()
+        game.bump_rating_versions()
         models.GameLog.write(game_id=game, guild_id=ctx.guild.id, message=f'{models.GameLog.member_string(ctx.author)} changed in-progress game to an open game. (`{ctx.prefix}unstart`)')
 
         await ctx.send(f'Game {game.id} is now an open game and no longer in progress.\nNotifying players: {" ".join(game.mentions())}')
@@ -902,16 +947,35 @@ async def boost_from(self, ctx, p_string: str):
 
         await ctx.send(f'Marking **{dm.name}** as a booster and successfully applied the role across {counter} server(s).')
 
+    @commands.command(aliases=['lbcache'])
+    async def cachestats(self, ctx, *, arg: str = None):
+        """ *Staff*: Show leaderboard and player card cache statistics
+        Hits are leaderboards or player cards served without rebuilding them.
+         **Examples**
+        `[p]cachestats` - Show hit/miss counters
+        `[p]cachestats clear` - Drop every cached leaderboard
+        """
+
+        if arg and arg.upper() == 'CLEAR':
+            leaderboard_cache.invalidate(reason=f'cleared by {ctx.author}')
+            return await ctx.send(f'Leaderboard cache cleared. {leaderboard_cache.summary()}')
+        await ctx.send(f'Leaderboard cache: {leaderboard_cache.summary()}\nPlayer card cache: {player_card.summary()}')
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def recalc_games_from(self, ctx, *, arg: str = None):
         """*Owner*: Recalculate games from a specific timestamp
 
         Give a game ID, and the bot will *recalculate_elo_since* all games completed after that game was completed.
+        Only games whose ELO can be affected by that game are replayed. Add `all` to replay every game since then.
+        **Examples**
+        `[p]recalc_games_from 12345`
+        `[p]recalc_games_from 12345 all`
         """
 
         import functools
-        game = models.Game.get_or_none(id=arg)
+        args = arg.split() if arg else []
+        game = models.Game.get_or_none(id=args[0]) if args and args[0].isdigit() else None
         if not game:
             return await ctx.send(f'no game found for id {arg}')
 
@@ -919,13 +983,42 @@ async def recalc_games_from(self, ctx, *, arg: str = None):
         if not game.completed_ts:
             return await ctx.send(f'Game {game.id} is not completed. Choose a completed game.')
 
+        seed = None if 'all' in args[1:] else game.influence_seed()
         await ctx.send('This may take a while...')
         settings.recalculation_mode = True
         async with ctx.typing():
-            await self.bot.loop.run_in_executor(None, functools.partial(models.Game.recalculate_elo_since, timestamp=game.completed_ts))
-            # Allows bot to remain responsive while this large operation is running.
-            await ctx.send(f'DB has been refreshed from {game.completed_ts} onward')
-            settings.recalculation_mode = False
+            try:
+                replayed, naive_count = await self.bot.loop.run_in_executor(None, functools.partial(models.Game.recalculate_elo_since, timestamp=game.completed_ts, seed=seed, guild_id=None if seed is None else game.guild_id))
+                # Allows bot to remain responsive while this large operation is running.
+            finally:
+                settings.recalculation_mode = False
+            await ctx.send(f'DB has been refreshed from {game.completed_ts} onward. Replayed {replayed} of the {naive_count} games a full recalculation would have replayed.')
+
+    @commands.command(hidden=True, aliases=['backfillstats'])
+    @commands.is_owner()
+    async def rebuild_member_stats(self, ctx, *, arg: str = None):
+        """*Owner*: Rebuild the streak, matchup and favorite tribe stats shown on player cards
+        These are normally kept up to date as games are confirmed, reversed and deleted, and as tribes are set. Rebuilds every member, or one member if given.
+        **Examples**
+        `[p]rebuild_member_stats` - Backfill every member
+        `[p]rebuild_member_stats @Nelluk`
+        """
+
+        member_ids = None
+        if arg:
+            discord_member = models.DiscordMember.get_or_none(discord_id=utilities.string_to_user_id(arg))
+            if not discord_member:
+                return await ctx.send(f'Could not find a DiscordMember in the database matching *{arg}*')
+            member_ids = [discord_member.id]
+
+        def rebuild():
+            utilities.connect()
+            models.TribeUsage.rebuild(member_ids)
+            return models.MemberStats.rebuild(member_ids)
+
+        async with ctx.typing():
+            count = await self.bot.loop.run_in_executor(None, rebuild)
+        await ctx.send(f'Rebuilt player card stats for {count} members.')
 
     @commands.command(aliases=['migrate'])
     @commands.is_owner()
@@ -976,6 +1069,7 @@ async def migrate_player(self, ctx, from_string: str, to_string: str):
                         gm.save()
 
                 new_discord_member.delete_instance()
+                models.TribeUsage.rebuild([old_discord_member.id])  # the moved games' tribes were counted for the deleted account
 
                 # set old account with new discord ID and refresh name
                 old_discord_member.discord_id = new_guild_member.id
@@ -11,6 +11,7 @@
 
 import pydantic
 
+from . import elo
 from .models import ApiApplication, DiscordMember, Game
 
 
@@ -33,6 +34,21 @@ class NewGame(pydantic.BaseModel):
     sides_discord_ids: List[List[int]]
 
 
+class SimulatedPlayer(pydantic.BaseModel):
+    """A player's current rating and completed ranked game count."""
+
+    elo: int
+    game_count: int = 0
+
+
+class Simulation(pydantic.BaseModel):
+    """A hypothetical game to calculate ELO changes for."""
+
+    sides: List[List[SimulatedPlayer]]
+    calc_version: int = 2
+    host_bonus: bool = True
+
+
 async def get_discord_member(guild_id: int, user_id: int) -> discord.Member:
     """Get a member from the cache if possible, else fetch."""
     guild = client.get_guild(guild_id)
@@ -135,3 +151,37 @@ async def new_game(
         db_game.notes = game.notes
         db_game.save()
     return {'game_id': db_game.id}
+
+
+@server.post('/simulate')
+async def simulate(
+        simulation: Simulation, scopes: List[str] = Depends(get_scopes)) -> dict:
+    """Calculate ELO changes for each possible winner of a game.
+
+    Pure calculation on the given ratings, no game data is read or written.
+    outcomes[w][s][p] is the change for player p on side s if side w wins.
+    """
+    if 'games:read' not in scopes:
+        raise HTTPException(
+            status_code=403, detail='Not authorised for scope games:read.'
+        )
+    if len(simulation.sides) < 2 or not all(simulation.sides):
+        raise HTTPException(
+            status_code=400,
+            detail='At least two sides with one or more players required.'
+        )
+    if simulation.calc_version not in (1, 2):
+        raise HTTPException(
+            status_code=400, detail='calc_version must be 1 or 2.'
+        )
+    side_sizes = [len(side) for side in simulation.sides]
+    bonus = elo.host_bonus(
+        simulation.calc_version, side_sizes
+    ) if simulation.host_bonus else 0
+    chances, outcomes = elo.simulate_outcomes(
+        [[player.elo for player in side] for side in simulation.sides],
+        [[player.game_count for player in side] for side in simulation.sides],
+        version=simulation.calc_version,
+        bonus=bonus
+    )
+    return {'win_chances': chances, 'outcomes': outcomes}
@@ -0,0 +1,131 @@
+"""Pure ELO arithmetic - ratings and game counts in, win chances and deltas out. Nothing here touches the database.
+
+Game.declare_winner() (through Game.get_side_win_chances(), GameSide.adjusted_elo() and the change_elo_after_game() methods),
+the in-memory replay in modules.recalculation and the what-if simulator all use these functions, so they always agree.
+"""
+from collections import namedtuple
+
+import settings
+
+# Tunable constants of the rating system, see modules.tuning. DEFAULT_PARAMS are the values in use
+EloParams = namedtuple('EloParams', ['k_factors', 'k_thresholds', 'boost', 'boost_floor', 'boost_ceiling',
+                                     'handicap_v1', 'handicap_v2', 'host_bonus'])
+DEFAULT_PARAMS = EloParams(k_factors=(75, 50, 32), k_thresholds=(6, 11), boost=.60, boost_floor=900, boost_ceiling=1200,
+                           handicap_v1=200, handicap_v2=100, host_bonus=50)
+
+
+def calc_version(game_date):
+    # Games starting 8/2/20 use a smaller handicap for uneven sides and a host advantage for solo hosts
+    return 2 if game_date >= settings.elo_calc_v2_date else 1
+
+
+def host_bonus(version: int, side_sizes, params: EloParams = DEFAULT_PARAMS):
+    # For a solo host game (1v1, 1v3, etc), give the host an extra 50 phantom ELO for an assumed host advantage
+    # which will make their calculated chance of winning higher, thus ELO prize lower. Not applied to team or squad ELO.
+    return params.host_bonus if version == 2 and side_sizes[0] == 1 else 0
+
+
+def calc_win_chance(my_side_elo: int, opponent_elo: int):
+    return round(1 / (1 + (10 ** ((opponent_elo - my_side_elo) / 400.0))), 3)
+
+
+def side_average(elos):
+    return int(round(sum(elos) / len(elos)))
+
+
+def adjusted_elo(size: int, missing_players: int, own_elo: int, opponent_elos: int, version: int = 1, params: EloParams = DEFAULT_PARAMS):
+    # If teams have imbalanced size, adjust win% based on a
+    # function of the team's elos involved, e.g.
+    # 1v2  [1400] vs [1100, 1100] adjusts to represent 50% win
+    # (compared to 58.8% for 1v1v1 for the 1400 player)
+
+    if version == 1:
+        handicap = params.handicap_v1  # 200, the elo difference for a 50% 1v2 chance
+        # with a 200 handicap the calc will give you a pretend player with 200 less elo as a partner to balance out the team
+        # ie in a [1200] vs [1000, 1000] it will give the first side a fake 1000 elo player - 50% chance of 1200 player winning
+        # that scenario.
+    else:
+        handicap = params.handicap_v2
+        # changed handicap to 100 8/1/2020, indicating that unbalanced games are easier for the smaller side than previous assumed.
+        # ie a [1200] vs [1000, 1000] game should be more like 60% chance to win for the host, not 50%
+    handicap_elo = handicap * 2 + max(own_elo - opponent_elos - handicap, 0)
+
+    # "fill up" missing players with placeholder handicapped elos
+    missing_player_elo = own_elo - handicap_elo
+    return int(round((own_elo * size + missing_player_elo * missing_players) / (size + missing_players)))
+
+
+def side_win_chances(largest_team: int, side_sizes, side_elos, version: int = 1, params: EloParams = DEFAULT_PARAMS):
+    n = len(side_sizes)
+
+    # Adjust team elos when the amount of players on each team
+    # is imbalanced, e.g. 1v2. It changes nothing when sizes are equal
+    sum_raw_elo = sum(side_elos)
+    adjusted_side_elo = []
+    for size, side_elo in zip(side_sizes, side_elos):
+        avg_opponent_elos = int(round((sum_raw_elo - side_elo) / (n - 1)))
+        adjusted_side_elo.append(adjusted_elo(size, largest_team - size, side_elo, avg_opponent_elos, version, params))
+
+    # Compute proper win chances when there are more than 2 teams,
+    # e.g. 2v2v2. It changes nothing when there are only 2 teams
+    max_elo = max(adjusted_side_elo)
+    second_elo = sorted(adjusted_side_elo)[-2]
+    win_chance_unnorm = [calc_win_chance(own_elo, second_elo if own_elo == max_elo else max_elo) for own_elo in adjusted_side_elo]
+    normalization_factor = sum(win_chance_unnorm)
+
+    return [round(win_chance / normalization_factor, 3) for win_chance in win_chance_unnorm]
+
+
+def player_elo_delta(current_elo: int, num_games: int, chance_of_winning: float, is_winner: bool, params: EloParams = DEFAULT_PARAMS):
+    # num_games is the player's count of completed ranked games before this one, which picks the K-factor
+    max_elo_delta = params.k_factors[2]
+
+    if num_games < params.k_thresholds[0]:
+        max_elo_delta = params.k_factors[0]
+    elif num_games < params.k_thresholds[1]:
+        max_elo_delta = params.k_factors[1]
+
+    if is_winner is True:
+        elo_delta = int(round((max_elo_delta * (1 - chance_of_winning)), 0))
+    else:
+        elo_delta = int(round((max_elo_delta * (0 - chance_of_winning)), 0))
+
+    floor, ceiling = params.boost_floor, params.boost_ceiling
+    elo_boost = params.boost * ((ceiling - max(min(current_elo, ceiling), floor)) / (ceiling - floor))  # 60% boost to delta at elo 900, gradually shifts to 0% boost at 1200 ELO
+
+    elo_bonus = int(abs(elo_delta) * elo_boost)
+    return elo_delta + elo_bonus
+
+
+def team_elo_delta(chance_of_winning: float, is_winner: bool, max_elo_delta: int = 32):
+    # Teams use a fixed K of 32. Squads use 50 for their first 6 games, then 32
+    if is_winner is True:
+        return int(round((max_elo_delta * (1 - chance_of_winning)), 0))
+    return int(round((max_elo_delta * (0 - chance_of_winning)), 0))
+
+
+def simulate_outcomes(side_elos, side_game_counts, largest_team: int = None, version: int = 2, bonus: int = 0, params: EloParams = DEFAULT_PARAMS):
+    # side_elos and side_game_counts hold one list per side, with each player's rating and completed ranked game count.
+    # Returns (win_chances, outcomes) where outcomes[w][s][p] is the ELO change of player p on side s if side w wins.
+    # Win chances do not depend on the winner, so every outcome costs only two deltas per player.
+    side_sizes = [len(side) for side in side_elos]
+    averages = [side_average(side) for side in side_elos]
+    averages[0] += bonus
+    chances = side_win_chances(largest_team or max(side_sizes), side_sizes, averages, version, params)
+
+    if_win, if_lose = [], []
+    for chance, elos, counts in zip(chances, side_elos, side_game_counts):
+        if_win.append([player_elo_delta(current_elo, num_games, chance, True, params) for current_elo, num_games in zip(elos, counts)])
+        if_lose.append([player_elo_delta(current_elo, num_games, chance, False, params) for current_elo, num_games in zip(elos, counts)])
+
+    outcomes = [[if_win[s] if s == w else if_lose[s] for s in range(len(side_sizes))] for w in range(len(side_sizes))]
+    return chances, outcomes
+
+
+def simulate_side_outcomes(side_ratings, side_sizes, largest_team: int = None, version: int = 2, max_elo_deltas=None):
+    # Team or squad equivalent of simulate_outcomes(), with a single rating per side. max_elo_deltas gives each side's K (default 32).
+    # Returns (win_chances, outcomes) where outcomes[w][s] is side s's ELO change if side w wins
+    chances = side_win_chances(largest_team or max(side_sizes), side_sizes, side_ratings, version)
+    max_elo_deltas = max_elo_deltas or [32] * len(side_sizes)
+    outcomes = [[team_elo_delta(chances[s], s == w, max_elo_deltas[s]) for s in range(len(side_sizes))] for w in range(len(side_sizes))]
+    return chances, outcomes
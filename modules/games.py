@@ -4,20 +4,18 @@
 import settings
 import modules.exceptions as exceptions
 import modules.achievements as achievements
-from modules import channels
+from modules import channels, graphs, leaderboard_cache, rating_index
 import peewee
 import modules.models as models
 from modules.models import Game, db, Player, Team, DiscordMember, Squad, GameSide, Tribe, Lineup
+import modules.player_card as player_card
 from modules.league import auto_grad_novas, populate_league_team_channels, get_team_leadership
 from itertools import groupby
 import logging
 import datetime
 import asyncio
 import re
-from matplotlib import pyplot as plt
 import io
-import pandas as pd
-import scipy.signal as signal
 
 logger = logging.getLogger('polybot.' + __name__)
 elo_logger = logging.getLogger('polybot.elo')
@@ -63,6 +61,7 @@ class polygames(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        graphs.start()
         if settings.run_tasks:
             self.bg_task = bot.loop.create_task(self.task_purge_game_channels())
             self.bg_task2 = bot.loop.create_task(self.task_set_champion_role())
@@ -154,9 +153,11 @@ async def on_member_remove(self, member):
             for l in pending_lineups:
                 models.GameLog.write(game_id=l.game.id, guild_id=member.guild.id, message=f'{models.GameLog.member_string(member)} left the game while leaving the server.')
 
-            q = Lineup.delete().where(models.Lineup.id.in_(pending_lineups))
+            with db.atomic():
+                models.TribeUsage.apply(models.TribeUsage.lineup_counts(models.Lineup.id.in_(pending_lineups)), sign=-1)
+                q = Lineup.delete().where(models.Lineup.id.in_(pending_lineups))
 
-            logger.info(f'Existing ELO player {member.display_name} {member.id} left guild {member.guild.name} - deleted Lineup records for {q.execute()} pending games.')
+                logger.info(f'Existing ELO player {member.display_name} {member.id} left guild {member.guild.name} - deleted Lineup records for {q.execute()} pending games.')
 
         if incomplete_lineups and member.guild.id == settings.server_ids['polychampions']:
             helper_role_name = settings.guild_setting(member.guild.id, 'helper_roles')[0]
@@ -192,6 +193,8 @@ async def on_member_update(self, before, after):
                 return
             player.is_banned = True
             player.save()
+            db.on_commit(lambda: leaderboard_cache.invalidate(after.guild.id, reason=f'ELO ban added for player {player.id}'))
+            db.on_commit(lambda: rating_index.invalidate(after.guild.id))
             logger.info(f'ELO Ban added for player {player.id} {player.name}')
             models.GameLog.write(game_id=0, guild_id=after.guild.id, message=f'{models.GameLog.member_string(after)} had *ELO Banned* role applied.')
 
@@ -203,6 +206,8 @@ async def on_member_update(self, before, after):
                 return
             player.is_banned = False
             player.save()
+            db.on_commit(lambda: leaderboard_cache.invalidate(after.guild.id, reason=f'ELO ban removed for player {player.id}'))
+            db.on_commit(lambda: rating_index.invalidate(after.guild.id))
             logger.info(f'ELO Ban removed for player {player.id} {player.name}')
             models.GameLog.write(game_id=0, guild_id=after.guild.id, message=f'{models.GameLog.member_string(after)} had *ELO Banned* role removed.')
 
@@ -254,6 +259,10 @@ async def lb(self, ctx, *, filters: str = ''):
         Ranks leaderboard by a player's maximum ELO ever achieved
         **allplayers**
         Includes players who have not played recently. By default the leaderboard drops players who have not played in 90 days.
+        **week**
+        Show rank movement (▲/▼) since last week instead of since yesterday.
+        **YYYY-MM-DD**
+        Show the leaderboard as it was on that date (from daily snapshots of the default leaderboards).
 
         Examples:
         `[p]lb` - Default local leaderboard
@@ -261,6 +270,8 @@ async def lb(self, ctx, *, filters: str = ''):
         `[p]lb max` - Local leaderboard for maximum historic ELO
         `[p]lb allplayers` - Local leaderboard including inactive players
         `[p]lb global max` - Leaderboard of maximum historic *global* ELO
+        `[p]lb week` - Local leaderboard with rank movement over the last week
+        `[p]lb 2021-06-01` - Local leaderboard as of June 1st, 2021
 
         `[p]lbrecent` - Most active players of the last 30 days
         `[p]lbactivealltime` - Most active players of all time
@@ -278,7 +289,6 @@ async def lb(self, ctx, *, filters: str = ''):
         `[p]lb global alltime allplayers max` - Global leaderboard, including inactive players, ranked by maximum hstoric Alltime ELO
         """
 
-        leaderboard = []
         max_flag, global_flag, version = False, False, None
         target_model = Player
         lb_title = 'Individual Leaderboard'
@@ -304,27 +314,95 @@ async def lb(self, ctx, *, filters: str = ''):
             version = 'ALLTIME'  # leaderboard ranked by player.elo_alltime
             lb_title += ' - Alltime (not reset)'
 
-        def process_leaderboard():
+        allplayers_flag = date_cutoff == datetime.date.min
+        board_guild_id = None if global_flag else ctx.guild.id
+        board_version = version or models.LeaderboardSnapshot.versions()[0]
+
+        date_match = re.search(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b', filters)
+        if date_match:
+            try:
+                as_of = datetime.date(*[int(x) for x in date_match.groups()])
+            except ValueError:
+                return await ctx.send(f'Invalid date *{date_match[0]}*. Use the format YYYY-MM-DD.')
+            return await self.historical_leaderboard(ctx, board_guild_id, board_version, as_of, lb_title)
+
+        # Rank movement is measured against the snapshot of the same board, which only exists for the default leaderboards
+        movement = None if (max_flag or allplayers_flag) else ('WEEK' if 'WEEK' in filters.upper() else 'DAY')
+        movement_date = datetime.date.today() - datetime.timedelta(days=7 if movement == 'WEEK' else 1)
+        if movement == 'WEEK':
+            lb_title += ' - Movement Since Last Week'
+
+        def leaderboard_page(start, end):
             utilities.connect()
+            generation = leaderboard_cache.generation()
             leaderboard_query = target_model.leaderboard(date_cutoff=date_cutoff, guild_id=ctx.guild.id, max_flag=max_flag, version=version)
+            records_query = DiscordMember.record_counts() if global_flag else Player.record_counts(guild_id=ctx.guild.id)
+
+            rows = models.leaderboard_rows(leaderboard_query, records_query, limit=end - start, offset=start)
+            previous_ranks = models.LeaderboardSnapshot.ranks(board_guild_id, board_version, movement_date, [row['id'] for row in rows]) if movement and rows else {}
+
+            page = []
+            for counter, row in enumerate(rows, start=start + 1):
+                emoji_str = row.get('team_emoji') or ''
+                previous_rank = previous_ranks.get(row['id'])
+                if previous_rank and previous_rank > counter:
+                    movement_str = f' ▲{previous_rank - counter}'
+                elif previous_rank and previous_rank < counter:
+                    movement_str = f' ▼{counter - previous_rank}'
+                else:
+                    movement_str = ''
 
-            for counter, player in enumerate(leaderboard_query[:2000]):
-                wins, losses = player.get_record()
-                emoji_str = player.team.emoji if not global_flag and player.team else ''
-
-                leaderboard.append(
-                    (f'{(counter + 1):>3}. {emoji_str}{player.name}', f'`ELO {player.elo_field}\u00A0\u00A0\u00A0\u00A0W {wins} / L {losses}`')
+                page.append(
+                    (f'{counter:>3}. {emoji_str}{row["name"]}{movement_str}', f'`ELO {row["elo_field"]}\u00A0\u00A0\u00A0\u00A0W {row["wins"]} / L {row["losses"]}`')
                 )
-            return leaderboard, leaderboard_query.count()
+            leaderboard_cache.put(leaderboard_cache.make_key(ctx.guild.id, version, max_flag, global_flag, allplayers_flag, page_start=start, movement=movement), page, generation)
+            return page
 
-        async with ctx.typing():
-            leaderboard, leaderboard_size = await self.bot.loop.run_in_executor(None, process_leaderboard)
+        def process_leaderboard_size():
+            utilities.connect()
+            generation = leaderboard_cache.generation()
+            size = target_model.leaderboard(date_cutoff=date_cutoff, guild_id=ctx.guild.id, max_flag=max_flag, version=version).count()
+            leaderboard_cache.put(leaderboard_cache.make_key(ctx.guild.id, version, max_flag, global_flag, allplayers_flag), size, generation)
+            return size
+
+        async def cached_leaderboard_page(start, end):
+            page = leaderboard_cache.get(leaderboard_cache.make_key(ctx.guild.id, version, max_flag, global_flag, allplayers_flag, page_start=start, movement=movement))
+            if page is None:
+                page = await self.bot.loop.run_in_executor(None, leaderboard_page, start, end)
+            return page
+
+        leaderboard_size = leaderboard_cache.get(leaderboard_cache.make_key(ctx.guild.id, version, max_flag, global_flag, allplayers_flag))
+        if leaderboard_size is None:
+            async with ctx.typing():
+                leaderboard_size = await self.bot.loop.run_in_executor(None, process_leaderboard_size)
 
         # if ctx.guild.id != settings.server_ids['polychampions']:
         #     await ctx.send('Powered by PolyChampions. League server with a team focus and competitive players.\n'
         #         'Supporting up to 6-player team ELO games and automatic team channels. - <https://tinyurl.com/polychampions>')
         #     # link put behind url shortener to not show big invite embed
-        await utilities.paginate(self.bot, ctx, title=f'**{lb_title}**\n{leaderboard_size} ranked players', message_list=leaderboard, page_start=0, page_end=10, page_size=10)
+        await utilities.paginate(self.bot, ctx, title=f'**{lb_title}**\n{leaderboard_size} ranked players', page_provider=cached_leaderboard_page, total=leaderboard_size,
+                                 page_start=0, page_end=10, page_size=10)
+
+    async def historical_leaderboard(self, ctx, guild_id: int, version: str, as_of: datetime.date, lb_title: str):
+        # Pages through the most recent leaderboard snapshot taken on or before as_of. guild_id is None for the global leaderboard
+
+        board = models.LeaderboardSnapshot.board(guild_id, version, as_of)
+
+        def leaderboard_page(start, end):
+            utilities.connect()
+            return [(f'{row["rank"]:>3}. {row["name"]}', f'`ELO {row["elo"]}`') for row in board.limit(end - start).offset(start).dicts()]
+
+        def process_board():
+            utilities.connect()
+            return board.count(), models.LeaderboardSnapshot.snapshot_date_as_of(guild_id, version, as_of).scalar()
+
+        async with ctx.typing():
+            size, snapshot_date = await self.bot.loop.run_in_executor(None, process_board)
+        if not size:
+            return await ctx.send(f'No leaderboard snapshot exists from on or before {as_of}.')
+
+        await utilities.paginate(self.bot, ctx, title=f'**{lb_title}**\nAs of {snapshot_date} - top {size} players', page_provider=leaderboard_page, total=size,
+                                 page_start=0, page_end=10, page_size=10)
 
     @settings.in_bot_channel_strict()
     @commands.command(aliases=['recent', 'active', 'lbactivealltime'], hidden=True)
@@ -335,39 +413,46 @@ async def lbrecent(self, ctx):
         Alternative command is `[p]lbactivealltime`
         """
         last_month = (datetime.datetime.now() + datetime.timedelta(days=-30))
-
-        leaderboard = []
+        alltime_flag = ctx.invoked_with == 'lbactivealltime'
 
         query = Player.select(Player, peewee.fn.COUNT(Lineup.id).alias('count')).join(Lineup).join(Game).where(
             (Lineup.player == Player.id) & ((Game.date > last_month) | (Game.completed_ts > last_month)) & (Game.guild_id == ctx.guild.id)
-        ).group_by(Player.id).order_by(-peewee.SQL('count'))
+        ).group_by(Player.id).order_by(-peewee.SQL('count'), Player.id)
 
-        if ctx.invoked_with == 'lbactivealltime':
+        if alltime_flag:
             # special command to see all time active list by discord member
             query = DiscordMember.select(DiscordMember, peewee.fn.COUNT(Lineup.id).alias('count')).join(Player).join(Lineup).join(Game).where(
                 (Lineup.player.discord_member == DiscordMember.id) & (Game.is_pending == 0)
-            ).group_by(DiscordMember.id).order_by(-peewee.SQL('count'))
+            ).group_by(DiscordMember.id).order_by(-peewee.SQL('count'), DiscordMember.id)
 
-            for counter, discord_member in enumerate(query[:1000]):
-                wins, losses = discord_member.get_record()
-                leaderboard.append(
-                    (f'{(counter + 1):>3}. {discord_member.name}', f'`ELO {discord_member.elo}\u00A0\u00A0\u00A0\u00A0Games Played {discord_member.count}`')
-                )
-            title = '**Most active players of all time**'
-        else:
-            for counter, player in enumerate(query[:500]):
-                wins, losses = player.get_record()
-                emoji_str = player.team.emoji if player.team else ''
-                leaderboard.append(
-                    (f'{(counter + 1):>3}. {emoji_str}{player.name}', f'`ELO {player.elo}\u00A0\u00A0\u00A0\u00A0Recent Games {player.count}`')
-                )
-            title = f'**Most Active Recent Players**\n{query.count()} players in past 30 days'
+        def leaderboard_page(start, end):
+            utilities.connect()
+            page = []
+            for counter, row in enumerate(models.leaderboard_rows(query, sort_column='count', limit=end - start, offset=start), start=start + 1):
+                if alltime_flag:
+                    page.append(
+                        (f'{counter:>3}. {row["name"]}', f'`ELO {row["elo"]}\u00A0\u00A0\u00A0\u00A0Games Played {row["count"]}`')
+                    )
+                else:
+                    emoji_str = row['team_emoji'] or ''
+                    page.append(
+                        (f'{counter:>3}. {emoji_str}{row["name"]}', f'`ELO {row["elo"]}\u00A0\u00A0\u00A0\u00A0Recent Games {row["count"]}`')
+                    )
+            return page
+
+        def leaderboard_size():
+            utilities.connect()
+            return query.count()
+
+        async with ctx.typing():
+            size = await self.bot.loop.run_in_executor(None, leaderboard_size)
+        title = '**Most active players of all time**' if alltime_flag else f'**Most Active Recent Players**\n{size} players in past 30 days'
 
         # if ctx.guild.id != settings.server_ids['polychampions']:
         #     await ctx.send('Powered by PolyChampions. League server with a team focus and competitive players.\n'
         #         'Supporting up to 6-player team ELO games and automatic team channels. - <https://tinyurl.com/polychampions>')
         #     # link put behind url shortener to not show big invite embed
-        await utilities.paginate(self.bot, ctx, title=title, message_list=leaderboard, page_start=0, page_end=10, page_size=10)
+        await utilities.paginate(self.bot, ctx, title=title, page_provider=leaderboard_page, total=size, page_start=0, page_end=10, page_size=10)
 
     @settings.in_bot_channel_strict()
     @settings.guild_has_setting(setting_name='allow_teams')
@@ -389,31 +474,35 @@ async def lbteam(self, ctx, *, arg: str = None):
             pro_flag = 1
             jr_string = ''
 
-        fig, ax = plt.subplots(figsize=(12, 8))
-        plt.style.use('default')
-
         if arg and arg.lower()[:3] == 'all':
             # date_cutoff = datetime.date.min
             embed = discord.Embed(title=f'**Alltime {jr_string}Team Leaderboard**')
-            fig.suptitle('Team ELO History (Alltime)', fontsize=16)
+            chart_title = 'Team ELO History (Alltime)'
             alltime = True
             sort_field = Team.elo_alltime
         else:
             # date_cutoff = datetime.datetime.strptime(settings.team_elo_reset_date, "%m/%d/%Y").date()
             embed = discord.Embed(title=f'**{jr_string}Team Leaderboard since {settings.team_elo_reset_date}**')
-            fig.suptitle('Team ELO History since ' + settings.team_elo_reset_date, fontsize=16)
+            chart_title = 'Team ELO History since ' + settings.team_elo_reset_date
             alltime = False
             sort_field = Team.elo
 
-        fig.autofmt_xdate()
-
         guild_check = settings.server_ids['polychampions'] if ctx.guild.id == settings.server_ids['test'] else ctx.guild.id
         query = Team.select().where(
             (Team.is_hidden == 0) & (Team.guild_id == guild_check) & (Team.pro_league == pro_flag)
         ).order_by(-sort_field)
 
+        def load_teams():
+            utilities.connect()
+            teams = [(team, team.get_record(alltime=alltime)) for team in query]
+            built_generation, histories = graphs.team_histories([team.id for team, record in teams], alltime)
+            return teams, built_generation, histories
+
         async with ctx.typing():
-            for counter, team in enumerate(query):
+            teams, built_generation, histories = await self.bot.loop.run_in_executor(None, load_teams)
+
+            chart_teams = []
+            for counter, (team, (wins, losses)) in enumerate(teams):
                 team_role = discord.utils.get(ctx.guild.roles, name=team.name)
                 if not team_role:
                     logger.error(f'Could not find matching role for team {team.name}')
@@ -425,49 +514,19 @@ async def lbteam(self, ctx, *, arg: str = None):
                         continue
                     member_count += 1
                 team_name_str = f'**{team.name}**   ({member_count})'  # Show team name with number of members without MIA role
-                wins, losses = team.get_record(alltime=alltime)
 
                 elo = team.elo_alltime if alltime else team.elo
                 embed.add_field(name=f'{team.emoji} {(counter + 1):>3}. {team_name_str}\n`ELO: {elo:<5} W {wins} / L {losses}`', value='\u200b', inline=False)
 
-                team_elo_history_query = (GameSide
-                        .select(Game.completed_ts, (GameSide.team_elo_after_game_alltime if alltime else GameSide.team_elo_after_game).alias('elo'))
-                        .join(Game)
-                        .where((GameSide.team_id == team.id) & ((GameSide.team_elo_after_game_alltime if alltime else GameSide.team_elo_after_game).is_null(False)))
-                        .order_by(Game.completed_ts))
-
-                if team_elo_history_query:
-                    team_elo_history = pd.DataFrame(team_elo_history_query.dicts())
-                    team_elo_history_resampled = team_elo_history.set_index('completed_ts').resample('D').mean().interpolate().reset_index()
-                    filter_length = max(int(len(team_elo_history_resampled.index) / 3), 1)
-                    filter_length = filter_length if filter_length % 2 != 0 else filter_length - 1
-                    poly_order = 2 if filter_length > 2 else 0
-
-                    plt.plot(team_elo_history['completed_ts'],
-                                team_elo_history['elo'],
-                                'o', markersize=3, alpha=.05, color=str(team_role.color))
-
-                    plt.plot(team_elo_history_resampled['completed_ts'],
-                                signal.savgol_filter(team_elo_history_resampled['elo'].values, filter_length, poly_order),
-                                '-', linewidth=2, label=team.name, color=str(team_role.color))
-
-        ax.yaxis.grid()
-
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_visible(False)
+                if team.id in histories:
+                    points, smoothed = histories[team.id]
+                    chart_teams.append((team.id, team.name, str(team_role.color), points, smoothed))
 
-        plt.legend(loc="best")
-
-        plt.savefig('graph.png', transparent=False)
-        plt.close(fig)
+            graph_bytes, series = await graphs.render(self.bot.loop, graphs.render_team_chart, chart_title, chart_teams)
+            graphs.store_team_series(alltime, series, built_generation)
 
         embed.set_image(url='attachment://graph.png')
-
-        with open('graph.png', 'rb') as f:
-            file = io.BytesIO(f.read())
-
-        image = discord.File(file, filename='graph.png')
+        image = discord.File(io.BytesIO(graph_bytes), filename='graph.png')
 
         await ctx.send(embed=embed, file=image)
 
@@ -486,7 +545,6 @@ async def lbsquad(self, ctx, *, filters: str = ''):
         `[p]lbsquad alltime` - Alltime leaderboard.
         """
 
-        leaderboard = []
         lb_title = 'Squad Leaderboard'
         date_cutoff = settings.date_cutoff
 
@@ -494,26 +552,34 @@ async def lbsquad(self, ctx, *, filters: str = ''):
             lb_title += ' - Alltime'
             date_cutoff = datetime.date.min
 
-        def process_leaderboard():
+        query = Squad.leaderboard(date_cutoff=date_cutoff, guild_id=ctx.guild.id)
+
+        def leaderboard_page(start, end):
             utilities.connect()
-            squads = Squad.leaderboard(date_cutoff=date_cutoff, guild_id=ctx.guild.id)
-            for counter, sq in enumerate(squads[:500]):
-                wins, losses = sq.get_record()
-                squad_members = sq.get_members()
+            squads = list(query.limit(end - start).offset(start))
+            members = Squad.members_by_squad([sq.id for sq in squads])
+            page = []
+            for counter, sq in enumerate(squads, start=start + 1):
+                squad_members = members[sq.id]
                 emoji_list = [p.team.emoji for p in squad_members if p.team is not None]
                 emoji_string = ' '.join(emoji_list)
-                squad_member_names = ' / '.join(sq.get_names())
+                squad_member_names = ' / '.join(p.name for p in squad_members)
                 squad_name_str = f'{sq.name}\n' if sq.name else ''
 
-                leaderboard.append(
-                    (f'{(counter + 1):>3}. {squad_name_str}{emoji_string}{squad_member_names}', f'`#{sq.id} (ELO: {sq.elo:4}) W {wins} / L {losses}`')
+                page.append(
+                    (f'{counter:>3}. {squad_name_str}{emoji_string}{squad_member_names}', f'`#{sq.id} (ELO: {sq.elo:4}) W {sq.stats.wins} / L {sq.stats.losses}`')
                 )
-            return leaderboard, squads.count()
+            return page
+
+        def leaderboard_size():
+            utilities.connect()
+            return min(query.count(), 500)
 
         async with ctx.typing():
-            leaderboard, leaderboard_size = await self.bot.loop.run_in_executor(None, process_leaderboard)
+            leaderboard_size = await self.bot.loop.run_in_executor(None, leaderboard_size)
 
-        await utilities.paginate(self.bot, ctx, title=f'**{lb_title}**\n{leaderboard_size} ranked squads', message_list=leaderboard, page_start=0, page_end=10, page_size=10)
+        await utilities.paginate(self.bot, ctx, title=f'**{lb_title}**\n{leaderboard_size} ranked squads', page_provider=leaderboard_page, total=leaderboard_size,
+                                 page_start=0, page_end=10, page_size=10)
 
     @settings.in_bot_channel()
     @settings.guild_has_setting(setting_name='allow_teams')
@@ -607,18 +673,20 @@ async def squad(self, ctx, *args):
             if len(squad_list) > 1:
                 # more than one match, so display a paginating list
                 squadlist = []
-                for squadside in squad_list[:50]:
-                    squad = squadside.squad
+                squads = list(squad_list[:50])
+                members = Squad.members_by_squad([squad.id for squad in squads])
+                for squad in squads:
                     wins, losses = squad.get_record()
+                    squad_names = ' / '.join(p.name for p in members[squad.id])
                     squad_name_str = f' - *{squad.name}*\n' if squad.name else ' - '
                     squadlist.append(
-                        (f'`#{squad.id:>3}`{squad_name_str}{" / ".join(squad.get_names()):40}', f'`(ELO: {squad.elo}) W {wins} / L {losses}`')
+                        (f'`#{squad.id:>3}`{squad_name_str}{squad_names:40}', f'`(ELO: {squad.elo}) W {wins} / L {losses}`')
                     )
                 await utilities.paginate(self.bot, ctx, title=f'Found {len(squad_list)} matches. Try `{ctx.prefix}squad #`:', message_list=squadlist, page_start=0, page_end=10, page_size=10)
                 return
 
             # Exact matching squad found by player name
-            squad = squad_list[0].squad
+            squad = squad_list[0]
 
         if squad.guild_id != ctx.guild.id:
             return await ctx.send(f'Squad with ID {squad_id} is affiliated with a different Discord server.')
@@ -708,42 +776,42 @@ async def player(self, ctx, *, args=None):
 
         def async_create_player_embed():
             utilities.connect()
-            wins, losses = player.get_record(version='alltime' if alltime_flag else None)
-            rank, lb_length = player.leaderboard_rank(settings.date_cutoff)
-
-            wins_g, losses_g = player.discord_member.get_record(version='alltime' if alltime_flag else None)
-            rank_g, lb_length_g = player.discord_member.leaderboard_rank(settings.date_cutoff)
-
-            polychamps_record = player.discord_member.get_polychamps_record()
-
-            image = None
+            stats = player_card.PlayerCardStats(player, alltime_flag=alltime_flag).build()
+            card_player = stats.player
+            wins, losses = stats.record
+            rank, lb_length = stats.rank, stats.lb_length
+            wins_g, losses_g = stats.record_g
+            rank_g, lb_length_g = stats.rank_g, stats.lb_length_g
+            polychamps_record = stats.polychamps_record
+
+            graph = None
             air_record = []
 
             if alltime_flag:
-                elo = player.elo_alltime
-                g_elo = player.discord_member.elo_alltime
-                elo_max = player.elo_max_alltime
-                g_elo_max = player.discord_member.elo_max_alltime
+                elo = card_player.elo_alltime
+                g_elo = card_player.discord_member.elo_alltime
+                elo_max = card_player.elo_max_alltime
+                g_elo_max = card_player.discord_member.elo_max_alltime
             else:
                 if models.is_post_moonrise():
-                    elo = player.elo_moonrise
-                    g_elo = player.discord_member.elo_moonrise
-                    elo_max = player.elo_max_moonrise
-                    g_elo_max = player.discord_member.elo_max_moonrise
+                    elo = card_player.elo_moonrise
+                    g_elo = card_player.discord_member.elo_moonrise
+                    elo_max = card_player.elo_max_moonrise
+                    g_elo_max = card_player.discord_member.elo_max_moonrise
 
-                    air_record_g = player.discord_member.get_record(version='air')
+                    air_record_g = stats.air_record_g
 
                     if air_record_g[0] or air_record_g[1]:
-                        air_record_l = player.get_record(version='air')
+                        air_record_l = stats.air_record
                         air_record = [('Global Record', f'W {air_record_g[0]} / L {air_record_g[1]}'),
-                                      ('Global ELO', f'{player.discord_member.elo} / {player.discord_member.elo_max} Max'),
+                                      ('Global ELO', f'{card_player.discord_member.elo} / {card_player.discord_member.elo_max} Max'),
                                       ('Local Record', f'W {air_record_l[0]} / L {air_record_l[1]}'),
-                                      ('Local ELO', f'{player.elo} / {player.elo_max} Max')]
+                                      ('Local ELO', f'{card_player.elo} / {card_player.elo_max} Max')]
                 else:
-                    elo = player.elo
-                    g_elo = player.discord_member.elo
-                    elo_max = player.elo_max
-                    g_elo_max = player.discord_member.elo_max
+                    elo = card_player.elo
+                    g_elo = card_player.discord_member.elo
+                    elo_max = card_player.elo_max
+                    g_elo_max = card_player.discord_member.elo_max
 
             if rank is None:
                 rank_str = 'Unranked'
@@ -756,31 +824,27 @@ def async_create_player_embed():
                 rank_str = f'{rank_str}\n{rank_g} of {lb_length_g} *Global*'
                 results_str = f'{results_str}\n**Global**\nELO: {g_elo}\nW\u00A0{wins_g}\u00A0/\u00A0L\u00A0{losses_g}'
 
-            # embed = discord.Embed(title=f'Player card for __{player.name}__')
-            embed = discord.Embed(description=f'__{"Alltime ELO " if alltime_flag else ""}Player card for <@{player.discord_member.discord_id}>__')
+            # embed = discord.Embed(title=f'Player card for __{card_player.name}__')
+            embed = discord.Embed(description=f'__{"Alltime ELO " if alltime_flag else ""}Player card for <@{card_player.discord_member.discord_id}>__')
             embed.add_field(name='**Results**', value=results_str)
             embed.add_field(name='**Ranking**', value=rank_str)
 
-            guild_member = ctx.guild.get_member(player.discord_member.discord_id)
-            if guild_member:
-                embed.set_thumbnail(url=guild_member.avatar_url_as(size=512))
-
-            if player.team:
-                team_str = f'{player.team.name} {player.team.emoji}' if player.team.emoji else player.team.name
+            if card_player.team:
+                team_str = f'{card_player.team.name} {card_player.team.emoji}' if card_player.team.emoji else card_player.team.name
                 embed.add_field(name='**Last-known Team**', value=team_str)
-            if player.discord_member.polytopia_name:
-                embed.add_field(name='Polytopia Game Name', value=player.discord_member.polytopia_name)
-            if player.discord_member.name_steam:
-                embed.add_field(name='Steam Name', value=player.discord_member.name_steam)
-            if player.discord_member.polytopia_id:
-                embed.add_field(name='Polytopia ID', value=player.discord_member.polytopia_id)
-                content_str = player.discord_member.polytopia_id
+            if card_player.discord_member.polytopia_name:
+                embed.add_field(name='Polytopia Game Name', value=card_player.discord_member.polytopia_name)
+            if card_player.discord_member.name_steam:
+                embed.add_field(name='Steam Name', value=card_player.discord_member.name_steam)
+            if card_player.discord_member.polytopia_id:
+                embed.add_field(name='Polytopia ID', value=card_player.discord_member.polytopia_id)
+                content_str = card_player.discord_member.polytopia_id
                 # Used as a single message before player card so users can easily copy/paste Poly ID
             else:
                 content_str = ''
 
-            if player.discord_member.timezone_offset:
-                offset_str = f'UTC+{player.discord_member.timezone_offset}' if player.discord_member.timezone_offset > 0 else f'UTC{player.discord_member.timezone_offset}'
+            if card_player.discord_member.timezone_offset:
+                offset_str = f'UTC+{card_player.discord_member.timezone_offset}' if card_player.discord_member.timezone_offset > 0 else f'UTC{card_player.discord_member.timezone_offset}'
                 embed.add_field(value=offset_str, name='Timezone Offset', inline=True)
 
             if polychamps_record:
@@ -790,7 +854,7 @@ def async_create_player_embed():
                 embed.add_field(value=pc_record_str, name='PolyChampions Record', inline=True)
 
             misc_stats = []
-            (winning_streak, losing_streak, v2_count, v3_count, duel_wins, duel_losses, wins_as_host, ranked_games_played) = player.discord_member.advanced_stats()
+            (winning_streak, losing_streak, v2_count, v3_count, duel_wins, duel_losses, wins_as_host, ranked_games_played) = stats.advanced_stats
             if winning_streak or losing_streak:
                 misc_stats.append(('Longest streaks', f'{winning_streak} wins, {losing_streak} losses'))
             if v2_count:
@@ -806,7 +870,7 @@ def async_create_player_embed():
             if g_elo_max > 1000:
                 misc_stats.append(('Max ELO achieved', f'{g_elo_max} G \u200b - \u200b {elo_max} L'))
 
-            favorite_tribes = player.discord_member.favorite_tribes(limit=3)
+            favorite_tribes = stats.favorite_tribes
             if favorite_tribes:
                 tribes_str = ' '.join([f'{t["emoji"] if t["emoji"] else t["name"]}' for t in favorite_tribes])
                 misc_stats.append(('Most-logged tribes', tribes_str))
@@ -822,89 +886,67 @@ def async_create_player_embed():
                 air_record = [stat.replace(".", "\u200b ") for stat in air_record]
                 embed.add_field(name='__Pre-Moonrise Reset Stats__', value='\n'.join(air_record), inline=False)
 
-            global_elo_history_query = (Player
-                .select(Game.completed_ts, Lineup.elo_after_game_global, Lineup.elo_after_game_global_moonrise, Lineup.elo_after_game_global_alltime)
-                .join(Lineup)
-                .join(Game)
-                .where((Player.discord_member_id == player.discord_member_id) & ((Lineup.elo_after_game_global.is_null(False)) | (Lineup.elo_after_game_global_moonrise.is_null(False))))
-                .order_by(Game.completed_ts))
-
-            global_elo_history_dates = [l.completed_ts for l in global_elo_history_query.objects()]
-
-            # if global_elo_history_dates:
-            local_elo_history_query = (Lineup
-                .select(Game.completed_ts, Lineup.elo_after_game, Lineup.elo_after_game_alltime, Lineup.elo_after_game_moonrise)
-                .join(Game)
-                .where((Lineup.player_id == player.id) & ((Lineup.elo_after_game.is_null(False)) | (Lineup.elo_after_game_moonrise.is_null(False))))
-            )
-
-            local_elo_history_dates = [l.completed_ts for l in local_elo_history_query.objects()]
-            local_elo_history_elos = [l.elo_after_game_alltime for l in local_elo_history_query.objects()] if alltime_flag else [l.elo_after_game or l.elo_after_game_moonrise for l in local_elo_history_query.objects()]
-
-            global_elo_history_elos = [l.elo_after_game_global_alltime for l in global_elo_history_query.objects()] if alltime_flag else [l.elo_after_game_global or l.elo_after_game_global_moonrise for l in global_elo_history_query.objects()]
-
             try:
-                server_name = settings.guild_setting(guild_id=player.guild_id, setting_name='display_name')
+                server_name = settings.guild_setting(guild_id=card_player.guild_id, setting_name='display_name')
             except exceptions.CheckFailedError:
                 server_name = settings.guild_setting(guild_id=None, setting_name='display_name')
 
-            if global_elo_history_dates or local_elo_history_dates:
-
-                plt.style.use('default')
-
-                plt.switch_backend('Agg')
-
-                fig, ax = plt.subplots()
-                fig.suptitle(f'{"Alltime" if alltime_flag else ""} ELO History (' + server_name + ')', fontsize=16)
-                fig.autofmt_xdate()
-
-                plt.plot(local_elo_history_dates, local_elo_history_elos, 'o', markersize=3, label=server_name)
-                plt.plot(global_elo_history_dates, global_elo_history_elos, 'o', markersize=3, label='Global')
-
-                ax.yaxis.grid()
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-                ax.spines['left'].set_visible(False)
-
-                plt.legend(loc="best")
-
-                plt.savefig('graph.png', transparent=False)
-                plt.close(fig)
-
-                embed.set_image(url='attachment://graph.png')
-
-                with open('graph.png', 'rb') as f:
-                    file = io.BytesIO(f.read())
+            if stats.global_elo_history or stats.local_elo_history:
+                graph = (f'{"Alltime" if alltime_flag else ""} ELO History (' + server_name + ')',
+                         [(server_name, stats.local_elo_history), ('Global', stats.global_elo_history)])
 
-                image = discord.File(file, filename='graph.png')
-
-            games_list = Game.search(player_filter=[player])
-            if not games_list:
+            if not stats.games_total:
                 recent_games_str = 'No games played'
             else:
-                recent_games_count = player.games_played(in_days=30).count()
-                recent_games_str = f'__Most recent games ({len(games_list)} total, {recent_games_count} recently):__'
+                recent_games_str = f'__Most recent games ({stats.games_total} total, {stats.games_recent} recently):__'
             embed.add_field(value='\u200b', name=recent_games_str, inline=False)
 
-            game_list = utilities.summarize_game_list(games_list[:5])
+            game_list = utilities.summarize_game_list(stats.recent_games)
             for game, result in game_list:
                 embed.add_field(name=game, value=result, inline=False)
 
-            if player.discord_member.discord_id != ctx.author.id:
-                # Look up 1v1 record between ctx.author and the card target
-                try:
-                    author_player = Player.get_or_except(player_string=str(ctx.author.id), guild_id=ctx.guild.id)
-                except exceptions.MyBaseException:
-                    matchup_games = []  # author not registered
-                else:
-                    matchup_games = Game.search(player_filter=[player, author_player], size_filter=[1, 1]).limit(1)
-            else:
-                matchup_games = []
+            return content_str, embed, graph
 
-            return content_str, embed, image, matchup_games
+        def load_cached_card():
+            # The card's cache key, the member's discord ID and the cached card (or None), from one lookup of the member
+            utilities.connect()
+            discord_id, rating_version = DiscordMember.select(DiscordMember.discord_id, DiscordMember.rating_version).where(
+                DiscordMember.id == player.discord_member_id
+            ).tuples().get()
+            key = player_card.card_key(player.id, alltime_flag, rating_version)
+            return key, discord_id, player_card.get(key)
+
+        def find_matchup_games(discord_id):
+            # Look up 1v1 record between ctx.author and the card target. Not cached since it depends on who is asking
+            if discord_id == ctx.author.id:
+                return []
+            utilities.connect()
+            try:
+                author_player = Player.get_or_except(player_string=str(ctx.author.id), guild_id=ctx.guild.id)
+            except exceptions.MyBaseException:
+                return []  # author not registered
+            return list(Game.search(player_filter=[player, author_player], size_filter=[1, 1]).limit(1))
 
         async with ctx.typing():
-            content_str, embed, image, matchup_games = await self.bot.loop.run_in_executor(None, async_create_player_embed)
+            card_key, discord_id, card = await self.bot.loop.run_in_executor(None, load_cached_card)
+            if card is None:
+                content_str, embed, graph = await self.bot.loop.run_in_executor(None, async_create_player_embed)
+                graph_bytes = None
+                if graph:
+                    graph_bytes = await graphs.render(self.bot.loop, graphs.render_elo_history, *graph)
+                    embed.set_image(url='attachment://graph.png')
+                card = (content_str, embed.to_dict(), graph_bytes)
+                player_card.put(card_key, card)
+
+            content_str, embed_dict, graph_bytes = card
+            embed = discord.Embed.from_dict(embed_dict)
+            image = discord.File(io.BytesIO(graph_bytes), filename='graph.png') if graph_bytes else None
+
+            guild_member = ctx.guild.get_member(discord_id)
+            if guild_member:
+                embed.set_thumbnail(url=guild_member.avatar_url_as(size=512))
+
+            matchup_games = await self.bot.loop.run_in_executor(None, find_matchup_games, discord_id)
 
         await ctx.send(content=content_str, file=image, embed=embed)
 
@@ -973,7 +1015,7 @@ async def team(self, ctx, *, team_string: str = None):
                         member_stats.append((member.name, 0, f'`{member.name[:23]:.<25}{"-":.<8}{"-":.<6}{"-":.<4}`'))
                     else:
                         wins, losses = p[0].get_record()
-                        lb_rank = p[0].leaderboard_rank(date_cutoff=settings.date_cutoff)[0]
+                        lb_rank = rating_index.rank(p[0].guild_id, p[0].id)[0]
                         rank_str = f'#{lb_rank}' if lb_rank else '-'
                         if completed_flag:
                             games_played = p[0].completed_game_count()
@@ -1008,53 +1050,16 @@ async def team(self, ctx, *, team_string: str = None):
         for game, result in game_list:
             embed.add_field(name=game, value=result)
 
-        alltime_team_elo_history_query = (GameSide
-                .select(Game.completed_ts, GameSide.team_elo_after_game_alltime)
-                .join(Game)
-                .where((GameSide.team_id == team.id) & (GameSide.team_elo_after_game_alltime.is_null(False)))
-                .order_by(Game.completed_ts))
-
-        alltime_team_elo_history_dates = [l.completed_ts for l in alltime_team_elo_history_query.objects()]
+        alltime_team_elo_history = models.EloEvent.history('team', [team.id], ['elo_alltime'])
+        alltime_team_elo_history_dates = [completed_ts for completed_ts, elo_after in alltime_team_elo_history]
 
         if alltime_team_elo_history_dates:
-            alltime_team_elo_history_elos = [l.team_elo_after_game_alltime for l in alltime_team_elo_history_query.objects()]
-
-            team_elo_history_query = (GameSide
-                .select(Game.completed_ts, GameSide.team_elo_after_game)
-                .join(Game)
-                .where((GameSide.team_id == team.id) & (GameSide.team_elo_after_game.is_null(False)))
-                .order_by(Game.completed_ts))
-
-            team_elo_history_dates = [l.completed_ts for l in team_elo_history_query.objects()]
-            team_elo_history_elos = [l.team_elo_after_game for l in team_elo_history_query.objects()]
-
-            plt.style.use('default')
-
-            plt.switch_backend('Agg')
-
-            fig, ax = plt.subplots()
-            fig.suptitle('ELO History (' + team.name + ')', fontsize=16)
-            fig.autofmt_xdate()
-
-            plt.plot(team_elo_history_dates, team_elo_history_elos, 'o', markersize=3, label=f'Since {settings.team_elo_reset_date}')
-            plt.plot(alltime_team_elo_history_dates, alltime_team_elo_history_elos, 'o', markersize=3, label='Alltime')
-
-            ax.yaxis.grid()
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['left'].set_visible(False)
-
-            plt.legend(loc="best")
-
-            plt.savefig('graph.png', transparent=False)
-            plt.close(fig)
+            team_elo_history = models.EloEvent.history('team', [team.id], ['elo'])
+            series = [(f'Since {settings.team_elo_reset_date}', team_elo_history), ('Alltime', alltime_team_elo_history)]
+            graph_bytes = await graphs.render(self.bot.loop, graphs.render_elo_history, 'ELO History (' + team.name + ')', series)
 
             embed.set_image(url='attachment://graph.png')
-
-            with open('graph.png', 'rb') as f:
-                file = io.BytesIO(f.read())
-
-            image = discord.File(file, filename='graph.png')
+            image = discord.File(io.BytesIO(graph_bytes), filename='graph.png')
 
         await ctx.send(file=image, embed=embed)
 
@@ -1705,6 +1710,7 @@ async def unwin(self, ctx, game: PolyGame = None):
                 async with ctx.typing():
                     with db.atomic():
                         timestamp = game.completed_ts
+                        seed = game.influence_seed()
                         game.reverse_elo_changes()
                         game.completed_ts = None
                         game.is_confirmed = False
@@ -1715,9 +1721,11 @@ async def unwin(self, ctx, game: PolyGame = None):
                         await post_unwin_messaging(ctx.guild, ctx.prefix, ctx.channel, game, previously_confirmed=True)
                         if game.is_ranked:
                             settings.recalculation_mode = True
-                            Game.recalculate_elo_since(timestamp=timestamp)
-                            elo_logger.debug(f'unwin game {game.id} completed')
-                            settings.recalculation_mode = False
+                            try:
+                                replayed, naive_count = Game.recalculate_elo_since(timestamp=timestamp, seed=seed, guild_id=game.guild_id)
+                            finally:
+                                settings.recalculation_mode = False
+                            elo_logger.debug(f'unwin game {game.id} completed - replayed {replayed} of {naive_count} games a full recalculation would have replayed')
                             utilities.unlock_game(game.id)
                             return await ctx.send(f'Game {game.id} has been marked as *Incomplete*. ELO changes have been reverted and ELO from all subsequent games recalculated.')
 
@@ -1732,6 +1740,7 @@ async def unwin(self, ctx, game: PolyGame = None):
                 game.is_completed = False
                 game.winner = None
                 game.save()
+                game.bump_rating_versions()
                 await post_unwin_messaging(ctx.guild, ctx.prefix, ctx.channel, game, previously_confirmed=False)
                 utilities.unlock_game(game.id)
                 return await ctx.send(f'Unconfirmed Game {game.id} has been marked as *Incomplete*.')
@@ -1759,6 +1768,7 @@ async def unwin(self, ctx, game: PolyGame = None):
                 game.is_completed = False
                 game.winner = None
                 game.save()
+                game.bump_rating_versions()
                 await post_unwin_messaging(ctx.guild, ctx.prefix, ctx.channel, game, previously_confirmed=False)
                 utilities.unlock_game(game.id)
                 return await ctx.send(f'Your unconfirmed win in game {game.id} has been reset and the game is now marked as *Incomplete*.')
@@ -1774,6 +1784,52 @@ async def unwin(self, ctx, game: PolyGame = None):
                 return await ctx.send(f'Your confirmation that **{game.winner.name()}** won game {game.id} has been *removed*. The win is still pending confirmation. '
                     f'{confirmed_count} of {side_count} sides are marked as confirming.')
 
+    @settings.in_bot_channel_strict()
+    @commands.command(usage='game_id', aliases=['simulate'])
+    async def whatif(self, ctx, game: PolyGame = None):
+        """Preview ELO changes for each possible winner of a game
+
+        Uses everyone's current ratings, so the numbers can shift if other games finish first. Nothing is changed.
+        **Example:**
+        `[p]whatif 25`
+        """
+
+        if not game:
+            return await ctx.send(f'Game ID not provided. Usage: __`{ctx.prefix}{ctx.invoked_with} GAME_ID`__')
+        if not game.is_ranked:
+            return await ctx.send(f'Game {game.id} is unranked. No ELO would change.')
+        if game.is_confirmed:
+            return await ctx.send(f'Game {game.id} is already confirmed, its ELO changes are shown in `{ctx.prefix}game {game.id}`.')
+
+        try:
+            sim = game.simulate_winners()
+        except exceptions.CheckFailedError as e:
+            return await ctx.send(f'**Error:** {e}')
+
+        def delta_str(delta):
+            return f'+{delta}' if delta > 0 else str(delta)
+
+        output = [f'__**ELO preview for game {game.id}**__' + (f' *{game.name}*' if game.name else '')]
+        for w, winning_side in enumerate(sim['gamesides']):
+            output.append(f'\n**If {winning_side.name()} wins** (chance {round(sim["win_chances"][w] * 100)}%)')
+            for s, side in enumerate(sim['gamesides']):
+                side_strs = []
+                if sim['team']:
+                    side_strs.append(f'Team {side.team.name} {delta_str(sim["team"][w][s])}')
+                if sim['squad']:
+                    side_strs.append(f'Squad {delta_str(sim["squad"][w][s])}')
+                if side_strs and len(sim['lineups'][s]) > 1:
+                    output.append(f'{side.name()}: ' + ', '.join(side_strs))
+                for p, lineup in enumerate(sim['lineups'][s]):
+                    player_strs = []
+                    if sim['local']:
+                        player_strs.append(f'Local {delta_str(sim["local"][w][s][p])}')
+                    if sim['global']:
+                        player_strs.append(f'Global {delta_str(sim["global"][w][s][p])}')
+                    output.append(f'`{lineup.player.name}`: ' + (', '.join(player_strs) or 'no change'))
+
+        await utilities.buffered_send(destination=ctx, content='\n'.join(output))
+
     @settings.in_bot_channel()
     @models.is_registered_member()
     @commands.command(usage='game_id', aliases=['delete_game', 'delgame', 'delmatch', 'deletegame'])
@@ -1900,6 +1956,7 @@ async def rename(self, ctx, *args):
             return await ctx.send('Error loading guild associated with this game. Please contact the bot owner.')
 
         game.save()
+        game.bump_rating_versions()
         await game.update_squad_channels(self.bot.guilds, game_guild.id)
         await game.update_announcement(guild=game_guild, prefix=ctx.prefix)
         models.GameLog.write(game_id=game, guild_id=game.guild_id, message=f'{models.GameLog.member_string(ctx.author)} renamed the game to *{discord.utils.escape_markdown(str(new_game_name))}*')
@@ -1974,8 +2031,8 @@ async def settribe(self, ctx, *, args: str = None):
                 await ctx.send(f'Matching player not found in game {game.id} matching "{utilities.escape_role_mentions(player_name)}". Check spelling or be more specific. {perm_str}')
                 continue
 
-            lineup_match.tribe = tribe
-            lineup_match.save()
+            lineup_match.set_tribe(tribe)
+            models.DiscordMember.bump_rating_versions([lineup_match.player.discord_member_id])
             await ctx.send(f'Player **{lineup_match.player.name}** assigned to tribe *{tribe.name if tribe else "None"}* in game {game.id} {tribe.emoji if tribe else ""}')
             models.GameLog.write(game_id=game.id, guild_id=game.guild_id, message=f'{models.GameLog.member_string(ctx.author)} assigned tribe of player {models.GameLog.member_string(lineup_match.player.discord_member)} to *{tribe.name if tribe else "None"}*')
 
@@ -2005,19 +2062,19 @@ async def game_search(self, ctx, mode: str, arg_list):
         if len(target_list) == 1 and target_list[0].upper() == 'ALL':
             results_str = f'All {status_str}s'
 
+            query = Game.search(status_filter=status_filter, guild_id=ctx.guild.id)
+            if status_filter == 2:
+                query = query.order_by(Game.completed_ts, Game.date, Game.id)  # reversing 'Incomplete' queries so oldest is at top
+
             def async_game_search():
                 utilities.connect()
-                query = Game.search(status_filter=status_filter, guild_id=ctx.guild.id)
-                if status_filter == 2:
-                    query = list(query)  # reversing 'Incomplete' queries so oldest is at top
-                    query.reverse()
                 logger.debug(f'Searching games, status filter: {status_filter}')
-                logger.debug(f'Returned {len(query)} results')
-                list_name = f'All {status_str}s ({len(query)})'
-                game_list = utilities.summarize_game_list(query[:500])
-                return game_list, list_name
+                result_count = query.count()
+                logger.debug(f'Returned {result_count} results')
+                list_name = f'All {status_str}s ({result_count})'
+                return result_count, list_name
 
-            game_list, list_name = await self.bot.loop.run_in_executor(None, async_game_search)
+            result_count, list_name = await self.bot.loop.run_in_executor(None, async_game_search)
         else:
             if not target_list:
                 # Target is person issuing command
@@ -2056,20 +2113,27 @@ def async_game_search():
             if not results_title:
                 results_str = 'No filters applied'
 
+            query = Game.search(status_filter=status_filter, player_filter=player_matches, team_filter=team_matches, title_filter=remaining_args, guild_id=ctx.guild.id, size_filter=team_sizes)
+
             def async_game_search():
                 utilities.connect()
-                query = Game.search(status_filter=status_filter, player_filter=player_matches, team_filter=team_matches, title_filter=remaining_args, guild_id=ctx.guild.id, size_filter=team_sizes)
                 logger.debug(f'Searching games, status filter: {status_filter}, player_filter: {player_matches}, team_filter: {team_matches}, title_filter: {remaining_args}')
-                logger.debug(f'Returned {len(query)} results')
-                game_list = utilities.summarize_game_list(query[:500], player_discord_id=player_discord_id)
-                list_name = f'{len(query)} {status_str}{"s" if len(query) != 1 else ""}\n{results_str}'
-                return game_list, list_name
+                result_count = query.count()
+                logger.debug(f'Returned {result_count} results')
+                list_name = f'{result_count} {status_str}{"s" if result_count != 1 else ""}\n{results_str}'
+                return result_count, list_name
 
-            game_list, list_name = await self.bot.loop.run_in_executor(None, async_game_search)
+            result_count, list_name = await self.bot.loop.run_in_executor(None, async_game_search)
 
-        if len(game_list) == 0:
+        if result_count == 0:
             return await ctx.send(f'No results. See `{ctx.prefix}help {ctx.invoked_with}` for usage examples. Searched for:\n{results_str}')
-        await utilities.paginate(self.bot, ctx, title=list_name, message_list=game_list, page_start=0, page_end=15, page_size=15)
+
+        def game_list_page(start, end):
+            # Only the games on the page being shown are loaded and summarized
+            utilities.connect()
+            return utilities.summarize_game_list(query.limit(end - start).offset(start), player_discord_id=player_discord_id)
+
+        await utilities.paginate(self.bot, ctx, title=list_name, page_provider=game_list_page, total=result_count, page_start=0, page_end=15, page_size=15)
 
     async def task_purge_game_channels(self):
         await self.bot.wait_until_ready()
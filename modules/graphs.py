@@ -0,0 +1,184 @@
+"""ELO graph rendering for the player and team cards and the lbteam chart. Rendering runs in a worker process, so pandas,
+scipy and matplotlib stay off the event loop and out of the executor threads.
+
+Charts are drawn with matplotlib's object-oriented Figure API onto an Agg canvas and returned as PNG bytes, so nothing touches
+pyplot's global state or the working directory. Functions that run in the worker take and return plain picklable values. The
+worker keeps one Figure per size and clears it between renders. warm_up() runs at startup, so a card graph only pays for
+drawing, not for importing matplotlib or creating a canvas.
+
+Each team's ELO history and its smoothed series are cached per (team_id, alltime) in the bot process. A team's entries are
+dropped when one of its games is confirmed or reversed, and every entry is dropped by a recalculation. As in
+leaderboard_cache, a generation counter keeps a history that was loaded before an invalidation from being stored after it.
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger('polybot.' + __name__)
+
+_lock = threading.Lock()
+_team_series = {}  # (team_id, alltime) -> ([(completed_ts, elo)], (dates, smoothed elos))
+_generation = 0
+_pool = None
+_figures = {}  # figsize -> Figure, reused between renders in the worker process
+
+CARD_FIGSIZE = (6.4, 4.8)  # matplotlib's default size
+LBTEAM_FIGSIZE = (12, 8)
+
+
+def pool():
+    # The renderer process pool, started on first use. The worker never uses the database connection it inherits.
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=1)
+        return _pool
+
+
+def replace_pool(broken: ProcessPoolExecutor):
+    # Drops a pool whose worker died, unless another caller has already replaced it. pool() starts a new one
+    global _pool
+    with _lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+async def render(loop, function, *args):
+    # Runs one of the render functions below in the worker. If the worker process died (ie. killed for using too much
+    # memory) the pool is broken for good, so start a new one and try once more
+    executor = pool()
+    try:
+        return await loop.run_in_executor(executor, function, *args)
+    except BrokenProcessPool:
+        logger.warning(f'graphs: renderer process pool is broken, restarting it to retry {function.__name__}')
+        replace_pool(executor)
+        return await loop.run_in_executor(pool(), function, *args)
+
+
+def team_histories(team_ids, alltime: bool):
+    # Returns (generation, {team_id: (points, smoothed)}) for every team with ELO history. Teams missing from the cache are
+    # loaded in one query and have smoothed None - render_team_chart() computes it, then pass the result to store_team_series()
+    from modules import models  # imported here since models imports this module
+
+    built_generation = _generation
+    with _lock:
+        histories = {team_id: _team_series[(team_id, alltime)] for team_id in team_ids if (team_id, alltime) in _team_series}
+
+    missing = [team_id for team_id in team_ids if team_id not in histories]
+    if missing:
+        loaded = models.EloEvent.histories('team', missing, ['elo_alltime' if alltime else 'elo'])
+        histories.update({team_id: (points, None) for team_id, points in loaded.items()})
+    return built_generation, histories
+
+
+def store_team_series(alltime: bool, histories, built_generation: int):
+    # histories is {team_id: (points, smoothed)}
+    with _lock:
+        if built_generation != _generation:
+            return  # invalidated while the chart was being drawn
+        for team_id, series in histories.items():
+            _team_series[(team_id, alltime)] = series
+
+
+def invalidate_team_series(team_ids=None, reason: str = ''):
+    # Drops the cached series of team_ids, or of every team if None
+    global _generation
+    with _lock:
+        _generation += 1
+        stale = [key for key in _team_series if team_ids is None or key[0] in team_ids]
+        for key in stale:
+            del _team_series[key]
+    if stale:
+        logger.debug(f'graphs: dropped {len(stale)} team series ({reason})')
+
+
+def smooth_team_history(points):
+    # Daily resampled and Savitzky-Golay smoothed ELO series of [(completed_ts, elo)], as (dates, elos)
+    import pandas as pd
+    import scipy.signal as signal
+
+    history = pd.DataFrame(points, columns=['completed_ts', 'elo'])
+    resampled = history.set_index('completed_ts').resample('D').mean().interpolate().reset_index()
+    filter_length = max(int(len(resampled.index) / 3), 1)
+    filter_length = filter_length if filter_length % 2 != 0 else filter_length - 1
+    poly_order = 2 if filter_length > 2 else 0
+
+    smoothed = signal.savgol_filter(resampled['elo'].values, filter_length, poly_order)
+    return resampled['completed_ts'].dt.to_pydatetime().tolist(), smoothed.tolist()
+
+
+def figure(figsize):
+    # This worker's Figure for figsize, cleared for a new chart
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = _figures.get(figsize)
+    if fig is None:
+        fig = _figures[figsize] = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+    else:
+        fig.clear()
+    return fig
+
+
+def finish(fig, ax, legend: bool = True):
+    # Styling shared by every chart, then the PNG bytes
+    fig.autofmt_xdate()
+    ax.yaxis.grid()
+
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+
+    if legend:
+        ax.legend(loc="best")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', transparent=False)
+    return buffer.getvalue()
+
+
+def warm_up():
+    # Runs in the worker once at startup: imports matplotlib and creates the canvases
+    for figsize in (CARD_FIGSIZE, LBTEAM_FIGSIZE):
+        fig = figure(figsize)
+        finish(fig, fig.subplots(), legend=False)
+
+
+def start():
+    # Starts the worker process and warms it up without waiting for it
+    pool().submit(warm_up)
+
+
+def render_elo_history(title: str, series):
+    # Runs in the worker. series is [(label, [(completed_ts, elo)])], one set of points per label, as for the player and team cards
+    fig = figure(CARD_FIGSIZE)
+    ax = fig.subplots()
+    fig.suptitle(title, fontsize=16)
+
+    for label, points in series:
+        ax.plot([p[0] for p in points], [p[1] for p in points], 'o', markersize=3, label=label)
+
+    return finish(fig, ax)
+
+
+def render_team_chart(title: str, teams):
+    # Runs in the worker. teams is [(team_id, name, color, points, smoothed)] in legend order, with smoothed None if not cached.
+    # Returns (PNG bytes, {team_id: (points, smoothed)}) so that the caller can cache the smoothed series.
+    fig = figure(LBTEAM_FIGSIZE)
+    ax = fig.subplots()
+    fig.suptitle(title, fontsize=16)
+
+    series = {}
+    for team_id, name, color, points, smoothed in teams:
+        if smoothed is None:
+            smoothed = smooth_team_history(points)
+        series[team_id] = (points, smoothed)
+
+        ax.plot([p[0] for p in points], [p[1] for p in points], 'o', markersize=3, alpha=.05, color=color)
+        ax.plot(smoothed[0], smoothed[1], '-', linewidth=2, label=name, color=color)
+
+    return finish(fig, ax, legend=bool(teams)), series
@@ -0,0 +1,75 @@
+"""In-process cache of rendered individual leaderboard pages (the rows shown by the lb command) and leaderboard sizes.
+
+Entries are keyed by (guild_id, version, max_flag, global_flag, allplayers_flag, page_start, movement), with guild_id None
+for global leaderboards, which are shared by every guild, and page_start None for the leaderboard size. A leaderboard only
+changes when a ranked game is confirmed, reversed, deleted or recalculated, when an ELO ban changes or when a display
+name changes, so those code paths call invalidate() - through db.on_commit(), so that a page rebuilt straight away
+cannot read the data from before the change. Entries also expire after MAX_AGE, since the 90 day activity cutoff and display names change
+without any such event.
+
+Leaderboards are built in executor threads while invalidation can happen on any thread, so every invalidation bumps a
+generation counter and put() discards a leaderboard that was built under an older generation.
+"""
+import logging
+import threading
+from timeit import default_timer as timer
+
+logger = logging.getLogger('polybot.' + __name__)
+
+MAX_AGE = 60 * 60  # seconds
+
+_lock = threading.Lock()
+_entries = {}  # key -> (built_at, value)
+_generation = 0
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'discarded': 0}
+
+
+def make_key(guild_id: int, version: str, max_flag: bool, global_flag: bool, allplayers_flag: bool, page_start: int = None, movement: str = None):
+    # movement is the snapshot that page rows show rank movement against, if any - see LeaderboardSnapshot
+    return (None if global_flag else guild_id, (version or '').upper(), bool(max_flag), bool(global_flag), bool(allplayers_flag), page_start, movement)
+
+
+def generation():
+    # Read before building a leaderboard and pass to put()
+    return _generation
+
+
+def get(key):
+    # Returns the cached value for key, or None
+    with _lock:
+        entry = _entries.get(key)
+        if entry and timer() - entry[0] < MAX_AGE:
+            stats['hits'] += 1
+            return entry[1]
+        _entries.pop(key, None)
+        stats['misses'] += 1
+        return None
+
+
+def put(key, value, built_generation: int):
+    with _lock:
+        if built_generation != _generation:
+            stats['discarded'] += 1  # invalidated while it was being built
+            return
+        _entries[key] = (timer(), value)
+
+
+def invalidate(guild_id: int = None, reason: str = ''):
+    # Drops the leaderboard pages of guild_id and of all global leaderboards, or everything if guild_id is None
+    global _generation
+    with _lock:
+        _generation += 1
+        stats['invalidations'] += 1
+        stale = [key for key in _entries if guild_id is None or key[0] is None or key[0] == guild_id]
+        for key in stale:
+            del _entries[key]
+    if stale:
+        logger.debug(f'leaderboard_cache: dropped {len(stale)} entries for guild {guild_id} ({reason})')
+
+
+def summary():
+    with _lock:
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f'{100 * stats["hits"] / lookups:.1f}%' if lookups else 'n/a'
+        return (f'{len(_entries)} cached leaderboard pages and sizes, {stats["hits"]} hits / {stats["misses"]} misses ({hit_rate}), '
+                f'{stats["invalidations"]} invalidations, {stats["discarded"]} discarded builds')
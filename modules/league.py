@@ -727,12 +727,9 @@ async def season(self, ctx, *, arg=None):
                         output.append(f'`{game.id}` *{game.name}* - **{side1.name()}** ({" / ".join(side1_roster)}) currently battling **{side2.name()}** ({" / ".join(side2_roster)}) ')
             else:
                 # regular standings summary
+                season_records = models.Team.season_records(team_ids=[team.id for team in poly_teams], season=season)
                 for team in poly_teams:
-                    season_record = team.get_season_record(season=season)  # (win_count_reg, loss_count_reg, incomplete_count_reg, win_count_post, loss_count_post, incomplete_count_post)
-                    if not season_record:
-                        logger.warning(f'No season record returned for team {team.name}')
-                        continue
-
+                    season_record = season_records.get(team.id, (0, 0, 0, 0, 0, 0))  # (win_count_reg, loss_count_reg, incomplete_count_reg, win_count_post, loss_count_post, incomplete_count_post)
                     standings.append((team, season_record[0], season_record[1], season_record[2], season_record[3], season_record[4], season_record[5]))
 
                 standings = sorted(standings, key=lambda x: (-x[4], -x[1], x[2]))  # should sort first by post-season wins desc, then wins descending then losses ascending
@@ -142,7 +142,7 @@ async def on_raw_reaction_remove(self, payload):
             return await feedback_destination.send(f'Game {game.id} has already started and cannot be left.')
 
         models.GameLog.write(game_id=game, guild_id=member.guild.id, message=f'{models.GameLog.member_string(member)} left the game (via reaction).')
-        lineup.delete_instance()
+        lineup.remove()
         await feedback_destination.send(f'Removing you from game {game.id}.')
 
     @commands.Cog.listener()
@@ -697,7 +697,7 @@ async def leave(self, ctx, game: PolyMatch = None):
             return await ctx.send(f'You are not a member of game {game.id}')
 
         models.GameLog.write(game_id=game, guild_id=ctx.guild.id, message=f'{models.GameLog.member_string(ctx.author)} left the game.')
-        lineup.delete_instance()
+        lineup.remove()
         await ctx.send('Removing you from the game.')
 
     @settings.in_bot_channel()
@@ -766,7 +766,7 @@ async def kick(self, ctx, game: PolyMatch, player: str):
 
         await ctx.send(f'Removing **{lineup.player.name}** from the game.')
         models.GameLog.write(game_id=game, guild_id=ctx.guild.id, message=f'{models.GameLog.member_string(ctx.author)} kicked {models.GameLog.member_string(lineup.player.discord_member)}')
-        lineup.delete_instance()
+        lineup.remove()
 
         if game.expiration < (datetime.datetime.now() + datetime.timedelta(hours=2)):
             # This catches the case of kicking someone from a full game, so that the game wont immediately get purged due to not being full
@@ -1021,6 +1021,7 @@ async def start(self, ctx, game: PolyMatch = None, *, name: str = None):
             game.date = datetime.datetime.today()
             game.is_pending = False
             game.save()
+            game.bump_rating_versions()
 
         logger.info(f'Game {game.id} closed and being tracked for ELO')
         models.GameLog.write(game_id=game, guild_id=ctx.guild.id, message=f'{models.GameLog.member_string(ctx.author)} started game with name *{discord.utils.escape_markdown(game.name)}*')
@@ -431,7 +431,25 @@ async def staffhelp(self, ctx, *, message: str = ''):
         models.GameLog.write(game_id=game_id, guild_id=ctx.guild.id, message=f'{models.GameLog.member_string(ctx.author)} requested staffhelp: *{message}*')
         await ctx.send('Your message has been sent to server staff. Please wait patiently or send additional information on your issue.')
 
-    @commands.command(hidden=True, aliases=['random_tribes', 'rtribe'], usage='game_size [-banned_tribe ...]')
+    @commands.command(aliases=['tribestats', 'populartribes'], usage=None)
+    @settings.in_bot_channel_strict()
+    async def tribes(self, ctx):
+        """ Display how often each tribe is played on this server and overall """
+
+        local_counts = {tribe.id: count for tribe, count in models.TribeUsage.popularity(guild_id=ctx.guild.id)}
+        global_popularity = models.TribeUsage.popularity()
+        local_total, global_total = sum(local_counts.values()), sum(count for _, count in global_popularity)
+        if not global_total:
+            return await ctx.send('No tribes have been logged for any games yet.')
+
+        output = ['__**Tribe Popularity**__ - share of games with a tribe logged, global (local)']
+        for tribe, count in global_popularity:
+            local_share = f'{100 * local_counts.get(tribe.id, 0) / local_total:.1f}%' if local_total else 'n/a'
+            output.append(f'{tribe.emoji if tribe.emoji else ""} **{tribe.name}**: {100 * count / global_total:.1f}% ({local_share})')
+
+        await utilities.buffered_send(destination=ctx, content='\n'.join(output))
+
+    @commands.command(hidden=True, aliases=['random_tribes', 'rtribe'], usage='game_size [-banned_tribe ...] [popular]')
     @settings.in_bot_channel()
     async def rtribes(self, ctx, size='1v1', *args):
         """Show a random tribe combination for a given game size.
@@ -439,6 +457,7 @@ async def rtribes(self, ctx, size='1v1', *args):
         **Example:**
         `[p]rtribes 2v2` - Shows Ai-mo/Imperius & Xin-xi/Luxidoor
         `[p]rtribes 2v2 -hoodrick -aquarion` - Remove Hoodrick and Aquarion from the random pool. This could cause problems if lots of tribes are removed.
+        `[p]rtribes 2v2 popular` - Favor the tribes that are played most often on this server
         """
 
         m = re.match(r"(\d+)v(\d+)", size.lower())
@@ -483,13 +502,27 @@ async def rtribes(self, ctx, size='1v1', *args):
         for tribe, group in tribes:
             tribe_groups.setdefault(group, set()).add(tribe)
 
+        if any(arg.lower() == 'popular' for arg in args):
+            # weight each tribe by how many games it has been logged for on this server
+            tribe_counts = {tribe.name.upper(): count for tribe, count in models.TribeUsage.popularity(guild_id=ctx.guild.id)}
+        else:
+            tribe_counts = {}
+
+        def pick(tribe_group):
+            weights = [tribe_counts.get(tribe.upper(), 0) + 1 for tribe in tribe_group]
+            return random.choices(tribe_group, weights=weights)[0]
+
         available_tribe_groups = list(tribe_groups.values())
         for _ in range(team_size):
             available_tribe_groups = [tg for tg in available_tribe_groups if len(tg) >= 2]
 
             this_tribe_group = random.choice(available_tribe_groups)
 
-            new_home, new_away = random.sample(this_tribe_group, 2)
+            if tribe_counts:
+                new_home = pick(sorted(this_tribe_group))
+                new_away = pick(sorted(this_tribe_group - {new_home}))
+            else:
+                new_home, new_away = random.sample(this_tribe_group, 2)
             this_tribe_group.remove(new_home)
             this_tribe_group.remove(new_away)
 
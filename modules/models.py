@@ -5,24 +5,105 @@
 import logging
 import os
 import re
+import threading
+from collections import namedtuple
 from typing import Any, Dict, List
 
 import discord
 from discord.ext import commands
 
 from peewee import *
+from peewee import _savepoint
 from playhouse.postgres_ext import *
 from psycopg2.errors import DuplicateObject
 
 import settings
 import statistics
-from modules import channels, exceptions
+from modules import channels, elo, exceptions, graphs, leaderboard_cache, rating_index
 
 
 logger = logging.getLogger('polybot.' + __name__)
 elo_logger = logging.getLogger('polybot.elo')
 
-db = PostgresqlExtDatabase(settings.psql_db, autorollback=True, user=settings.psql_user, autoconnect=False, password='password')
+
+class CallbackSavepoint(_savepoint):
+    # A savepoint with its own level of on_commit() callbacks, dropped if the savepoint rolls back and otherwise handed to the
+    # enclosing level - so callbacks queued inside a savepoint only run if the outermost transaction commits with its changes in it
+
+    def __enter__(self):
+        self.callbacks = []
+        self.db.callback_state().levels.append(self.callbacks)
+        return super().__enter__()
+
+    def rollback(self):
+        super().rollback()
+        self.callbacks.clear()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return super().__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            levels = self.db.callback_state().levels
+            levels.pop()  # savepoints nest, so this is self.callbacks
+            levels[-1].extend(self.callbacks)
+
+
+class BotDatabase(PostgresqlExtDatabase):
+    # Adds on_commit(), for cache invalidation that has to wait until other connections can read the change
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._commit_callbacks = threading.local()  # transactions are per thread, like the connection
+
+    def callback_state(self):
+        # .levels: [callbacks of the outermost transaction, then one list for each open savepoint, innermost last]
+        # .committed: callbacks whose transaction has committed, waiting for it to leave the transaction stack
+        state = self._commit_callbacks
+        if not hasattr(state, 'levels'):
+            state.levels, state.committed = [[]], []
+        return state
+
+    def on_commit(self, callback):
+        # Runs callback once the outermost transaction has committed and exited (dropped if it or the savepoint the callback
+        # was queued in rolls back), or now if there is no transaction
+        if self.in_transaction():
+            self.callback_state().levels[-1].append(callback)
+        else:
+            callback()
+
+    def savepoint(self):
+        return CallbackSavepoint(self)
+
+    def commit(self):
+        result = super().commit()
+        state = self.callback_state()
+        for level in state.levels:
+            state.committed.extend(level)
+            level.clear()
+        if not self.in_transaction():
+            self.run_committed_callbacks()
+        return result
+
+    def rollback(self):
+        for level in self.callback_state().levels:
+            level.clear()
+        return super().rollback()
+
+    def pop_transaction(self):
+        # db.atomic() commits before it leaves the transaction stack - wait until it has, so callbacks see in_transaction() False
+        transaction = super().pop_transaction()
+        if not self.in_transaction():
+            self.run_committed_callbacks()
+        return transaction
+
+    def run_committed_callbacks(self):
+        state = self.callback_state()
+        callbacks, state.committed = state.committed, []
+        for callback in callbacks:
+            callback()
+
+
+db = BotDatabase(settings.psql_db, autorollback=True, user=settings.psql_user, autoconnect=False, password='password')
 
 
 def tomorrow():
@@ -54,6 +135,63 @@ def moonrise_or_air_date_range(version: str = None):
         return air
 
 
+# rank is None (and percentile None) if the entity is not on the leaderboard.
+# neighbors is a list of (id, elo, rank) around the entity, including the entity itself
+LeaderboardPosition = namedtuple('LeaderboardPosition', ['rank', 'total', 'percentile', 'neighbors'])
+
+
+def ranked_leaderboard(leaderboard_query):
+    # Ranks leaderboard_query (a Player/DiscordMember.leaderboard() query, which selects elo_field) in the database with
+    # RANK() OVER (ORDER BY elo_field DESC, id) - the same order the leaderboard is displayed in.
+    # Selects id, elo_field, rank and total (the leaderboard size) - use as a subquery or CTE
+    lb = leaderboard_query.order_by().alias('lb')
+    return Select([lb], [lb.c.id, lb.c.elo_field, fn.RANK().over(order_by=[lb.c.elo_field.desc(), lb.c.id]).alias('rank'),
+                         fn.COUNT(SQL('*')).over().alias('total')])
+
+
+def leaderboard_position(leaderboard_query, entity_id: int, neighbors: int = 0):
+    # Returns the entity's rank in leaderboard_query, the leaderboard size and the entries up to `neighbors` places above
+    # and below, in one query. When the entity is not ranked only the top entry comes back, so that the total is still known.
+    ranked = ranked_leaderboard(leaderboard_query).cte('ranked')
+    me = Select([ranked], [ranked.c.rank]).where(ranked.c.id == entity_id).cte('me')
+    query = Select([ranked], [ranked.c.id, ranked.c.elo_field, ranked.c.rank, ranked.c.total]).join(me, JOIN.LEFT_OUTER, on=SQL('TRUE')).where(
+        (ranked.c.rank.between(me.c.rank - neighbors, me.c.rank + neighbors)) | (me.c.rank.is_null() & (ranked.c.rank == 1))
+    ).order_by(ranked.c.rank).with_cte(ranked, me).bind(db)
+
+    rows = list(query.tuples())
+    if not rows:
+        return LeaderboardPosition(None, 0, None, [])
+    total = rows[0][3]
+    rank = next((row_rank for row_id, elo, row_rank, row_total in rows if row_id == entity_id), None)
+    if rank is None:
+        return LeaderboardPosition(None, total, None, [])
+    percentile = round(100 * (total - rank) / total, 1)  # share of the leaderboard ranked below this entity
+    return LeaderboardPosition(rank, total, percentile, [(row_id, elo, row_rank) for row_id, elo, row_rank, row_total in rows])
+
+
+def leaderboard_rows(entity_query, records_query=None, sort_column: str = 'elo_field', limit: int = 2000, offset: int = 0):
+    # Renders `limit` rows, starting after the first `offset`, of a Player or DiscordMember leaderboard-style query (which must be
+    # ordered by sort_column descending, then id) as dicts in a single query. Each dict holds the entity's columns and any aliases
+    # selected by entity_query, plus:
+    #   wins, losses - from records_query (see Player/DiscordMember.record_counts()), if given
+    #   team_emoji - for Player queries, so that rendering does not fetch each player's Team
+    base = entity_query.limit(limit).offset(offset).alias('base')
+    columns = [SQL('base.*')]
+    query = Select([base])
+
+    if records_query is not None:
+        records = records_query.alias('records')
+        columns.extend([fn.COALESCE(records.c.wins, 0).alias('wins'), fn.COALESCE(records.c.losses, 0).alias('losses')])
+        query = query.join(records, JOIN.LEFT_OUTER, on=(records.c.entity_id == base.c.id))
+
+    if entity_query.model is Player:
+        columns.append(Team.emoji.alias('team_emoji'))
+        query = query.join(Team, JOIN.LEFT_OUTER, on=(Team.id == base.c.team_id))
+
+    query = query.select(*columns).order_by(base.c[sort_column].desc(), base.c.id).bind(db)
+    return list(query.dicts())
+
+
 def string_to_user_id(input):
     # copied from Utilities - probably a better way to structure this but currently importing utilities creates circular import
 
@@ -140,14 +278,7 @@ def completed_game_count(self):
 
     def change_elo_after_game(self, chance_of_winning: float, is_winner: bool):
 
-        max_elo_delta = 32
-
-        if is_winner is True:
-            elo_delta = int(round((max_elo_delta * (1 - chance_of_winning)), 0))
-        else:
-            elo_delta = int(round((max_elo_delta * (0 - chance_of_winning)), 0))
-
-        return elo_delta
+        return elo.team_elo_delta(chance_of_winning, is_winner)
 
     def get_record(self, alltime=True):
 
@@ -175,21 +306,30 @@ def get_season_record(self, season=None):
         if self.guild_id != settings.server_ids['polychampions'] or self.is_hidden:
             return ()
 
-        full_season_games, regular_season_games, post_season_games = Game.polychamps_season_games(league='all', season=season)
-
-        losses = Game.search(status_filter=4, team_filter=[self])
-        wins = Game.search(status_filter=3, team_filter=[self])
-        incomplete = Game.search(status_filter=2, team_filter=[self])
-
-        win_count_reg = Game.select(Game.id).where(Game.id.in_(wins) & Game.id.in_(regular_season_games)).count()
-        loss_count_reg = Game.select(Game.id).where(Game.id.in_(losses) & Game.id.in_(regular_season_games)).count()
-        incomplete_count_reg = Game.select(Game.id).where(Game.id.in_(incomplete) & Game.id.in_(regular_season_games)).count()
-
-        win_count_post = Game.select(Game.id).where(Game.id.in_(wins) & Game.id.in_(post_season_games)).count()
-        loss_count_post = Game.select(Game.id).where(Game.id.in_(losses) & Game.id.in_(post_season_games)).count()
-        incomplete_count_post = Game.select(Game.id).where(Game.id.in_(incomplete) & Game.id.in_(post_season_games)).count()
-
-        return (win_count_reg, loss_count_reg, incomplete_count_reg, win_count_post, loss_count_post, incomplete_count_post)
+        return Team.season_records(team_ids=[self.id], season=season).get(self.id, (0, 0, 0, 0, 0, 0))
+
+    def season_records(team_ids, season=None):
+        # Returns {team_id: (win_count_reg, loss_count_reg, incomplete_count_reg, win_count_post, loss_count_post, incomplete_count_post)}
+        # for polychampions season games (all seasons if season is None), in one query grouped by team.
+        # Teams without season games are left out. Wins and losses count as Game.search(status_filter=3/4) would
+        decided = (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_pending == 0)
+        won, lost, incomplete = decided & (GameSide.id == Game.winner), decided & (GameSide.id != Game.winner), (Game.is_confirmed == 0)
+        regular, post = (Game.is_postseason == 0), (Game.is_postseason == 1)
+
+        season_filter = (Game.season == season) if season else (Game.season.is_null(False))
+        query = GameSide.select(
+            GameSide.team,
+            fn.COUNT(SQL('*')).filter(won & regular),
+            fn.COUNT(SQL('*')).filter(lost & regular),
+            fn.COUNT(SQL('*')).filter(incomplete & regular),
+            fn.COUNT(SQL('*')).filter(won & post),
+            fn.COUNT(SQL('*')).filter(lost & post),
+            fn.COUNT(SQL('*')).filter(incomplete & post)
+        ).join(Game, on=(GameSide.game == Game.id)).where(
+            season_filter & (GameSide.team.in_(team_ids)) & (GameSide.size > 1)
+        ).group_by(GameSide.team)
+
+        return {row[0]: tuple(row[1:]) for row in query.tuples()}
 
     def related_external_severs(guild_id: int):
         # return a list of external server IDs from a given guild_id
@@ -211,6 +351,9 @@ class DiscordMember(BaseModel):
     elo_max_alltime = SmallIntegerField(default=1000)
     elo_moonrise = SmallIntegerField(default=1000)
     elo_max_moonrise = SmallIntegerField(default=1000)
+    ranked_game_count = IntegerField(default=0)  # confirmed ranked games in global-leaderboard servers, maintained by declare_winner/reverse_elo_changes. See Game.unconfirmed_claim_counts()
+    ranked_game_count_moonrise = IntegerField(default=0)  # subset of ranked_game_count dated on/after settings.moonrise_reset_date
+    rating_version = IntegerField(default=0)  # bumped by any rating or game change shown on this member's player card, see modules.player_card
     polytopia_id = TextField(null=True)
     polytopia_name = TextField(null=True)
     is_banned = BooleanField(default=False)
@@ -244,77 +387,18 @@ def as_json(self, include_games: bool) -> Dict[str, Any]:
     def mention(self):
         return f'<@{self.discord_id}>'
 
-    def advanced_stats(self):
-
-        server_list = settings.servers_included_in_global_lb()
+    def bump_rating_versions(member_ids=None):
+        # Marks the cached player cards of member_ids (a list or subquery of DiscordMember ids, or every member if None) as stale
+        query = DiscordMember.update(rating_version=DiscordMember.rating_version + 1)
+        if member_ids is not None:
+            query = query.where(DiscordMember.id.in_(member_ids))
+        query.execute()
 
-        ranked_games_played = Game.select().join(Lineup).join(Player).where(
-            (Player.discord_member == self) &
-            (Game.is_completed == 1) &
-            (Game.is_ranked == 1) &
-            (Game.is_confirmed == 1) &
-            (Game.guild_id.in_(server_list))
-        ).order_by(Game.completed_ts).prefetch(GameSide, Lineup, Player)
-
-        winning_streak, losing_streak, longest_winning_streak, longest_losing_streak = 0, 0, 0, 0
-        v2_count, v3_count = 0, 0  # wins of 1v2 or 1v3 games
-        duel_wins, duel_losses = 0, 0  # 1v1 matchup stats
-        wins_as_host = 0
-        last_win, last_loss = False, False
-
-        for game in ranked_games_played:
-
-            is_winner = False
-            won_as_host = False
-            gamesides = game.ordered_side_list()
-            for gs in gamesides:
-                # going through in this way uses the results already in memory rather than a bunch of new DB queries
-                if gs.id == game.winner_id:
-                    winner = gs
-                    first_loop = True
-                    for l in gs.ordered_player_list():
-                        if l.player.discord_member_id == self.id:
-                            is_winner = True
-                            if first_loop:
-                                won_as_host = True
-                        first_loop = False
-                    break
-
-            logger.debug(f'Game {game.id} completed_ts {game.completed_ts} is a {"win" if is_winner else "loss"} WS: {winning_streak} LS: {losing_streak} last_win: {last_win} last_loss: {last_loss}')
-            if is_winner:
-                if won_as_host:
-                    wins_as_host += 1
-                if last_win:
-                    # winning streak is extended
-                    winning_streak += 1
-                    longest_winning_streak = winning_streak if (winning_streak > longest_winning_streak) else longest_winning_streak
-                else:
-                    # winning streak is broken
-                    winning_streak = 1
-                    last_win, last_loss = True, False
-                if len(winner.lineup) == 1 and len(gamesides) == 2:
-                    size_of_opponent = game.largest_team()
-
-                    if size_of_opponent == 1:
-                        duel_wins += 1
-                    elif size_of_opponent == 2:
-                        v2_count += 1
-                    elif size_of_opponent == 3:
-                        v3_count += 1
-            else:
-                if last_loss:
-                    # losing streak is extended
-                    losing_streak += 1
-                    longest_losing_streak = losing_streak if losing_streak > longest_losing_streak else longest_losing_streak
-                else:
-                    # winning streak is broken
-                    losing_streak = 1
-                    last_win, last_loss = False, True
-
-                if len(game.gamesides) == 2 and game.largest_team() == 1 and game.smallest_team() == 1:
-                    duel_losses += 1
-
-        return (longest_winning_streak, longest_losing_streak, v2_count, v3_count, duel_wins, duel_losses, wins_as_host, len(ranked_games_played))
+    def advanced_stats(self):
+        # (longest_winning_streak, longest_losing_streak, v2_count, v3_count, duel_wins, duel_losses, wins_as_host, ranked_games_played)
+        # read from this member's MemberStats row
+        stats = MemberStats.get_or_none(MemberStats.discord_member == self.id)
+        return stats.as_tuple() if stats else (0, 0, 0, 0, 0, 0, 0, 0)
 
     def update_name(self, new_name: str):
         self.name = new_name
@@ -360,6 +444,24 @@ def get_record(self, version: str = None):
 
         return (self.wins(version=version).count(), self.losses(version=version).count())
 
+    def record_counts(version: str = None):
+        # Wins and losses of every member in one grouped query, counted the same way as wins()/losses().
+        # Rows of (entity_id, wins, losses) - use as records_query for leaderboard_rows()
+        date_min, date_max = moonrise_or_air_date_range(version=version)
+        server_list = settings.servers_included_in_global_lb()
+
+        return Lineup.select(
+            Player.discord_member.alias('entity_id'),
+            fn.COUNT(SQL('*')).filter(Game.winner == Lineup.gameside).alias('wins'),
+            fn.COUNT(SQL('*')).filter(Game.winner != Lineup.gameside).alias('losses')
+        ).join(Game).join_from(Lineup, Player).where(
+            (Game.is_completed == 1) &
+            (Game.is_confirmed == 1) &
+            (Game.is_ranked == 1) &
+            (Game.guild_id.in_(server_list)) &
+            (Game.date >= date_min) & (Game.date <= date_max)
+        ).group_by(Player.discord_member)
+
     def get_polychamps_record(self):
 
         try:
@@ -367,32 +469,28 @@ def get_polychamps_record(self):
         except exceptions.NoSingleMatch:
             return None
 
-        all_season_games = Game.polychamps_season_games(league='all')[0]
-        pro_season_games = Game.polychamps_season_games(league='pro')[0]
-        junior_season_games = Game.polychamps_season_games(league='junior')[0]
-
-        losses = Game.search(status_filter=4, player_filter=[pc_player])
-        wins = Game.search(status_filter=3, player_filter=[pc_player])
-
-        total_win_count = Game.select(Game.id).where(Game.id.in_(wins) & Game.id.in_(all_season_games)).count()
-
-        total_loss_count = Game.select(Game.id).where(Game.id.in_(losses) & Game.id.in_(all_season_games)).count()
-
-        if not total_win_count and not total_loss_count:
+        # One pass over the player's season game lineups, counted as Game.search(status_filter=3/4) would
+        won, lost = (Game.winner == Lineup.gameside), (Game.winner != Lineup.gameside)
+        pro, junior = (Game.league == 'P'), (Game.league == 'J')
+        record = Lineup.select(
+            fn.COUNT(SQL('*')).filter(won).alias('wins'),
+            fn.COUNT(SQL('*')).filter(lost).alias('losses'),
+            fn.COUNT(SQL('*')).filter(won & pro).alias('pro_wins'),
+            fn.COUNT(SQL('*')).filter(lost & pro).alias('pro_losses'),
+            fn.COUNT(SQL('*')).filter(won & junior).alias('junior_wins'),
+            fn.COUNT(SQL('*')).filter(lost & junior).alias('junior_losses')
+        ).join(Game, on=(Lineup.game == Game.id)).where(
+            (Lineup.player == pc_player) & (Game.season.is_null(False)) &
+            (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_pending == 0)
+        ).dicts().get()
+
+        if not record['wins'] and not record['losses']:
             return None
 
-        pro_win_count = Game.select(Game.id).where(Game.id.in_(wins) & Game.id.in_(pro_season_games)).count()
-
-        pro_loss_count = Game.select(Game.id).where(Game.id.in_(losses) & Game.id.in_(pro_season_games)).count()
-
-        junior_win_count = Game.select(Game.id).where(Game.id.in_(wins) & Game.id.in_(junior_season_games)).count()
-
-        junior_loss_count = Game.select(Game.id).where(Game.id.in_(losses) & Game.id.in_(junior_season_games)).count()
-
         return {
-            'full_record': (total_win_count, total_loss_count),
-            'pro_record': (pro_win_count, pro_loss_count),
-            'junior_record': (junior_win_count, junior_loss_count)
+            'full_record': (record['wins'], record['losses']),
+            'pro_record': (record['pro_wins'], record['pro_losses']),
+            'junior_record': (record['junior_wins'], record['junior_losses'])
         }
 
     def games_played(self, in_days: int = None):
@@ -434,21 +532,13 @@ def completed_game_count(self, only_ranked: bool = True, moonrise: bool = False)
         return num_games
 
     def leaderboard_rank(self, date_cutoff):
-        # TODO: This could be replaced with Postgresql Window functions to have the DB calculate the rank.
-        # Advantages: Probably moderately more efficient, and will resolve ties in a sensible way
-        # But no idea how to write the query :/
-        # http://docs.peewee-orm.com/en/latest/peewee/query_examples.html#find-the-top-three-revenue-generating-facilities
-
-        query = DiscordMember.leaderboard(date_cutoff=date_cutoff)
+        # Returns (rank, leaderboard size). Rank is None if not on the leaderboard
+        position = self.leaderboard_position(date_cutoff)
+        return (position.rank, position.total)
 
-        is_found = False
-        for counter, p in enumerate(query.tuples()):
-            if p[0] == self.id:
-                is_found = True
-                break
-
-        rank = counter + 1 if is_found else None
-        return (rank, query.count())
+    def leaderboard_position(self, date_cutoff, neighbors: int = 0, max_flag: bool = False, version: str = None):
+        # LeaderboardPosition with rank, total, percentile and the members `neighbors` places above and below on the global leaderboard
+        return leaderboard_position(DiscordMember.leaderboard(date_cutoff=date_cutoff, max_flag=max_flag, version=version), self.id, neighbors)
 
     def leaderboard(date_cutoff, guild_id: int = None, max_flag: bool = False, version: str = None):
         # guild_id is a dummy parameter so DiscordMember.leaderboard and Player.leaderboard can be called in identical ways
@@ -481,9 +571,9 @@ def favorite_tribes(self, limit=3):
         # Returns a list of dicts of format:
         # {'tribe': 7, 'emoji': '<:luxidoor:448015285212151809>', 'name': 'Luxidoor', 'tribe_count': 14}
 
-        q = Lineup.select(Lineup.tribe, Tribe.emoji, Tribe.name, fn.COUNT(Lineup.tribe).alias('tribe_count')).join(Tribe).join_from(Lineup, Player).where(
-            (Lineup.player.discord_member == self) & (Lineup.tribe.is_null(False))
-        ).group_by(Lineup.tribe, Lineup.tribe.emoji, Tribe.name).order_by(-SQL('tribe_count')).limit(limit)
+        q = TribeUsage.select(TribeUsage.tribe, Tribe.emoji, Tribe.name, fn.SUM(TribeUsage.tribe_count).alias('tribe_count')).join(Tribe).where(
+            (TribeUsage.discord_member == self) & (TribeUsage.tribe_count > 0)
+        ).group_by(TribeUsage.tribe, Tribe.emoji, Tribe.name).order_by(-SQL('tribe_count'), TribeUsage.tribe).limit(limit)
 
         return q.dicts()
 
@@ -522,6 +612,8 @@ class Player(BaseModel):
     elo_max_alltime = SmallIntegerField(default=1000)
     elo_moonrise = SmallIntegerField(default=1000)
     elo_max_moonrise = SmallIntegerField(default=1000)
+    ranked_game_count = IntegerField(default=0)  # confirmed ranked games, maintained by declare_winner/reverse_elo_changes. See Game.unconfirmed_claim_counts()
+    ranked_game_count_moonrise = IntegerField(default=0)  # subset of ranked_game_count dated on/after settings.moonrise_reset_date
     trophies = ArrayField(CharField, null=True)
     is_banned = BooleanField(default=False)
 
@@ -543,6 +635,9 @@ def generate_display_name(self=None, player_name=None, player_nick=None):
             display_name = player_name
 
         if self:
+            if display_name != self.name:
+                # leaderboard pages show display names
+                db.on_commit(lambda: leaderboard_cache.invalidate(self.guild_id, reason=f'display name changed for player {self.id}'))
             self.name = display_name
             self.nick = player_nick
             self.save()
@@ -774,22 +869,31 @@ def get_record(self, version: str = None):
 
         return (self.wins(version=version).count(), self.losses(version=version).count())
 
-    def leaderboard_rank(self, date_cutoff):
-        # TODO: This could be replaced with Postgresql Window functions to have the DB calculate the rank.
-        # Advantages: Probably moderately more efficient, and will resolve ties in a sensible way
-        # But no idea how to write the query :/
-        # http://docs.peewee-orm.com/en/latest/peewee/query_examples.html#find-the-top-three-revenue-generating-facilities
+    def record_counts(guild_id: int, version: str = None):
+        # Wins and losses of every player in the guild in one grouped query, counted the same way as wins()/losses().
+        # Rows of (entity_id, wins, losses) - use as records_query for leaderboard_rows()
+        date_min, date_max = moonrise_or_air_date_range(version=version)
 
-        query = Player.leaderboard(date_cutoff=date_cutoff, guild_id=self.guild_id)
+        return Lineup.select(
+            Lineup.player.alias('entity_id'),
+            fn.COUNT(SQL('*')).filter(Game.winner == Lineup.gameside).alias('wins'),
+            fn.COUNT(SQL('*')).filter(Game.winner != Lineup.gameside).alias('losses')
+        ).join(Game).where(
+            (Game.guild_id == guild_id) &
+            (Game.is_completed == 1) &
+            (Game.is_confirmed == 1) &
+            (Game.is_ranked == 1) &
+            (Game.date >= date_min) & (Game.date <= date_max)
+        ).group_by(Lineup.player)
 
-        player_found = False
-        for counter, p in enumerate(query.tuples()):
-            if p[0] == self.id:
-                player_found = True
-                break
+    def leaderboard_rank(self, date_cutoff):
+        # Returns (rank, leaderboard size). Rank is None if not on the leaderboard
+        position = self.leaderboard_position(date_cutoff)
+        return (position.rank, position.total)
 
-        rank = counter + 1 if player_found else None
-        return (rank, query.count())
+    def leaderboard_position(self, date_cutoff, neighbors: int = 0, max_flag: bool = False, version: str = None):
+        # LeaderboardPosition with rank, total, percentile and the players `neighbors` places above and below on this guild's leaderboard
+        return leaderboard_position(Player.leaderboard(date_cutoff=date_cutoff, guild_id=self.guild_id, max_flag=max_flag, version=version), self.id, neighbors)
 
     def leaderboard(date_cutoff, guild_id: int, max_flag: bool = False, version: str = None):
 
@@ -825,9 +929,9 @@ def favorite_tribes(self, limit=3):
         # Returns a list of dicts of format:
         # {'tribe': 7, 'emoji': '<:luxidoor:448015285212151809>', 'name': 'Luxidoor', 'tribe_count': 14}
 
-        q = Lineup.select(Lineup.tribe, Tribe.emoji, Tribe.name, fn.COUNT(Lineup.tribe).alias('tribe_count')).join(Tribe).where(
-            (Lineup.player == self) & (Lineup.tribe.is_null(False))
-        ).group_by(Lineup.tribe, Lineup.tribe.emoji, Tribe.name).order_by(-SQL('tribe_count')).limit(limit)
+        q = TribeUsage.select(TribeUsage.tribe, Tribe.emoji, Tribe.name, TribeUsage.tribe_count).join(Tribe).where(
+            (TribeUsage.discord_member == self.discord_member_id) & (TribeUsage.guild_id == self.guild_id) & (TribeUsage.tribe_count > 0)
+        ).order_by(-TribeUsage.tribe_count, TribeUsage.tribe).limit(limit)
 
         return q.dicts()
 
@@ -917,6 +1021,15 @@ class Game(BaseModel):
     game_chan = BitField(default=None, null=True)
     size = ArrayField(SmallIntegerField, default=[0])
     is_mobile = BooleanField(default=True)
+    season = SmallIntegerField(null=True, default=None)  # PolyChampions season tag parsed from name by save(), see season_tags()
+    league = TextField(null=True, default=None)  # 'P' or 'J' for a season game. None if the tag has no league letter
+    is_postseason = BooleanField(default=False)
+    search_vector = TSVectorField(null=True, index=False)  # name and notes for Game.search() title_filter, kept in step by save()
+
+    SEARCH_CONFIG = 'simple'  # text search configuration for search_vector. No stemming or stop words since names are mostly made-up words
+
+    # (season, league, is_postseason) and search_vector (GIN) are indexed by migrator.py. They are not declared on the model, since
+    # create_tables() would try to create them on an existing game table before the migration adds the columns
 
     def as_json(self, include_users: bool = False) -> Dict[str, Any]:
         """Get the game as a dict for returning from the API."""
@@ -947,6 +1060,14 @@ def __setattr__(self, name, value):
             value = value.strip('\"').strip('\'').strip('”').strip('“').title()[:35].strip() if value else value
         return super().__setattr__(name, value)
 
+    def save(self, *args, **kwargs):
+        # Keeps the season tag columns in step with the name whenever a game is named or renamed
+        if self._dirty & {'name', 'guild_id', 'size'}:
+            self.season, self.league, self.is_postseason = Game.season_tags(self.name, self.guild_id, self.size)
+        if self._dirty & {'name', 'notes'}:
+            self.search_vector = fn.to_tsvector(Game.SEARCH_CONFIG, ' '.join(filter(None, (self.name, self.notes))))
+        return super().save(*args, **kwargs)
+
     async def create_game_channels(self, guild_list, guild_id):
         logger.debug(f'in create_game_channels for game {self.id}')
         guild = discord.utils.get(guild_list, id=guild_id)
@@ -1613,72 +1734,153 @@ def create_game(
                 for player in player_group:
                     Lineup.create(game=newgame, gameside=gameside, player=player)
 
+            newgame.bump_rating_versions()
+
         return newgame, warnings
 
     def reverse_elo_changes(self):
+        # Set-based: the rating changes come from this game's EloEvent rows, so nothing is loaded record by record
         logger.debug(f'reverse_elo_changes for game {self.id}')
-        for lineup in self.lineup:
-            lineup.player.elo += lineup.elo_change_player * -1
-            lineup.player.elo_alltime += lineup.elo_change_player_alltime * -1
-            lineup.player.elo_moonrise += lineup.elo_change_player_moonrise * -1
-            lineup.player.save()
-            lineup.elo_change_player = 0
-            lineup.elo_change_player_alltime = 0
-            lineup.elo_change_player_moonrise = 0
-            lineup.elo_after_game = None
-            lineup.elo_after_game_alltime = None
-            lineup.elo_after_game_global = None
-            lineup.elo_after_game_global_alltime = None
-            lineup.elo_after_game_moonrise = None
-            lineup.elo_after_game_global_moonrise = None
-
-            if lineup.elo_change_discordmember_alltime or lineup.elo_change_discordmember or lineup.elo_change_discordmember_moonrise:
-                lineup.player.discord_member.elo += lineup.elo_change_discordmember * -1
-                lineup.player.discord_member.elo_alltime += lineup.elo_change_discordmember_alltime * -1
-                lineup.player.discord_member.elo_moonrise += lineup.elo_change_discordmember_moonrise * -1
-                lineup.player.discord_member.save()
-                lineup.elo_change_discordmember = 0
-                lineup.elo_change_discordmember_alltime = 0
-                lineup.elo_change_discordmember_moonrise = 0
-            lineup.save()
-
-        for gameside in self.gamesides:
-            if gameside.elo_change_squad and gameside.squad:
-                gameside.squad.elo += (gameside.elo_change_squad * -1)
-                gameside.squad.save()
-                gameside.elo_change_squad = 0
+        lineup_reset = {}
+        for entity_type, flavor, change_field, aftergame_field in EloEvent.LINEUP_FLAVORS:
+            lineup_reset.update({change_field: 0, aftergame_field: None})
 
-            if gameside.elo_change_team and gameside.team:
-                gameside.team.elo += (gameside.elo_change_team * -1)
-                gameside.team.save()
-                gameside.elo_change_team = 0
-
-            if gameside.elo_change_team_alltime and gameside.team:
-                gameside.team.elo_alltime += (gameside.elo_change_team_alltime * -1)
-                gameside.team.save()
-                gameside.elo_change_team_alltime = 0
-
-            gameside.team_elo_after_game = None
-            gameside.team_elo_after_game_alltime = None
-            gameside.save()
+        with db.atomic():
+            EloEvent.reverse_game(self)
+            self.bump_rating_versions()
+            if self.is_confirmed and self.is_ranked:
+                RatingCheckpoint.invalidate_since(self.completed_ts)
+            Lineup.update(**lineup_reset).where(Lineup.game == self).execute()
+            GameSide.update(elo_change_team=0, elo_change_team_alltime=0, elo_change_squad=0,
+                            team_elo_after_game=None, team_elo_after_game_alltime=None).where(GameSide.game == self).execute()
+
+            if self.is_confirmed and self.is_ranked:
+                self.update_ranked_game_counts(increment=-1)
+            if self.is_confirmed:
+                # this game still reads as confirmed until the caller clears its result, so leave it out of the recount
+                SquadStats.refresh(self.squad_ids(), exclude_game=self)
+                if self.is_ranked and self.guild_id in settings.servers_included_in_global_lb():
+                    member_ids = Player.select(Player.discord_member).join(Lineup).where(Lineup.game == self)
+                    MemberStats.rebuild([p[0] for p in member_ids.tuples()], exclude_game=self)
+
+        team_ids = [side.team_id for side in self.gamesides if side.team_id]
+
+        def invalidate():
+            leaderboard_cache.invalidate(self.guild_id, reason=f'reverse_elo_changes game {self.id}')
+            graphs.invalidate_team_series(team_ids, reason=f'reverse_elo_changes game {self.id}')
+            rating_index.invalidate(self.guild_id)
+        db.on_commit(invalidate)
+
+    def elo_participants(self):
+        # Loads this game's sides (with Team and Squad) and lineups (with Player and DiscordMember) in two queries.
+        # Each Team/Squad appears as a single shared instance, and every lineup points at its loaded side and at this game,
+        # so ELO changes can be made in memory and written once by flush_elo_changes()
+        gamesides = list(GameSide.select(GameSide, Team, Squad).join(Team, JOIN.LEFT_OUTER).join_from(GameSide, Squad, JOIN.LEFT_OUTER).where(
+            GameSide.game == self
+        ).order_by(GameSide.position))
+
+        teams, squads = {}, {}
+        for side in gamesides:
+            if side.team:
+                side.team = teams.setdefault(side.team.id, side.team)
+            if side.squad:
+                side.squad = squads.setdefault(side.squad.id, side.squad)
+
+        sides_by_id = {side.id: side for side in gamesides}
+        lineups = list(Lineup.select(Lineup, Player, DiscordMember).join(Player).join(DiscordMember).where(
+            Lineup.game == self
+        ).order_by(Lineup.id))
+        for lineup in lineups:
+            lineup.game = self
+            lineup.gameside = sides_by_id[lineup.gameside_id]
+
+        return gamesides, lineups
+
+    def flush_elo_changes(gamesides, lineups, players, members, teams, squads):
+        # Writes ELO fields changed in memory with one bulk UPDATE per model. Called inside a transaction.
+        elo_fields = ['elo', 'elo_max', 'elo_alltime', 'elo_max_alltime', 'elo_moonrise', 'elo_max_moonrise']
+        lineup_fields = ['elo_change_player', 'elo_change_player_alltime', 'elo_change_player_moonrise',
+                         'elo_change_discordmember', 'elo_change_discordmember_alltime', 'elo_change_discordmember_moonrise',
+                         'elo_after_game', 'elo_after_game_alltime', 'elo_after_game_moonrise',
+                         'elo_after_game_global', 'elo_after_game_global_alltime', 'elo_after_game_global_moonrise']
+        gameside_fields = ['elo_change_team', 'elo_change_team_alltime', 'elo_change_squad', 'team_elo_after_game', 'team_elo_after_game_alltime']
+
+        for model, records, fields in ((Player, players, elo_fields), (DiscordMember, members, elo_fields),
+                                       (Lineup, lineups, lineup_fields), (GameSide, gamesides, gameside_fields),
+                                       (Team, teams, ['elo', 'elo_alltime']), (Squad, squads, ['elo'])):
+            records = list({record.id: record for record in records}.values())
+            if records:
+                model.bulk_update(records, fields=fields)
+
+    def squad_ids(self):
+        return [side.squad_id for side in self.gamesides if side.squad_id]
+
+    def bump_rating_versions(self):
+        # Marks the cached player cards of everyone in this game as stale
+        DiscordMember.bump_rating_versions(Player.select(Player.discord_member).join(Lineup).where(Lineup.game == self))
+
+    def unconfirmed_claim_counts(entity, entity_ids=None, exclude_game: 'Game' = None):
+        # {id: (games, moonrise games)} of ranked games with an unconfirmed win, for entity Player.id or Player.discord_member (every id if
+        # entity_ids is None). The K-factor has always counted completed games, which includes these, while ranked_game_count only counts
+        # confirmed games - so they are added on top when a K-factor is picked. exclude_game is the game being rated, which a recalculation
+        # never counts towards its own K-factor
+        condition = (Game.is_completed == 1) & (Game.is_confirmed == 0) & (Game.is_ranked == 1)
+        if entity_ids is not None:
+            condition &= entity.in_(list(entity_ids))
+        if exclude_game is not None:
+            condition &= (Game.id != exclude_game.id)
+        if entity is Player.discord_member:
+            condition &= Game.guild_id.in_(settings.servers_included_in_global_lb())
+        query = Lineup.select(entity, fn.COUNT(Lineup.id), fn.COUNT(Lineup.id).filter(Game.date >= settings.moonrise_reset_date)).join(
+            Game, on=(Lineup.game == Game.id)).join_from(Lineup, Player).where(condition).group_by(entity)
+        return {entity_id: (count, moonrise_count) for entity_id, count, moonrise_count in query.tuples()}
+
+    def add_unconfirmed_claims(self, players, members):
+        # Adds unconfirmed_claim_counts() to the ranked_game_count fields of this game's records loaded by elo_participants(), in memory
+        # only - flush_elo_changes() never writes them back
+        for entity, records in ((Player.id, players), (Player.discord_member, members)):
+            records = list({record.id: record for record in records}.values())
+            claims = Game.unconfirmed_claim_counts(entity, [record.id for record in records], exclude_game=self) if records else {}
+            for record in records:
+                count, moonrise_count = claims.get(record.id, (0, 0))
+                record.ranked_game_count += count
+                record.ranked_game_count_moonrise += moonrise_count
+
+    def update_ranked_game_counts(self, increment: int):
+        # Maintains Player/DiscordMember.ranked_game_count, which picks the K-factor in Lineup.change_elo_after_game()
+        # +1 when a ranked game is confirmed, -1 when its ELO changes are reversed
+        moonrise_increment = increment if self.is_post_moonrise() else 0
+        player_ids = Lineup.select(Lineup.player).where(Lineup.game == self)
+
+        Player.update(ranked_game_count=Player.ranked_game_count + increment,
+                      ranked_game_count_moonrise=Player.ranked_game_count_moonrise + moonrise_increment).where(Player.id.in_(player_ids)).execute()
+
+        if self.guild_id in settings.servers_included_in_global_lb():
+            DiscordMember.update(ranked_game_count=DiscordMember.ranked_game_count + increment,
+                                 ranked_game_count_moonrise=DiscordMember.ranked_game_count_moonrise + moonrise_increment).where(
+                DiscordMember.id.in_(Player.select(Player.discord_member).where(Player.id.in_(player_ids)))).execute()
 
     def delete_game(self):
         # resets any relevant ELO changes to players and teams, deletes related lineup records, and deletes the game entry itself
 
         logger.info(f'Deleting game {self.id}')
         recalculate = False
+        squad_ids = self.squad_ids()
         with db.atomic():
+            self.bump_rating_versions()  # while the lineups still exist
             if self.winner:
                 self.winner = None
 
                 if self.is_confirmed and self.is_ranked:
                     recalculate = True
                     since = self.completed_ts
+                    seed = self.influence_seed()  # captured before the lineups are deleted
 
                     self.reverse_elo_changes()
 
                 self.save()
 
+            TribeUsage.apply(TribeUsage.lineup_counts(Lineup.game == self.id), sign=-1)
             for lineup in self.lineup:
                 lineup.delete_instance()
 
@@ -1688,43 +1890,18 @@ def delete_game(self):
             self.delete_instance()
 
             if recalculate:
-                Game.recalculate_elo_since(timestamp=since)
+                Game.recalculate_elo_since(timestamp=since, seed=seed, guild_id=self.guild_id)
+
+            SquadStats.refresh(squad_ids)
+
+        def invalidate():
+            leaderboard_cache.invalidate(self.guild_id, reason=f'delete_game {self.id}')
+            rating_index.invalidate(self.guild_id)
+        db.on_commit(invalidate)
 
     def get_side_win_chances(largest_team: int, gameside_list, gameside_elo_list, calc_version: int = 1):
-        n = len(gameside_list)
-
-        # Adjust team elos when the amount of players on each team
-        # is imbalanced, e.g. 1v2. It changes nothing when sizes are equal
-        adjusted_side_elo, win_chance_list = [], []
-        sum_raw_elo = sum(gameside_elo_list)
-        for s, elo in zip(gameside_list, gameside_elo_list):
-            missing_players = largest_team - len(s.lineup)
-            avg_opponent_elos = int(round((sum_raw_elo - elo) / (n - 1)))
-            adj_side_elo = s.adjusted_elo(missing_players, elo, avg_opponent_elos, calc_version)
-            adjusted_side_elo.append(adj_side_elo)
-
-        # Compute proper win chances when there are more than 2 teams,
-        # e.g. 2v2v2. It changes nothing when there are only 2 teams
-        win_chance_unnorm = []
-        normalization_factor = 0
-        max_elo = max(adjusted_side_elo)
-        second_elo = sorted(adjusted_side_elo)[-2]
-
-        for own_elo, side in zip(adjusted_side_elo, gameside_list):
-            target_elo = max_elo
-            if (target_elo == own_elo):
-                target_elo = second_elo
-            win_chance = GameSide.calc_win_chance(own_elo, target_elo)
-            win_chance_unnorm.append(win_chance)
-            normalization_factor += win_chance
-
-        # Apply the win/loss results for each team given their win% chance
-        # for i in range(n):
-        for side_win_chance_unnorm, adj_side_elo, side in zip(win_chance_unnorm, adjusted_side_elo, gameside_list):
-            win_chance = round(side_win_chance_unnorm / normalization_factor, 3)
-            win_chance_list.append(win_chance)
-
-        return win_chance_list
+        # Side sizes are read from each GameSide's lineup, the math lives in modules.elo
+        return elo.side_win_chances(largest_team, [len(s.lineup) for s in gameside_list], gameside_elo_list, calc_version)
 
     def declare_winner(self, winning_side: 'GameSide', confirm: bool):
         logger.debug(f'Running declare_winner for game {self.id}')
@@ -1737,6 +1914,7 @@ def declare_winner(self, winning_side: 'GameSide', confirm: bool):
         if smallest_side <= 0:
             return logger.error(f'Cannot declare_winner for game {self.id}: Side with 0 players detected.')
 
+        rated_players, rated_members, rated_teams = [], [], []
         with db.atomic():
             if confirm is True:
                 if self.is_confirmed:
@@ -1748,53 +1926,56 @@ def declare_winner(self, winning_side: 'GameSide', confirm: bool):
 
                 self.is_confirmed = True
                 if self.is_ranked:
+                    # a win claimed before a checkpoint was taken but confirmed after it is not in that checkpoint
+                    RatingCheckpoint.invalidate_since(self.completed_ts)
+
                     # run elo calculations for player, discordmember, team, squad
 
                     largest_side = self.largest_team()
-                    # gamesides = list(self.gamesides)
-                    gamesides = list(self.ordered_side_list())
+                    gamesides, lineups = self.elo_participants()
+                    self.add_unconfirmed_claims([l.player for l in lineups], [l.player.discord_member for l in lineups])
+                    side_lineups = [[l for l in lineups if l.gameside is s] for s in gamesides]
+                    side_sizes = [len(side) for side in side_lineups]
 
-                    side_elos = [s.average_elo() for s in gamesides]
-                    side_elos_discord = [s.average_elo(by_discord_member=True) for s in gamesides]
+                    # same averages as GameSide.average_elo(), from the records loaded above
+                    era_field = 'elo_moonrise' if self.is_post_moonrise() else 'elo'
+                    side_elos = [elo.side_average([getattr(l.player, era_field) for l in side]) for side in side_lineups]
+                    side_elos_discord = [elo.side_average([getattr(l.player.discord_member, era_field) for l in side]) for side in side_lineups]
 
-                    side_elos_alltime = [s.average_elo(alltime=True) for s in gamesides]
-                    side_elos_discord_alltime = [s.average_elo(by_discord_member=True, alltime=True) for s in gamesides]
+                    side_elos_alltime = [elo.side_average([l.player.elo_alltime for l in side]) for side in side_lineups]
+                    side_elos_discord_alltime = [elo.side_average([l.player.discord_member.elo_alltime for l in side]) for side in side_lineups]
 
                     team_elos = [s.team.elo if s.team else None for s in gamesides]
                     team_elos_alltime = [s.team.elo_alltime if s.team else None for s in gamesides]
 
                     squad_elos = [s.squad.elo if s.squad else None for s in gamesides]
 
-                    if self.date >= settings.elo_calc_v2_date:
-                        # added two adjustments for games starting 8/2/20:
-                        # 50 elo point host advantage for 1-player host sides (1 v X)
-                        # smaller handicap for uneven sides in GameSide.adjusted_elo()
-                        calc_version = 2
-                        if self.size[0] == 1:
-                            # For a solo host game (1v1, 1v3, etc), give them an adjustment for an assumed host advantage
-                            # Gives them an extra 50 phantom ELO which will make their calculated chance of winning higher, thus ELO prize lower
-                            side_elos[0] = side_elos[0] + 50
-                            side_elos_discord[0] = side_elos_discord[0] + 50
-                            side_elos_alltime[0] = side_elos_alltime[0] + 50
-                            side_elos_discord_alltime[0] = side_elos_discord_alltime[0] + 50
-                    else:
-                        calc_version = 1
+                    # added two adjustments for games starting 8/2/20:
+                    # 50 elo point host advantage for 1-player host sides (1 v X)
+                    # smaller handicap for uneven sides in elo.adjusted_elo()
+                    calc_version = elo.calc_version(self.date)
+                    host_bonus = elo.host_bonus(calc_version, self.size)
+                    side_elos[0] = side_elos[0] + host_bonus
+                    side_elos_discord[0] = side_elos_discord[0] + host_bonus
+                    side_elos_alltime[0] = side_elos_alltime[0] + host_bonus
+                    side_elos_discord_alltime[0] = side_elos_discord_alltime[0] + host_bonus
 
-                    side_win_chances = Game.get_side_win_chances(largest_side, gamesides, side_elos, calc_version)
-                    side_win_chances_discord = Game.get_side_win_chances(largest_side, gamesides, side_elos_discord, calc_version)
+                    side_win_chances = elo.side_win_chances(largest_side, side_sizes, side_elos, calc_version)
+                    side_win_chances_discord = elo.side_win_chances(largest_side, side_sizes, side_elos_discord, calc_version)
 
-                    side_win_chances_alltime = Game.get_side_win_chances(largest_side, gamesides, side_elos_alltime, calc_version)
-                    side_win_chances_discord_alltime = Game.get_side_win_chances(largest_side, gamesides, side_elos_discord_alltime, calc_version)
+                    side_win_chances_alltime = elo.side_win_chances(largest_side, side_sizes, side_elos_alltime, calc_version)
+                    side_win_chances_discord_alltime = elo.side_win_chances(largest_side, side_sizes, side_elos_discord_alltime, calc_version)
 
                     if smallest_side > 1:
                         if None not in team_elos:
-                            team_win_chances = Game.get_side_win_chances(largest_side, gamesides, team_elos, calc_version)
-                            team_win_chances_alltime = Game.get_side_win_chances(largest_side, gamesides, team_elos_alltime, calc_version)
+                            team_win_chances = elo.side_win_chances(largest_side, side_sizes, team_elos, calc_version)
+                            team_win_chances_alltime = elo.side_win_chances(largest_side, side_sizes, team_elos_alltime, calc_version)
                         else:
                             team_win_chances, team_win_chances_alltime = None, None
 
                         if None not in squad_elos:
-                            squad_win_chances = Game.get_side_win_chances(largest_side, gamesides, squad_elos, calc_version)
+                            squad_win_chances = elo.side_win_chances(largest_side, side_sizes, squad_elos, calc_version)
+                            squad_game_counts = Squad.completed_game_counts([s.squad for s in gamesides])
                         else:
                             squad_win_chances = None
                     else:
@@ -1805,10 +1986,16 @@ def declare_winner(self, winning_side: 'GameSide', confirm: bool):
                         team_win_chances = None
                         logger.info(f'Game date {self.date} is before reset date of {team_elo_reset_date}. Will not count towards team ELO.')
 
+                    if self.is_post_moonrise():
+                        logger.info(f'Game date {self.date} is after ELO reset date of {settings.moonrise_reset_date}. Counts towards POST-Moonrise ELO')
+                    else:
+                        logger.info(f'Game date {self.date} is before ELO reset date of {settings.moonrise_reset_date}. Counts towards pre-Moonrise ELO')
+
+                    # All changes below are made in memory, then written with one bulk UPDATE per model
                     for i in range(len(gamesides)):
                         side = gamesides[i]
                         is_winner = True if side == winning_side else False
-                        for p in side.lineup:
+                        for p in side_lineups[i]:
                             p.change_elo_after_game(side_win_chances_alltime[i], is_winner, alltime=True, moonrise=False)
                             p.change_elo_after_game(side_win_chances_discord_alltime[i], is_winner, by_discord_member=True, alltime=True, moonrise=False)
                             if self.is_post_moonrise():
@@ -1817,11 +2004,9 @@ def declare_winner(self, winning_side: 'GameSide', confirm: bool):
                                 else:
                                     p.change_elo_after_game(side_win_chances[i], is_winner, alltime=False, moonrise=True)
                                 p.change_elo_after_game(side_win_chances_discord[i], is_winner, by_discord_member=True, alltime=False, moonrise=True)
-                                logger.info(f'Game date {self.date} is after ELO reset date of {settings.moonrise_reset_date}. Counts towards POST-Moonrise ELO')
                             else:
                                 p.change_elo_after_game(side_win_chances[i], is_winner, alltime=False, moonrise=False)
                                 p.change_elo_after_game(side_win_chances_discord[i], is_winner, by_discord_member=True, alltime=False, moonrise=False)
-                                logger.info(f'Game date {self.date} is before ELO reset date of {settings.moonrise_reset_date}. Counts towards pre-Moonrise ELO')
 
                         if team_win_chances:
                             team_elo_delta = side.team.change_elo_after_game(team_win_chances[i], is_winner)
@@ -1829,22 +2014,114 @@ def declare_winner(self, winning_side: 'GameSide', confirm: bool):
                             side.elo_change_team = team_elo_delta
                             side.team.elo = int(side.team.elo + team_elo_delta)
                             side.team_elo_after_game = side.team.elo
-                            side.team.save()
                         if team_win_chances_alltime:
                             team_elo_delta = side.team.change_elo_after_game(team_win_chances_alltime[i], is_winner)
                             elo_logger.debug(f'Team.change_elo_after_game team.id: {side.team.id} Alltime ELO {side.team.elo_alltime} adding delta {team_elo_delta}')
                             side.elo_change_team_alltime = team_elo_delta
                             side.team.elo_alltime = int(side.team.elo_alltime + team_elo_delta)
                             side.team_elo_after_game_alltime = side.team.elo_alltime
-                            side.team.save()
                         if squad_win_chances:
-                            side.elo_change_squad = side.squad.change_elo_after_game(squad_win_chances[i], is_winner)
-
-                        side.save()
+                            side.elo_change_squad = side.squad.change_elo_after_game(squad_win_chances[i], is_winner, num_games=squad_game_counts[side.squad.id])
+
+                    players = [l.player for l in lineups]
+                    members = [l.player.discord_member for l in lineups] if self.guild_id in settings.servers_included_in_global_lb() else []
+                    rated_players, rated_members = players, members
+                    teams = [s.team for s in gamesides if s.team] if (team_win_chances or team_win_chances_alltime) else []
+                    rated_teams = teams
+                    squads = [s.squad for s in gamesides] if squad_win_chances else []
+                    Game.flush_elo_changes(gamesides, lineups, players, members, teams, squads)
+                    events = EloEvent.from_game(self, gamesides, lineups, squads_rated=bool(squad_win_chances))
+                    if events:
+                        EloEvent.insert_many(events).execute()
+
+                    # counted after the ELO changes so that this game does not affect its own K-factor
+                    self.update_ranked_game_counts(increment=1)
 
             self.winner = winning_side
             self.is_completed = True
             self.save()
+            self.bump_rating_versions()
+
+            if confirm:
+                if self.is_ranked and self.guild_id in settings.servers_included_in_global_lb():
+                    # after save() so that a member rebuilt by record_game() finds this game confirmed
+                    MemberStats.record_game(self, gamesides, side_lineups, winning_side)
+                SquadStats.refresh(self.squad_ids())
+
+        def invalidate():
+            if self.is_ranked:
+                leaderboard_cache.invalidate(self.guild_id, reason=f'declare_winner game {self.id}')
+            if rated_players:
+                rating_index.record_ratings(self.guild_id, rated_players, rated_members)
+            if rated_teams:
+                graphs.invalidate_team_series([team.id for team in rated_teams], reason=f'declare_winner game {self.id}')
+        db.on_commit(invalidate)
+
+    def simulate_winners(self):
+        # Read-only preview of declare_winner(confirm=True) for every possible winning side, using current ratings.
+        # Gathers ratings and game counts in one pass and hands them to the pure functions in modules.elo - nothing is written.
+        # Returns a dict of gamesides, calc_version and win chances, plus 'local', 'global', 'team' and 'squad' outcomes,
+        # where outcomes[w][s][p] (or [w][s] for team/squad) is the change for side s (player p) if side w wins.
+        # A flavor that would not change for this game is None.
+
+        gamesides, all_lineups = self.elo_participants()
+        self.add_unconfirmed_claims([l.player for l in all_lineups], [l.player.discord_member for l in all_lineups])
+        lineups = [[l for l in all_lineups if l.gameside is s] for s in gamesides]
+        side_sizes = [len(side) for side in lineups]
+        if not side_sizes or min(side_sizes) <= 0:
+            raise exceptions.CheckFailedError(f'Game {self.id} has a side with 0 players.')
+
+        largest_side, smallest_side = max(side_sizes), min(side_sizes)
+        calc_version = elo.calc_version(self.date)
+        host_bonus = elo.host_bonus(calc_version, side_sizes)
+        moonrise = self.is_post_moonrise()
+        elo_field = 'elo_moonrise' if moonrise else 'elo'
+        count_field = 'ranked_game_count_moonrise' if moonrise else 'ranked_game_count'
+        bot_ids = [settings.bot_id, settings.bot_id_beta]
+
+        players = [[l.player for l in side] for side in lineups]
+        members = [[p.discord_member for p in side] for side in players]
+        is_bot = [[m.discord_id in bot_ids for m in side] for side in members]
+
+        def zero_bots(outcomes):
+            # elobot's ELO is kept at 0 for penalty games, so it never changes
+            return [[[0 if is_bot[s][i] else delta for i, delta in enumerate(side)] for s, side in enumerate(outcome)] for outcome in outcomes]
+
+        chances, local_outcomes = elo.simulate_outcomes([[getattr(p, elo_field) for p in side] for side in players],
+                                                        [[getattr(p, count_field) for p in side] for side in players],
+                                                        largest_side, calc_version, host_bonus)
+        if moonrise and smallest_side == 1 and self.guild_id == settings.server_ids['polychampions']:
+            local_outcomes = None  # polychampions-specific rule, no local ELO for non-team games
+
+        if self.guild_id in settings.servers_included_in_global_lb():
+            global_chances, global_outcomes = elo.simulate_outcomes([[getattr(m, elo_field) for m in side] for side in members],
+                                                                    [[getattr(m, count_field) for m in side] for side in members],
+                                                                    largest_side, calc_version, host_bonus)
+            global_outcomes = zero_bots(global_outcomes)
+        else:
+            global_chances, global_outcomes = None, None
+
+        team_outcomes, squad_outcomes = None, None
+        if smallest_side > 1:
+            team_elo_reset_date = datetime.datetime.strptime(settings.team_elo_reset_date, "%m/%d/%Y").date()
+            if all(s.team for s in gamesides) and self.date >= team_elo_reset_date:
+                team_outcomes = elo.simulate_side_outcomes([s.team.elo for s in gamesides], side_sizes, largest_side, calc_version)[1]
+            if all(s.squad for s in gamesides):
+                squad_game_counts = Squad.completed_game_counts([s.squad for s in gamesides])
+                max_elo_deltas = [50 if squad_game_counts[s.squad.id] < 6 else 32 for s in gamesides]
+                squad_outcomes = elo.simulate_side_outcomes([s.squad.elo for s in gamesides], side_sizes, largest_side, calc_version, max_elo_deltas)[1]
+
+        return {
+            'gamesides': gamesides,
+            'lineups': lineups,
+            'calc_version': calc_version,
+            'win_chances': chances,
+            'global_win_chances': global_chances,
+            'local': zero_bots(local_outcomes) if local_outcomes else None,
+            'global': global_outcomes,
+            'team': team_outcomes,
+            'squad': squad_outcomes,
+        }
 
     def has_player(self, player: Player = None, discord_id: int = None):
         # if player (or discord_id) was a participant in this game: return True, GameSide
@@ -2074,7 +2351,8 @@ def search(player_filter=None, team_filter=None, title_filter=None, status_filte
         # 0 = desktop (is_mobile == False)
         # 1 = mobile (is_mobile == True)
         # 2 = any
-        # title_filter should be a [list, of, words] to search for in game notes or title. using iregexp (case insensitive). ordering doesn't matter
+        # title_filter should be a [list, of, words] to search for in game notes or title. Each word matches the start of a word (case insensitive)
+        # using the search_vector full text index. ordering doesn't matter. Best matches are listed first
 
         confirmed_filter, completed_filter, pending_filter = [0, 1], [0, 1], [0, 1]
         platform_filter = [0, 1] if platform_filter == 2 else [platform_filter]
@@ -2120,16 +2398,18 @@ def search(player_filter=None, team_filter=None, title_filter=None, status_filte
         else:
             player_subq = Game.select(Game.id)
 
+        title_rank = None
         if title_filter:
 
-            strip_regexp = re.compile('[^1-9a-zA-Z ]')  # strip out everything except alphanumerics and spaces
+            strip_regexp = re.compile('[^0-9a-zA-Z ]')  # strip out everything except alphanumerics and spaces
             clean_search_terms = strip_regexp.sub('', ' '.join(title_filter)).split()
-            search_regexp = '^' + ''.join([f'(?=.*{arg})' for arg in clean_search_terms]) + '.+'
-            # https://stackoverflow.com/questions/24656131/regex-for-existence-of-some-words-whose-order-doesnt-matter
+            search_query = ' & '.join([f'{arg}:*' for arg in clean_search_terms])  # ie. 'lux:* & final:*'
 
-            title_subq = Game.select(Game.id).where(
-                (Game.notes.iregexp(search_regexp)) | (Game.name.iregexp(search_regexp))
-            )
+            if clean_search_terms:
+                title_subq = Game.select(Game.id).where(Game.search_vector.match(search_query, language=Game.SEARCH_CONFIG))
+                title_rank = fn.ts_rank(Game.search_vector, fn.to_tsquery(Game.SEARCH_CONFIG, search_query))
+            else:
+                title_subq = Game.select(Game.id)
         else:
             title_subq = Game.select(Game.id)
 
@@ -2183,7 +2463,10 @@ def search(player_filter=None, team_filter=None, title_filter=None, status_filte
                 Game.is_mobile.in_(platform_filter)
             ) & (
                 Game.is_pending.in_(pending_filter))
-        ).order_by(-Game.completed_ts, -Game.date)
+        ).order_by(-Game.completed_ts, -Game.date, -Game.id)
+
+        if title_rank is not None:
+            game = game.order_by(title_rank.desc(), -Game.completed_ts, -Game.date, -Game.id)
 
         return game
 
@@ -2314,13 +2597,86 @@ def by_opponents(player_lists):
 
         # return games_with_same_number_of_sides
 
-    def recalculate_elo_since(timestamp):
+    def influence_seed(self):
+        # Ratings that change directly when this game's result is reversed or replayed: {'player': {ids}, 'discord_member': {ids}, 'team': {ids}, 'squad': {ids}}
+        seed = {'player': set(), 'discord_member': set(), 'team': set(), 'squad': set()}
+        is_global = self.guild_id in settings.servers_included_in_global_lb()
+
+        query = Lineup.select(Lineup.player, Player.discord_member, GameSide.team, GameSide.squad).join(Player).join_from(
+            Lineup, GameSide).where(Lineup.game == self)
+        for player_id, discord_member_id, team_id, squad_id in query.tuples():
+            seed['player'].add(player_id)
+            if is_global:
+                seed['discord_member'].add(discord_member_id)
+            if team_id:
+                seed['team'].add(team_id)
+            if squad_id:
+                seed['squad'].add(squad_id)
+
+        return seed
+
+    def influence_closure(timestamp, seed: dict):
+        # Walks confirmed ranked games completed since timestamp in order. A game whose players, global members, teams or squads include
+        # an affected rating must be replayed, and every rating in that game becomes affected for the games that follow it.
+        # Returns the ids of the games to replay, in completed_ts order.
+        affected = {key: set(ids) for key, ids in seed.items()}
+        global_guilds = settings.servers_included_in_global_lb()
+
+        query = Lineup.select(Game.id, Game.guild_id, Lineup.player, Player.discord_member, GameSide.team, GameSide.squad).join(
+            Game).join_from(Lineup, Player).join_from(Lineup, GameSide).where(
+            (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.completed_ts >= timestamp) & (Game.winner.is_null(False)) & (Game.is_ranked == 1)
+        ).order_by(Game.completed_ts, Game.id)
+
+        games = {}  # game id: {'player': {ids}, ...}, insertion-ordered by completed_ts
+        for game_id, guild_id, player_id, discord_member_id, team_id, squad_id in query.tuples():
+            entities = games.setdefault(game_id, {'player': set(), 'discord_member': set(), 'team': set(), 'squad': set()})
+            entities['player'].add(player_id)
+            if guild_id in global_guilds:
+                # global ELO only changes in servers included in the global leaderboard
+                entities['discord_member'].add(discord_member_id)
+            if team_id:
+                entities['team'].add(team_id)
+            if squad_id:
+                entities['squad'].add(squad_id)
+
+        game_ids = []
+        for game_id, entities in games.items():
+            if any(entities[key] & affected[key] for key in entities):
+                game_ids.append(game_id)
+                for key in entities:
+                    affected[key].update(entities[key])
+
+        return game_ids
+
+    def recalculate_elo_since(timestamp, seed: dict = None, guild_id: int = None):
+        # Recalculates confirmed ranked games completed since timestamp. If a RatingCheckpoint from before timestamp exists, its ratings
+        # are restored and later games are replayed in memory - if guild_id is given, only that guild's local ratings and (for a global
+        # leaderboard guild) the global ratings, and if seed is given as well (see Game.influence_seed()), only the ratings and games that
+        # seed reaches - see recalculation.influence_component(). Otherwise games are reversed and replayed one by one - if seed is given,
+        # only the games that seed's ratings can reach - see Game.influence_closure().
+        # Returns a tuple of (games replayed, games a full replay would have covered - since the checkpoint if one was used, else since timestamp)
+        from modules import recalculation  # imported here since recalculation imports this module
+
         db.connect(reuse_if_open=True)
         games = Game.select().where(
             (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.completed_ts >= timestamp) & (Game.winner.is_null(False)) & (Game.is_ranked == 1)
-        ).order_by(Game.completed_ts).prefetch(GameSide, Lineup)
+        ).order_by(Game.completed_ts, Game.id)
+        naive_count = games.count()
+
+        checkpoint = recalculation.nearest_checkpoint(timestamp)
+        if checkpoint:
+            naive_count = Game.select().where(recalculation.replay_filter() & recalculation.after_checkpoint(checkpoint)).count()
+            replayed = recalculation.recalculate_from_checkpoint(checkpoint, guild_id=guild_id, seed=seed)
+            elo_logger.debug(f'recalculate_elo_since {timestamp} - replayed {replayed} of {naive_count} games since checkpoint {checkpoint.id}')
+            return replayed, naive_count
 
-        elo_logger.debug(f'recalculate_elo_since {timestamp}')
+        RatingCheckpoint.delete().where(RatingCheckpoint.completed_ts >= timestamp).execute()
+
+        if seed is not None:
+            games = games.where(Game.id.in_(Game.influence_closure(timestamp, seed)))
+        games = games.prefetch(GameSide, Lineup)
+
+        elo_logger.debug(f'recalculate_elo_since {timestamp} - replaying {len(games)} of {naive_count} games')
         for g in games:
             g.reverse_elo_changes()
             g.is_completed = 0  # To have correct completed game counts for new ELO calculations
@@ -2331,6 +2687,7 @@ def recalculate_elo_since(timestamp):
             full_game = Game.load_full_game(game_id=g.id)
             full_game.declare_winner(winning_side=full_game.winner, confirm=True)
         elo_logger.debug('recalculate_elo_since complete')
+        return len(games), naive_count
 
     def recalculate_all_elo():
         # Reset all ELOs to 1000, reset completed game counts, and re-run Game.declare_winner() on all qualifying games
@@ -2340,10 +2697,14 @@ def recalculate_all_elo():
         settings.recalculation_mode = True
 
         with db.atomic():
-            Player.update(elo=1000, elo_max=1000, elo_alltime=1000, elo_max_alltime=1000, elo_moonrise=1000, elo_max_moonrise=1000).execute()
+            Player.update(elo=1000, elo_max=1000, elo_alltime=1000, elo_max_alltime=1000, elo_moonrise=1000, elo_max_moonrise=1000,
+                          ranked_game_count=0, ranked_game_count_moonrise=0).execute()
             Team.update(elo=1000, elo_alltime=1000).execute()
-            DiscordMember.update(elo=1000, elo_max=1000, elo_alltime=1000, elo_max_alltime=1000, elo_moonrise=1000, elo_max_moonrise=1000).execute()
+            DiscordMember.update(elo=1000, elo_max=1000, elo_alltime=1000, elo_max_alltime=1000, elo_moonrise=1000, elo_max_moonrise=1000,
+                                 ranked_game_count=0, ranked_game_count_moonrise=0).execute()
             Squad.update(elo=1000).execute()
+            RatingCheckpoint.delete().execute()
+            EloEvent.delete().execute()
 
             bot_members = DiscordMember.select().where(
                 DiscordMember.discord_id.in_([settings.bot_id, settings.bot_id_beta])
@@ -2365,6 +2726,13 @@ def recalculate_all_elo():
                 full_game.declare_winner(winning_side=full_game.winner, confirm=True)
 
         settings.recalculation_mode = False
+        MemberStats.rebuild()
+        DiscordMember.bump_rating_versions()
+        def invalidate():
+            leaderboard_cache.invalidate(reason='recalculate_all_elo')
+            graphs.invalidate_team_series(reason='recalculate_all_elo')
+            rating_index.invalidate()
+        db.on_commit(invalidate)
         elo_logger.info('recalculate_all_elo complete')
 
     def first_open_side(self, roles):
@@ -2611,49 +2979,63 @@ def confirmations_count(self):
 
         return (confirmed_count, side_count, fully_confirmed)
 
+    def season_tags(name: str, guild_id: int, size):
+        # Returns (season, league, is_postseason) for a polychampions season game, based on a name something like "PS8W7 Blah Blah"
+        # or "JS8 Finals Foo", or (None, None, False) for any other game. Stored on the game by Game.save()
+        # Junior seasons began with S4, and pro seasons before S5 had no 'P' designator
+        if not name or guild_id != settings.server_ids['polychampions'] or list(size or []) not in ([2, 2], [3, 3]):
+            return (None, None, False)
+
+        m = re.search(r'([PJ]?)S(\d{1,3})', name.upper())
+        if not m:
+            return (None, None, False)
+
+        season = int(m[2])
+        league = m[1] if m[1] else ('P' if season <= 4 else None)
+        is_postseason = 'FINAL' in name.upper() or 'SEMI' in name.upper()
+        return (season, league, is_postseason)
+
+    def backfill_season_tags():
+        # Sets season/league/is_postseason on every existing polychampions game from its name. Returns the number of season games
+        games = Game.select(Game.id, Game.name, Game.guild_id, Game.size).where(Game.guild_id == settings.server_ids['polychampions'])
+
+        tagged = []
+        for game in games:
+            game.season, game.league, game.is_postseason = Game.season_tags(game.name, game.guild_id, game.size)
+            if game.season is not None:
+                tagged.append(game)
+
+        with db.atomic():
+            Game.update(season=None, league=None, is_postseason=False).where(Game.season.is_null(False)).execute()
+            Game.bulk_update(tagged, fields=[Game.season, Game.league, Game.is_postseason], batch_size=1000)
+        return len(tagged)
+
+    def backfill_search_vectors():
+        # Sets search_vector on every existing game from its name and notes, as save() would. Returns the number of games updated
+        return Game.update(search_vector=fn.to_tsvector(Game.SEARCH_CONFIG, fn.concat_ws(' ', Game.name, Game.notes))).execute()
+
     def polychamps_season_games(league='all', season=None):
-        # infers polychampions season games based on Game.name, something like "PS8W7 Blah Blah" or "JS8 Finals Foo"
-        # Junior seasons began with S4
-        # relies on name being set reliably
-        # default season=None returns all seasons (any digit character). Otherwise pass an integer representing season #
-        # Returns three lists: ([All season games], [Regular season games], [Post season games])
+        # polychampions season games, from the season tag columns that Game.save() sets from the name
+        # default season=None returns all seasons. Otherwise pass an integer representing season #
+        # Returns three queries: ([All season games], [Regular season games], [Post season games])
 
         if season:
-            season_str = str(season)
+            season_filter = (Game.season == season)
         else:
-            season_str = '\\d'
-
-        pc_games = Game.select(Game.id).where(
-            ((Game.guild_id == settings.server_ids['polychampions']) & ((Game.size == [2, 2]) | (Game.size == [3, 3])))
-        )
+            season_filter = (Game.season.is_null(False))
 
         if league == 'all':
-            full_season = Game.select().where(
-                Game.name.iregexp(f'[PJ]?S{season_str}') & Game.id.in_(pc_games)  # matches S5 or PS5 or any S#
-            )
+            full_season = Game.select().where(season_filter)  # includes tags like S5 with no league letter
         elif league == 'pro':
-            if not season:
-                early_season_str = 'S[1234]'  # pro seasons before S5 had no 'P' designator
-            elif season and season <= 4:
-                early_season_str = f'S{str(season)}'
-            else:
-                early_season_str = None
-
-            full_season = Game.select().where(
-                (Game.name.iregexp(f'PS{season_str}') | Game.name.iregexp(early_season_str)) & Game.id.in_(pc_games)  # matches PS5 or S3 (before juniors started)
-            )
+            full_season = Game.select().where(season_filter & (Game.league == 'P'))
         elif league == 'junior':
-            full_season = Game.select().where(
-                Game.name.iregexp(f'JS{season_str}') & Game.id.in_(pc_games)  # matches JS5
-            )
+            full_season = Game.select().where(season_filter & (Game.league == 'J'))
         else:
             return ([], [], [])
 
-        playoff_filter = Game.select(Game.id).where(Game.name.contains('FINAL') | Game.name.contains('SEMI'))
-
-        regular_season = Game.select().where(Game.id.in_(full_season) & ~Game.id.in_(playoff_filter))
+        regular_season = full_season.where(Game.is_postseason == 0)
 
-        post_season = Game.select().where(Game.id.in_(full_season) & Game.id.in_(playoff_filter))
+        post_season = full_season.where(Game.is_postseason == 1)
 
         return (full_season, regular_season, post_season)
 
@@ -2676,28 +3058,13 @@ def is_league_game(self):
 
     def is_season_game(self):
 
-        # If game is a PolyChamps season game, return tuple like (5, 'P') indicating season 5, pro league (or 'J' for junior)
+        # If game is a PolyChampions season game, return tuple like (5, 'P') indicating season 5, pro league (or 'J' for junior)
         # If not, return empty tuple (which has a False boolean value)
 
-        if self.guild_id != settings.server_ids['polychampions']:
-            return ()
-
-        if self not in Game.polychamps_season_games()[0]:
-            # Making sure game is caught by the polychamps_season_games regexp first
+        if self.season is None:
             return ()
 
-        m = re.match(r"([PJ]?)S(\d+)", self.name.upper())
-        if not m:
-            logger.error(f'Game {self.id} matched regexp in polychamps_season_games() but not is_season_game() - {self.name}')
-            return ()
-
-        season = int(m[2])
-        if season <= 4:
-            league = 'P'
-        else:
-            league = m[1].upper()
-
-        return (season, league)
+        return (self.season, self.league)
 
     def is_uncaught_season_game(self):
         # Look for games that have a season tag in the notes or not at the beginning of name
@@ -2726,6 +3093,8 @@ class Squad(BaseModel):
     guild_id = BitField(unique=False, null=False)
     name = TextField(null=False, default='')
 
+    # (guild_id, elo) is indexed by migrator.py, so it is created in one place only
+
     def upsert(player_list, guild_id: int):
 
         squads = Squad.get_matching_squad(player_list)
@@ -2735,6 +3104,7 @@ def upsert(player_list, guild_id: int):
             sq = Squad.create(guild_id=guild_id)
             for p in player_list:
                 SquadMember.create(player=p, squad=sq)
+            SquadStats.create(squad=sq, member_count=len(player_list))
             return sq
 
         return squads[0]
@@ -2747,20 +3117,29 @@ def completed_game_count(self):
 
         return num_games
 
-    def change_elo_after_game(self, chance_of_winning: float, is_winner: bool):
-        if self.completed_game_count() < 6:
+    def completed_game_counts(squads):
+        # {squad.id: completed_game_count()} for several squads in one query
+        counts = {squad.id: 0 for squad in squads}
+        query = GameSide.select(GameSide.squad, fn.COUNT(GameSide.id).alias('num_games')).join(Game).where(
+            (Game.is_completed == 1) & (GameSide.squad.in_(list(counts))) & (Game.is_ranked == 1)
+        ).group_by(GameSide.squad).tuples()
+        counts.update(query)
+        return counts
+
+    def change_elo_after_game(self, chance_of_winning: float, is_winner: bool, num_games: int = None):
+        # Changes self.elo in memory only, the caller saves it. num_games can be passed in to skip the count query
+        if num_games is None:
+            num_games = self.completed_game_count()
+
+        if num_games < 6:
             max_elo_delta = 50
         else:
             max_elo_delta = 32
 
-        if is_winner is True:
-            elo_delta = int(round((max_elo_delta * (1 - chance_of_winning)), 0))
-        else:
-            elo_delta = int(round((max_elo_delta * (0 - chance_of_winning)), 0))
+        elo_delta = elo.team_elo_delta(chance_of_winning, is_winner, max_elo_delta)
 
         elo_logger.debug(f'Squad.change_elo_after_game squad.id: {self.id} ELO {self.elo} adding delta {elo_delta}')
         self.elo = int(self.elo + elo_delta)
-        self.save()
 
         return elo_delta
 
@@ -2791,33 +3170,28 @@ def subq_squads_with_completed_games(min_games: int = 1):
         ).having(fn.COUNT('*') >= min_games)
 
     def leaderboard_rank(self, date_cutoff):
+        # Returns (rank, leaderboard size). Rank is None if not on the leaderboard
+        position = leaderboard_position(Squad.leaderboard(date_cutoff=date_cutoff, guild_id=self.guild_id), self.id)
+        return (position.rank, position.total)
 
-        query = Squad.leaderboard(date_cutoff=date_cutoff, guild_id=self.guild_id)
-
-        squad_found = False
-        for counter, s in enumerate(query.tuples()):
-            if s[0] == self.id:
-                squad_found = True
-                break
-
-        rank = counter + 1 if squad_found else None
-        return (rank, query.count())
-
-    def leaderboard(date_cutoff, guild_id: int):
-
+    def min_games(guild_id: int):
+        # Fewer games are required of squads on servers with few squads
         num_squads = Squad.select().where(Squad.guild_id == guild_id).count()
         if num_squads < 15:
-            min_games = 0
+            return 0
         elif num_squads < 25:
-            min_games = 1
-        else:
-            min_games = 2
+            return 1
+        return 2
 
-        q = Squad.select().join(GameSide).join(Game).where(
-            (
-                Squad.id.in_(Squad.subq_squads_with_completed_games(min_games=min_games))
-            ) & (Squad.guild_id == guild_id) & (Game.completed_ts > date_cutoff)
-        ).order_by(-Squad.elo).group_by(Squad)
+    def leaderboard(date_cutoff, guild_id: int):
+        # Squads joined to their SquadStats (as squad.stats), with elo_field selected for leaderboard_position()
+        # A single scan of squad_stats - nothing is aggregated over game history here
+
+        q = Squad.select(Squad, SquadStats, Squad.elo.alias('elo_field')).join(SquadStats, attr='stats').where(
+            (Squad.guild_id == guild_id) &
+            (SquadStats.completed_games >= Squad.min_games(guild_id)) &
+            (SquadStats.last_played > date_cutoff)
+        ).order_by(-Squad.elo, Squad.id)
 
         return q
 
@@ -2832,45 +3206,53 @@ def get_matching_squad(player_list):
 
     def get_all_matching_squads(player_list, guild_id: int):
         # Takes [List, of, Player, Records] (not names)
-        # Returns all squads containing players in player list. Used to look up a squad by partial or complete membership
+        # Returns all squads containing players in player list, joined to their SquadStats (as squad.stats) and most active first.
+        # Used to look up a squad by partial or complete membership
 
         # Limited to squads with at least 2 members and at least min_games completed game
-        num_squads = Squad.select().where(Squad.guild_id == guild_id).count()
-        if num_squads < 15:
-            min_games = 0
-        elif num_squads < 25:
-            min_games = 1
-        else:
-            min_games = 2
-
-        squad_with_matching_members = Squad.select().join(SquadMember).group_by(Squad.id).having(
-            (fn.SUM(SquadMember.player.in_(player_list).cast('integer')) == len(player_list))
-        )
-
-        query = GameSide.select(GameSide.squad, fn.COUNT('*').alias('games_played')).where(
-            (GameSide.squad.in_(Squad.subq_squads_by_size(min_size=2))) &
-            (GameSide.squad.in_(Squad.subq_squads_with_completed_games(min_games=min_games))) &
-            (GameSide.squad.in_(squad_with_matching_members))
-        ).group_by(GameSide.squad).order_by(-SQL('games_played'))
-
-        return query
+        squad_with_matching_members = SquadMember.select(SquadMember.squad).where(
+            SquadMember.player.in_(player_list)
+        ).group_by(SquadMember.squad).having(fn.COUNT('*') == len(player_list))
+
+        min_games = Squad.min_games(guild_id)
+        query = Squad.select(Squad, SquadStats).join(SquadStats, attr='stats').where(
+            (Squad.id.in_(squad_with_matching_members)) &
+            (SquadStats.member_count >= 2) &
+            (SquadStats.completed_games >= min_games)
+        ).order_by(-SquadStats.completed_games, Squad.id)
+
+        if query.exists():
+            return query
+
+        # Fallback without squad_stats, counting games as before it existed: for squads that have no stats row yet, or whose
+        # only games are still in progress on a server with few squads. get_record() looks up the stats of these squads itself
+        return Squad.select().where(
+            (Squad.id.in_(squad_with_matching_members)) &
+            (Squad.id.in_(Squad.subq_squads_by_size(min_size=2))) &
+            (Squad.id.in_(Squad.subq_squads_with_completed_games(min_games=min_games)))
+        ).order_by(Squad.id)
 
     def get_record(self):
-
-        wins = GameSide.select(GameSide.id).join(Game).where(
-            (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_ranked == 1) & (GameSide.squad == self) & (GameSide.id == Game.winner)
-        ).count()
-
-        losses = GameSide.select(GameSide.id).join(Game).where(
-            (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_ranked == 1) & (GameSide.squad == self) & (GameSide.id != Game.winner)
-        ).count()
-
-        return (wins, losses)
+        # (wins, losses) in confirmed ranked games, from the squad's SquadStats if it was joined in, otherwise looked up by key
+        stats = getattr(self, 'stats', None) or SquadStats.get_or_none(SquadStats.squad == self.id)
+        if stats is None:
+            return (0, 0)
+        return (stats.wins, stats.losses)
 
     def get_members(self):
         members = [member.player for member in self.squadmembers]
         return members
 
+    def members_by_squad(squad_ids):
+        # {squad_id: [Player records, with Team loaded]} for several squads in one query, ordered as get_members() would be
+        members = {squad_id: [] for squad_id in squad_ids}
+        query = SquadMember.select(SquadMember.squad, Player, Team).join(Player).join(Team, JOIN.LEFT_OUTER).where(
+            SquadMember.squad.in_(list(members))
+        ).order_by(SquadMember.id)
+        for member in query:
+            members[member.squad_id].append(member.player)
+        return members
+
     def get_names(self):
         member_names = [member.player.name for member in self.squadmembers]
         return member_names
@@ -2949,8 +3331,7 @@ def has_same_players_as(self, gameside):
         return all(p in s2_players for p in s1_players)
 
     def calc_win_chance(my_side_elo: int, opponent_elo: int):
-        chance_of_winning = round(1 / (1 + (10 ** ((opponent_elo - my_side_elo) / 400.0))), 3)
-        return chance_of_winning
+        return elo.calc_win_chance(my_side_elo, opponent_elo)
 
     def elo_strings(self):
         # Returns a tuple of strings for team ELO and squad ELO display. ie:
@@ -2994,26 +3375,8 @@ def average_elo(self, by_discord_member: bool = False, alltime: bool = False):
         return int(round(sum(elo_list) / len(elo_list)))
 
     def adjusted_elo(self, missing_players: int, own_elo: int, opponent_elos: int, calc_version: int = 1):
-        # If teams have imbalanced size, adjust win% based on a
-        # function of the team's elos involved, e.g.
-        # 1v2  [1400] vs [1100, 1100] adjusts to represent 50% win
-        # (compared to 58.8% for 1v1v1 for the 1400 player)
-
-        if calc_version == 1:
-            handicap = 200  # the elo difference for a 50% 1v2 chance
-            # with a 200 handicap the calc will give you a pretend player with 200 less elo as a partner to balance out the team
-            # ie in a [1200] vs [1000, 1000] it will give the first side a fake 1000 elo player - 50% chance of 1200 player winning
-            # that scenario.
-        else:
-            handicap = 100
-            # changed handicap to 100 8/1/2020, indicating that unbalanced games are easier for the smaller side than previous assumed.
-            # ie a [1200] vs [1000, 1000] game should be more like 60% chance to win for the host, not 50%
-        handicap_elo = handicap * 2 + max(own_elo - opponent_elos - handicap, 0)
-        size = len(self.lineup)
-
-        # "fill up" missing players with placeholder handicapped elos
-        missing_player_elo = own_elo - handicap_elo
-        return int(round((own_elo * size + missing_player_elo * missing_players) / (size + missing_players)))
+        # If teams have imbalanced size, fill up missing players with handicapped placeholder elos. See elo.adjusted_elo()
+        return elo.adjusted_elo(len(self.lineup), missing_players, own_elo, opponent_elos, calc_version)
 
     def name(self):
 
@@ -3189,41 +3552,45 @@ def change_elo_after_game(self, chance_of_winning: float, is_winner: bool, by_di
             change_field = 'elo_change_discordmember' if by_discord_member else 'elo_change_player'
             aftergame_field = 'elo_after_game_global' if by_discord_member else 'elo_after_game'
 
-        elo = getattr(record, elo_field)
-        num_games = record.completed_game_count(moonrise=moonrise)
-
-        max_elo_delta = 32
+        current_elo = getattr(record, elo_field)
+        num_games = record.ranked_game_count_moonrise if moonrise else record.ranked_game_count
 
-        if num_games < 6:
-            max_elo_delta = 75
-        elif num_games < 11:
-            max_elo_delta = 50
-
-        if is_winner is True:
-            elo_delta = int(round((max_elo_delta * (1 - chance_of_winning)), 0))
-        else:
-            elo_delta = int(round((max_elo_delta * (0 - chance_of_winning)), 0))
-
-        elo_boost = .60 * ((1200 - max(min(elo, 1200), 900)) / 300)  # 60% boost to delta at elo 900, gradually shifts to 0% boost at 1200 ELO
-
-        elo_bonus = int(abs(elo_delta) * elo_boost)
-        elo_delta += elo_bonus
+        # K of 75/50/32 depending on games played, plus a boost for ratings under 1200
+        elo_delta = elo.player_elo_delta(current_elo, num_games, chance_of_winning, is_winner)
 
         if self.player.discord_member.discord_id in [settings.bot_id, settings.bot_id_beta]:
             # keep elobot's elo at 0 always - for penalty games
             return logger.info('Skipping elo set for bot user')
 
-        elo_logger.debug(f'Lineup.change_elo_after_game: Global: {by_discord_member} is_winner: {is_winner} alltime: {alltime} moonrise: {moonrise} Game.id {self.game.id} Lineup.id: {self.id} Player/DM.id: {record.id} Original ELO: {elo} Delta: {elo_delta} Original max ELO: {getattr(record, max_field)}')
+        elo_logger.debug(f'Lineup.change_elo_after_game: Global: {by_discord_member} is_winner: {is_winner} alltime: {alltime} moonrise: {moonrise} Game.id {self.game.id} Lineup.id: {self.id} Player/DM.id: {record.id} Original ELO: {current_elo} Delta: {elo_delta} Original max ELO: {getattr(record, max_field)}')
+
+        # In memory only - Game.declare_winner() writes lineups, players and members with Game.flush_elo_changes()
+        new_elo = int(current_elo + elo_delta)
+        setattr(record, elo_field, new_elo)
+        if new_elo > getattr(record, max_field):
+            setattr(record, max_field, new_elo)
+        setattr(self, change_field, elo_delta)
+        setattr(self, aftergame_field, new_elo)
 
-        new_elo = int(elo + elo_delta)
+    def set_tribe(self, tribe: 'Tribe'):
+        # Sets and saves the tribe of this lineup (None to unset it), moving its count in tribe_usage from the old tribe to the new one
+        old_tribe_id, new_tribe_id = self.tribe_id, (tribe.id if tribe else None)
         with db.atomic():
-            setattr(record, elo_field, new_elo)
-            if new_elo > getattr(record, max_field):
-                setattr(record, max_field, new_elo)
-            setattr(self, change_field, elo_delta)
-            setattr(self, aftergame_field, new_elo)
-            record.save()
+            self.tribe = tribe
             self.save()
+            if old_tribe_id != new_tribe_id:
+                member_id, guild_id = self.player.discord_member_id, self.player.guild_id
+                if old_tribe_id:
+                    TribeUsage.apply({(member_id, guild_id, old_tribe_id): 1}, sign=-1)
+                if new_tribe_id:
+                    TribeUsage.apply({(member_id, guild_id, new_tribe_id): 1})
+
+    def remove(self):
+        # Deletes this lineup (ie. a player leaving a pending game), taking its tribe out of tribe_usage
+        with db.atomic():
+            if self.tribe_id:
+                TribeUsage.apply({(self.player.discord_member_id, self.player.guild_id, self.tribe_id): 1}, sign=-1)
+            self.delete_instance()
 
     def emoji_str(self):
 
@@ -3306,11 +3673,493 @@ def generate_new_token(self):
         self.save()
 
 
+class RatingCheckpoint(BaseModel):
+    # Snapshot of every Player/DiscordMember/Team/Squad rating after all confirmed ranked games up to and including last_game_id,
+    # in (completed_ts, id) order. Each *_data field is a compressed packed array - see recalculation.RatingTable.pack()
+    created_ts = DateTimeField(default=datetime.datetime.now)
+    completed_ts = DateTimeField(null=False, index=True)  # completed_ts of the last game included
+    last_game_id = IntegerField(null=False)  # not a foreign key - the game may later be deleted, which invalidates the checkpoint anyway
+    game_count = IntegerField(default=0)
+    player_data = BlobField()
+    discordmember_data = BlobField()
+    team_data = BlobField()
+    squad_data = BlobField()
+
+    def invalidate_since(timestamp):
+        # Deletes the checkpoints at or after timestamp. Called when a game completed at timestamp is confirmed or reversed, since
+        # checkpoints taken in between were snapshotted without (or with) that game and a replay starting from them would skip it
+        if timestamp is None:
+            return 0
+        deleted = RatingCheckpoint.delete().where(RatingCheckpoint.completed_ts >= timestamp).execute()
+        if deleted:
+            elo_logger.debug(f'RatingCheckpoint.invalidate_since {timestamp}: deleted {deleted} checkpoints')
+        return deleted
+
+
+class EloEvent(BaseModel):
+    # Ledger of rating changes, one row per (entity, flavor, game), written by Game.declare_winner(). Rows are never updated -
+    # reversing a game's ELO subtracts the summed deltas in one UPDATE per rating model, then deletes that game's rows.
+    # The Lineup.elo_change_* / GameSide.elo_change_* columns are still written for display.
+    game = ForeignKeyField(Game, on_delete='CASCADE', index=True)
+    entity_type = CharField(max_length=16)  # 'player', 'discordmember', 'team' or 'squad'
+    entity_id = IntegerField()
+    flavor = CharField(max_length=16)  # name of the rating field that changed: 'elo', 'elo_alltime' or 'elo_moonrise'
+    delta = SmallIntegerField()
+    rating_after = SmallIntegerField(null=True)  # null for events rebuilt from old games that did not store it (always for squads)
+    completed_ts = DateTimeField()  # copied from the game so that history is a range scan of the index below
+
+    class Meta:
+        table_name = 'elo_event'
+        indexes = ((('entity_type', 'entity_id', 'flavor', 'completed_ts'), False),)
+
+    # (entity_type, flavor, change field, after-game field) for each rating a Lineup or GameSide records
+    LINEUP_FLAVORS = (
+        ('player', 'elo', 'elo_change_player', 'elo_after_game'),
+        ('player', 'elo_alltime', 'elo_change_player_alltime', 'elo_after_game_alltime'),
+        ('player', 'elo_moonrise', 'elo_change_player_moonrise', 'elo_after_game_moonrise'),
+        ('discordmember', 'elo', 'elo_change_discordmember', 'elo_after_game_global'),
+        ('discordmember', 'elo_alltime', 'elo_change_discordmember_alltime', 'elo_after_game_global_alltime'),
+        ('discordmember', 'elo_moonrise', 'elo_change_discordmember_moonrise', 'elo_after_game_global_moonrise'),
+    )
+    GAMESIDE_FLAVORS = (
+        ('team', 'elo', 'elo_change_team', 'team_elo_after_game'),
+        ('team', 'elo_alltime', 'elo_change_team_alltime', 'team_elo_after_game_alltime'),
+    )
+
+    def from_game(game, gamesides, lineups, squads_rated: bool):
+        # Event rows (as dicts for insert_many) for the changes declare_winner() just made in memory.
+        # A rating was changed whenever its after-game field is set; squads have no after-game field so squads_rated says so
+        rows = []
+
+        def event(entity_type, entity_id, flavor, delta, rating_after):
+            rows.append({'game': game.id, 'entity_type': entity_type, 'entity_id': entity_id, 'flavor': flavor,
+                         'delta': delta, 'rating_after': rating_after, 'completed_ts': game.completed_ts})
+
+        for lineup in lineups:
+            for entity_type, flavor, change_field, aftergame_field in EloEvent.LINEUP_FLAVORS:
+                if getattr(lineup, aftergame_field) is not None:
+                    entity_id = lineup.player.id if entity_type == 'player' else lineup.player.discord_member.id
+                    event(entity_type, entity_id, flavor, getattr(lineup, change_field), getattr(lineup, aftergame_field))
+        for side in gamesides:
+            for entity_type, flavor, change_field, aftergame_field in EloEvent.GAMESIDE_FLAVORS:
+                if getattr(side, aftergame_field) is not None:
+                    event(entity_type, side.team.id, flavor, getattr(side, change_field), getattr(side, aftergame_field))
+            if squads_rated:
+                event('squad', side.squad.id, 'elo', side.elo_change_squad, side.squad.elo)
+        return rows
+
+    def reverse_game(game):
+        # Subtracts every delta recorded for game from the rating it was added to - one UPDATE per rating model - and drops the events
+        if not EloEvent.select().where(EloEvent.game == game).exists():
+            # rated before the ledger existed and not backfilled yet - its change columns still hold the deltas
+            EloEvent.rebuild(Game.id == game.id)
+
+        for model, entity_type, flavors in ((Player, 'player', ('elo', 'elo_alltime', 'elo_moonrise')),
+                                            (DiscordMember, 'discordmember', ('elo', 'elo_alltime', 'elo_moonrise')),
+                                            (Team, 'team', ('elo', 'elo_alltime')),
+                                            (Squad, 'squad', ('elo', ))):
+            deltas = EloEvent.select(EloEvent.entity_id, *[fn.SUM(EloEvent.delta).filter(EloEvent.flavor == flavor).alias(flavor) for flavor in flavors]).where(
+                (EloEvent.game == game) & (EloEvent.entity_type == entity_type)
+            ).group_by(EloEvent.entity_id).alias('deltas')
+            model.update({getattr(model, flavor): getattr(model, flavor) - fn.COALESCE(getattr(deltas.c, flavor), 0) for flavor in flavors}).from_(
+                deltas).where(model.id == deltas.c.entity_id).execute()
+
+        EloEvent.delete().where(EloEvent.game == game).execute()
+
+    def rebuild(game_filter=None):
+        # Regenerates the ledger from the Lineup/GameSide change columns, for every game matching game_filter (default all games).
+        # Used to backfill the table and after a recalculation rewrites those columns in bulk. Old games have nonzero changes with no
+        # after-game value, which still need events so that reverse_game() can undo them - those get a null rating_after
+        delete_query = EloEvent.delete()
+        if game_filter is not None:
+            delete_query = delete_query.where(EloEvent.game.in_(Game.select(Game.id).where(game_filter)))
+        delete_query.execute()
+
+        game_filter = game_filter if game_filter is not None else (Game.id.is_null(False))
+        fields = [EloEvent.game, EloEvent.entity_type, EloEvent.entity_id, EloEvent.flavor, EloEvent.delta, EloEvent.rating_after, EloEvent.completed_ts]
+        inserted = 0
+        for entity_type, flavor, change_field, aftergame_field in EloEvent.LINEUP_FLAVORS:
+            entity = Lineup.player if entity_type == 'player' else Player.discord_member
+            query = Lineup.select(Lineup.game, Value(entity_type), entity, Value(flavor), getattr(Lineup, change_field), getattr(Lineup, aftergame_field),
+                                  Game.completed_ts).join(Game).join_from(Lineup, Player).where(
+                game_filter & (getattr(Lineup, aftergame_field).is_null(False) | (getattr(Lineup, change_field) != 0)))
+            inserted += EloEvent.insert_from(query, fields).as_rowcount().execute()
+        for entity_type, flavor, change_field, aftergame_field in EloEvent.GAMESIDE_FLAVORS:
+            query = GameSide.select(GameSide.game, Value(entity_type), GameSide.team, Value(flavor), getattr(GameSide, change_field), getattr(GameSide, aftergame_field),
+                                    Game.completed_ts).join(Game, on=(GameSide.game == Game.id)).where(
+                game_filter & (getattr(GameSide, aftergame_field).is_null(False) | (getattr(GameSide, change_field) != 0)))
+            inserted += EloEvent.insert_from(query, fields).as_rowcount().execute()
+        query = GameSide.select(GameSide.game, Value('squad'), GameSide.squad, Value('elo'), GameSide.elo_change_squad, SQL('NULL::smallint'),
+                                Game.completed_ts).join(Game, on=(GameSide.game == Game.id)).where(
+            game_filter & GameSide.squad.is_null(False) & (GameSide.elo_change_squad != 0))
+        inserted += EloEvent.insert_from(query, fields).as_rowcount().execute()
+
+        logger.info(f'EloEvent.rebuild inserted {inserted} events')
+        return inserted
+
+    def history(entity_type: str, entity_ids, flavors, since: datetime.datetime = None):
+        # (completed_ts, rating_after) for every change to the given entities' ratings that recorded the rating after it, oldest first.
+        # Passing several flavors merges them into one series, ie. ('elo', 'elo_moonrise') for a current-era graph
+        query = EloEvent.select(EloEvent.completed_ts, EloEvent.rating_after).where(
+            (EloEvent.entity_type == entity_type) & (EloEvent.entity_id.in_(list(entity_ids))) & (EloEvent.flavor.in_(list(flavors))) &
+            (EloEvent.rating_after.is_null(False))
+        )
+        if since:
+            query = query.where(EloEvent.completed_ts >= since)
+        return list(query.order_by(EloEvent.completed_ts).tuples())
+
+    def histories(entity_type: str, entity_ids, flavors, since: datetime.datetime = None):
+        # {entity_id: history()} for several entities in one query. Entities with no history are left out
+        query = EloEvent.select(EloEvent.entity_id, EloEvent.completed_ts, EloEvent.rating_after).where(
+            (EloEvent.entity_type == entity_type) & (EloEvent.entity_id.in_(list(entity_ids))) & (EloEvent.flavor.in_(list(flavors))) &
+            (EloEvent.rating_after.is_null(False))
+        )
+        if since:
+            query = query.where(EloEvent.completed_ts >= since)
+
+        histories = {}
+        for entity_id, completed_ts, rating_after in query.order_by(EloEvent.completed_ts).tuples():
+            histories.setdefault(entity_id, []).append((completed_ts, rating_after))
+        return histories
+
+
+class LeaderboardSnapshot(BaseModel):
+    # Daily copy of the top of each default (active players, not max) leaderboard, written by LeaderboardSnapshot.write().
+    # Local boards have guild_id set and entity_id is a Player id, global boards have guild_id null and entity_id is a DiscordMember id
+    snapshot_date = DateField()
+    guild_id = BitField(null=True)
+    version = CharField(max_length=16)  # 'AIR', 'MOONRISE' or 'ALLTIME', as in Player.leaderboard()
+    rank = SmallIntegerField()
+    entity_id = IntegerField()
+    elo = SmallIntegerField()
+
+    class Meta:
+        table_name = 'leaderboard_snapshot'
+        indexes = (
+            (('guild_id', 'version', 'snapshot_date', 'rank'), False),  # one board on one date, in rank order
+            (('entity_id', 'guild_id', 'version', 'snapshot_date'), False),  # one entity's rank history
+        )
+
+    def versions():
+        return ['MOONRISE' if is_post_moonrise() else 'AIR', 'ALLTIME']
+
+    def write(snapshot_date: datetime.date = None, top_n: int = 500):
+        # Snapshots every guild's leaderboard and the global leaderboard for each of versions(), replacing any snapshot already
+        # taken on snapshot_date. Each board is ranked and copied by one INSERT ... SELECT, so no rows pass through Python.
+        snapshot_date = snapshot_date or datetime.date.today()
+        guild_ids = [guild_id for (guild_id, ) in Player.select(Player.guild_id).distinct().tuples()]
+        fields = [LeaderboardSnapshot.snapshot_date, LeaderboardSnapshot.guild_id, LeaderboardSnapshot.version,
+                  LeaderboardSnapshot.rank, LeaderboardSnapshot.entity_id, LeaderboardSnapshot.elo]
+
+        inserted = 0
+        with db.atomic():
+            LeaderboardSnapshot.delete().where(LeaderboardSnapshot.snapshot_date == snapshot_date).execute()
+            for version in LeaderboardSnapshot.versions():
+                boards = [(guild_id, Player.leaderboard(date_cutoff=settings.date_cutoff, guild_id=guild_id, version=version)) for guild_id in guild_ids]
+                boards.append((None, DiscordMember.leaderboard(date_cutoff=settings.date_cutoff, version=version)))
+                for guild_id, leaderboard_query in boards:
+                    ranked = ranked_leaderboard(leaderboard_query).alias('ranked')
+                    query = Select([ranked], [Value(snapshot_date), Value(guild_id) if guild_id else SQL('NULL::bigint'), Value(version),
+                                              ranked.c.rank, ranked.c.id, ranked.c.elo_field]).where(ranked.c.rank <= top_n)
+                    inserted += LeaderboardSnapshot.insert_from(query, fields).as_rowcount().execute()
+
+        db.on_commit(lambda: leaderboard_cache.invalidate(reason='LeaderboardSnapshot.write'))  # cached pages show movement against the previous snapshot
+        logger.info(f'LeaderboardSnapshot.write inserted {inserted} rows for {snapshot_date}')
+        return inserted
+
+    def board_filter(guild_id: int, version: str):
+        return (LeaderboardSnapshot.guild_id.is_null() if guild_id is None else (LeaderboardSnapshot.guild_id == guild_id)) & (LeaderboardSnapshot.version == version.upper())
+
+    def snapshot_date_as_of(guild_id: int, version: str, as_of: datetime.date):
+        # Subquery of the date of the most recent snapshot of this board taken on or before as_of
+        return LeaderboardSnapshot.select(fn.MAX(LeaderboardSnapshot.snapshot_date)).where(
+            LeaderboardSnapshot.board_filter(guild_id, version) & (LeaderboardSnapshot.snapshot_date <= as_of)
+        )
+
+    def board(guild_id: int, version: str, as_of: datetime.date):
+        # The board as of the most recent snapshot on or before as_of, in rank order, with each entity's current name.
+        # Use guild_id None for the global board
+        entity_model = DiscordMember if guild_id is None else Player
+        return LeaderboardSnapshot.select(LeaderboardSnapshot, entity_model.name).join(
+            entity_model, JOIN.LEFT_OUTER, on=(entity_model.id == LeaderboardSnapshot.entity_id)
+        ).where(
+            LeaderboardSnapshot.board_filter(guild_id, version) &
+            (LeaderboardSnapshot.snapshot_date == LeaderboardSnapshot.snapshot_date_as_of(guild_id, version, as_of))
+        ).order_by(LeaderboardSnapshot.rank)
+
+    def ranks(guild_id: int, version: str, as_of: datetime.date, entity_ids):
+        # {entity_id: rank} for the given entities on the board as of the most recent snapshot on or before as_of
+        query = LeaderboardSnapshot.select(LeaderboardSnapshot.entity_id, LeaderboardSnapshot.rank).where(
+            LeaderboardSnapshot.board_filter(guild_id, version) & (LeaderboardSnapshot.entity_id.in_(list(entity_ids))) &
+            (LeaderboardSnapshot.snapshot_date == LeaderboardSnapshot.snapshot_date_as_of(guild_id, version, as_of))
+        )
+        return dict(query.tuples())
+
+    def rank_history(entity_id: int, guild_id: int, version: str, since: datetime.date = None):
+        # (snapshot_date, rank, elo) for one entity, oldest first - a range scan of the second index above
+        query = LeaderboardSnapshot.select(LeaderboardSnapshot.snapshot_date, LeaderboardSnapshot.rank, LeaderboardSnapshot.elo).where(
+            (LeaderboardSnapshot.entity_id == entity_id) & LeaderboardSnapshot.board_filter(guild_id, version)
+        )
+        if since:
+            query = query.where(LeaderboardSnapshot.snapshot_date >= since)
+        return list(query.order_by(LeaderboardSnapshot.snapshot_date).tuples())
+
+
+
+class SquadStats(BaseModel):
+    # Per-squad totals behind the squad leaderboard and squad lookups, so that they are not aggregated from game history
+    # on every command. Recomputed for a game's squads by refresh() when the game is confirmed, reversed or deleted.
+    squad = ForeignKeyField(Squad, primary_key=True, on_delete='CASCADE')
+    member_count = SmallIntegerField(default=0)
+    completed_games = IntegerField(default=0)  # confirmed games, ranked or not
+    wins = IntegerField(default=0)  # confirmed ranked games
+    losses = IntegerField(default=0)
+    last_played = DateTimeField(null=True)  # completed_ts of the latest confirmed game
+
+    class Meta:
+        table_name = 'squad_stats'
+
+    def refresh(squad_ids=None, exclude_game: 'Game' = None):
+        # Recomputes the stats of squad_ids (every squad if None) in one INSERT ... SELECT ... ON CONFLICT and returns the row count.
+        # exclude_game is left out of the counts, for use while that game's result is being reversed.
+        if squad_ids is not None:
+            squad_ids = list(set(squad_ids))
+            if not squad_ids:
+                return 0
+
+        game_filter = (Game.is_completed == 1) & (Game.is_confirmed == 1) & (GameSide.squad.is_null(False))
+        if exclude_game:
+            game_filter &= (Game.id != exclude_game.id)
+
+        results = GameSide.select(
+            GameSide.squad.alias('squad_id'),
+            fn.COUNT(SQL('*')).alias('completed_games'),
+            fn.COUNT(SQL('*')).filter((Game.is_ranked == 1) & (Game.winner == GameSide.id)).alias('wins'),
+            fn.COUNT(SQL('*')).filter((Game.is_ranked == 1) & (Game.winner != GameSide.id)).alias('losses'),
+            fn.MAX(Game.completed_ts).alias('last_played')
+        ).join(Game, on=(GameSide.game == Game.id)).where(game_filter).group_by(GameSide.squad)
+        members = SquadMember.select(SquadMember.squad.alias('squad_id'), fn.COUNT(SQL('*')).alias('member_count')).group_by(SquadMember.squad)
+        squads = Squad.select(Squad.id)
+
+        if squad_ids is not None:
+            results = results.where(GameSide.squad.in_(squad_ids))
+            members = members.where(SquadMember.squad.in_(squad_ids))
+            squads = squads.where(Squad.id.in_(squad_ids))
+
+        results, members = results.alias('results'), members.alias('members')
+        query = squads.select_extend(
+            fn.COALESCE(members.c.member_count, 0), fn.COALESCE(results.c.completed_games, 0),
+            fn.COALESCE(results.c.wins, 0), fn.COALESCE(results.c.losses, 0), results.c.last_played
+        ).join(members, JOIN.LEFT_OUTER, on=(members.c.squad_id == Squad.id)).join_from(
+            Squad, results, JOIN.LEFT_OUTER, on=(results.c.squad_id == Squad.id))
+
+        fields = [SquadStats.squad, SquadStats.member_count, SquadStats.completed_games, SquadStats.wins, SquadStats.losses, SquadStats.last_played]
+        return SquadStats.insert_from(query, fields).on_conflict(conflict_target=[SquadStats.squad], preserve=fields[1:]).as_rowcount().execute()
+
+
+class MemberStats(BaseModel):
+    # Per-member streak and matchup statistics over confirmed ranked games in global-leaderboard servers, as shown on the player card.
+    # Updated a game at a time by declare_winner(), and rebuilt from game history by rebuild() when a game is reversed.
+    discord_member = ForeignKeyField(DiscordMember, primary_key=True, on_delete='CASCADE')
+    ranked_games = IntegerField(default=0)
+    current_streak = SmallIntegerField(default=0)  # +n after n straight wins, -n after n straight losses
+    longest_winning_streak = SmallIntegerField(default=0)
+    longest_losing_streak = SmallIntegerField(default=0)
+    v2_wins = IntegerField(default=0)  # wins of 1v2 or 1v3 games
+    v3_wins = IntegerField(default=0)
+    duel_wins = IntegerField(default=0)  # 1v1 matchup stats
+    duel_losses = IntegerField(default=0)
+    wins_as_host = IntegerField(default=0)
+    last_completed_ts = DateTimeField(null=True)  # of the latest game counted
+
+    class Meta:
+        table_name = 'member_stats'
+
+    def matchup(size, is_winner: bool, side_lineup_count: int):
+        # 'duel', 'v2' or 'v3' if the game counts towards those stats for this side, else None
+        if len(size) != 2:
+            return None
+        if is_winner:
+            return {1: 'duel', 2: 'v2', 3: 'v3'}.get(max(size)) if side_lineup_count == 1 else None
+        return 'duel' if max(size) == 1 and min(size) == 1 else None
+
+    def record_result(self, completed_ts, is_winner: bool, won_as_host: bool, matchup: str = None):
+        # Counts one more game, in memory. Games must be recorded in completed_ts order for the streaks to be right.
+        # Like the streak walk this replaced, a longest streak is only recorded once a streak is extended to 2 or more
+        self.ranked_games += 1
+        self.last_completed_ts = completed_ts
+        if is_winner:
+            if self.current_streak > 0:
+                self.current_streak += 1
+                self.longest_winning_streak = max(self.longest_winning_streak, self.current_streak)
+            else:
+                self.current_streak = 1
+            if won_as_host:
+                self.wins_as_host += 1
+            if matchup == 'duel':
+                self.duel_wins += 1
+            elif matchup == 'v2':
+                self.v2_wins += 1
+            elif matchup == 'v3':
+                self.v3_wins += 1
+        else:
+            if self.current_streak < 0:
+                self.current_streak -= 1
+                self.longest_losing_streak = max(self.longest_losing_streak, -self.current_streak)
+            else:
+                self.current_streak = -1
+            if matchup == 'duel':
+                self.duel_losses += 1
+
+    def as_tuple(self):
+        # In the order DiscordMember.advanced_stats() returns
+        return (self.longest_winning_streak, self.longest_losing_streak, self.v2_wins, self.v3_wins,
+                self.duel_wins, self.duel_losses, self.wins_as_host, self.ranked_games)
+
+    def save_all(records):
+        # Upserts records, reading __data__ so that the DiscordMember of each record is not loaded
+        fields = MemberStats._meta.sorted_fields
+        rows = [{field.name: record.__data__.get(field.name) for field in fields} for record in records]
+        for batch in chunked(rows, 500):
+            MemberStats.insert_many(batch).on_conflict(conflict_target=[MemberStats.discord_member], preserve=fields[1:]).execute()
+
+    def record_game(game: 'Game', gamesides, side_lineups, winning_side: 'GameSide'):
+        # Called by declare_winner() inside its transaction, once the game is saved as confirmed, for a ranked game in a global-leaderboard server.
+        # side_lineups is each side's lineups in Lineup.id order, with Player loaded. A member whose last counted game completed
+        # after this one is rebuilt instead, since a game counted out of order would break the streaks.
+        results = {}
+        for side, lineups in zip(gamesides, side_lineups):
+            is_winner = side.id == winning_side.id
+            matchup = MemberStats.matchup(game.size, is_winner, len(lineups))
+            for position, lineup in enumerate(lineups):
+                results[lineup.player.discord_member_id] = (is_winner, is_winner and position == 0, matchup)
+
+        records = {record.discord_member_id: record for record in MemberStats.select().where(MemberStats.discord_member.in_(list(results)))}
+        out_of_order = [member_id for member_id, record in records.items() if record.last_completed_ts and record.last_completed_ts > game.completed_ts]
+        updated = []
+        for member_id, result in results.items():
+            if member_id in out_of_order:
+                continue
+            record = records.get(member_id) or MemberStats(discord_member=member_id)
+            record.record_result(game.completed_ts, *result)
+            updated.append(record)
+
+        MemberStats.save_all(updated)
+        if out_of_order:
+            MemberStats.rebuild(out_of_order)
+
+    def rebuild(member_ids=None, exclude_game: 'Game' = None):
+        # Recomputes the rows of member_ids (every member if None) from their game history in one query and returns the row count.
+        # exclude_game is left out, for use while that game's result is being reversed.
+        if member_ids is not None:
+            member_ids = list(set(member_ids))
+            if not member_ids:
+                return 0
+
+        side_lineup = Lineup.alias('side_lineup')
+        first_lineup = side_lineup.select(fn.MIN(side_lineup.id)).where(side_lineup.gameside == Lineup.gameside)
+        side_lineup_count = side_lineup.select(fn.COUNT(side_lineup.id)).where(side_lineup.gameside == Lineup.gameside)
+
+        query = Lineup.select(
+            Player.discord_member, Game.completed_ts, Game.size, Game.winner, Lineup.gameside, Lineup.id,
+            first_lineup.alias('first_lineup'), side_lineup_count.alias('side_lineup_count')
+        ).join(Game, on=(Lineup.game == Game.id)).join_from(Lineup, Player).where(
+            (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_ranked == 1) &
+            (Game.guild_id.in_(settings.servers_included_in_global_lb()))
+        ).order_by(Player.discord_member, Game.completed_ts, Game.id)
+        if member_ids is not None:
+            query = query.where(Player.discord_member.in_(member_ids))
+        if exclude_game:
+            query = query.where(Game.id != exclude_game.id)
+
+        records = {member_id: MemberStats(discord_member=member_id) for member_id in member_ids or []}
+        for member_id, completed_ts, size, winner_id, side_id, lineup_id, first_lineup_id, lineup_count in query.tuples():
+            record = records.get(member_id)
+            if record is None:
+                record = records[member_id] = MemberStats(discord_member=member_id)
+            is_winner = winner_id == side_id
+            record.record_result(completed_ts, is_winner, is_winner and lineup_id == first_lineup_id,
+                                 MemberStats.matchup(size, is_winner, lineup_count))
+
+        with db.atomic():
+            if member_ids is None:
+                MemberStats.delete().execute()
+            MemberStats.save_all(records.values())
+        return len(records)
+
+
+
+class TribeUsage(BaseModel):
+    # Number of games each member has played as each tribe in each server, for favorite_tribes() and tribe popularity stats.
+    # Counts lineups with a tribe set. Adjusted by Lineup.set_tribe(), Lineup.remove() and Game.delete_game(), and rebuilt from lineups by rebuild().
+    discord_member = ForeignKeyField(DiscordMember, on_delete='CASCADE')
+    guild_id = BitField(unique=False, null=False)
+    tribe = ForeignKeyField(Tribe, on_delete='CASCADE')
+    tribe_count = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'tribe_usage'
+        indexes = ((('discord_member', 'guild_id', 'tribe'), True),)   # Trailing comma is required
+
+    def lineup_counts_query(condition=None):
+        # Rows of (discord_member_id, guild_id, tribe_id, lineup count) for the lineups matching condition (all lineups if None)
+        query = Lineup.select(Player.discord_member, Player.guild_id, Lineup.tribe, fn.COUNT(Lineup.id)).join(Player).where(
+            Lineup.tribe.is_null(False)
+        ).group_by(Player.discord_member, Player.guild_id, Lineup.tribe)
+        return query.where(condition) if condition is not None else query
+
+    def lineup_counts(condition):
+        # Returns {(discord_member_id, guild_id, tribe_id): lineup count} for the lineups matching condition
+        query = TribeUsage.lineup_counts_query(condition)
+        return {(member_id, guild_id, tribe_id): count for member_id, guild_id, tribe_id, count in query.tuples()}
+
+    def apply(changes, sign: int = 1):
+        # changes is {(discord_member_id, guild_id, tribe_id): count}. Adds sign * count to each counter
+        with db.atomic():
+            for (member_id, guild_id, tribe_id), count in changes.items():
+                delta = sign * count
+                if delta > 0:
+                    TribeUsage.insert(discord_member=member_id, guild_id=guild_id, tribe=tribe_id, tribe_count=delta).on_conflict(
+                        conflict_target=[TribeUsage.discord_member, TribeUsage.guild_id, TribeUsage.tribe],
+                        update={TribeUsage.tribe_count: TribeUsage.tribe_count + delta}
+                    ).execute()
+                elif delta < 0:
+                    TribeUsage.update(tribe_count=TribeUsage.tribe_count + delta).where(
+                        (TribeUsage.discord_member == member_id) & (TribeUsage.guild_id == guild_id) & (TribeUsage.tribe == tribe_id)
+                    ).execute()
+
+    def popularity(guild_id: int = None):
+        # Returns [(Tribe, games played)], most played first, over every server or only guild_id
+        query = Tribe.select(Tribe, fn.SUM(TribeUsage.tribe_count).alias('tribe_count')).join(TribeUsage).group_by(Tribe.id).having(
+            fn.SUM(TribeUsage.tribe_count) > 0
+        ).order_by(-SQL('tribe_count'), Tribe.name)
+        if guild_id:
+            query = query.where(TribeUsage.guild_id == guild_id)
+        return [(tribe, tribe.tribe_count) for tribe in query]
+
+    def rebuild(member_ids=None):
+        # Recomputes the counters of member_ids (every member if None) from their lineups and returns the number of counters written
+        if member_ids is not None:
+            member_ids = list(set(member_ids))
+            if not member_ids:
+                return 0
+
+        query = TribeUsage.lineup_counts_query(Player.discord_member.in_(member_ids) if member_ids is not None else None)
+        delete_query = TribeUsage.delete()
+        if member_ids is not None:
+            delete_query = delete_query.where(TribeUsage.discord_member.in_(member_ids))
+
+        fields = [TribeUsage.discord_member, TribeUsage.guild_id, TribeUsage.tribe, TribeUsage.tribe_count]
+        with db.atomic():
+            delete_query.execute()
+            return TribeUsage.insert_from(query, fields).as_rowcount().execute()
+
+
 with db.connection_context():
     db.create_tables([
         Configuration, Team, DiscordMember, Game, Player, Tribe, Squad,
         GameSide, SquadMember, Lineup, GameLog, TeamServerBroadcastMessage,
-        ApiApplication
+        ApiApplication, RatingCheckpoint, EloEvent, LeaderboardSnapshot, SquadStats, MemberStats, TribeUsage
     ])
     # Only creates missing tables so should be safe to run each time
 
@@ -3322,3 +4171,11 @@ def generate_new_token(self):
         # Will throw one of above exceptions if foreign key already exists - exception depends on which version of psycopg2 is running
         # if exception is caught inside a transaction then the transaction will be rolled back (create_tables reverted),
         # so using the connection_context() and this section is not run using any transactions
+
+    if Squad.select().exists() and not SquadStats.select().exists():
+        # First start since squad_stats was added - Squad.leaderboard() and squad lookups need every squad to have a row
+        logger.warning(f'Populated squad_stats for {SquadStats.refresh()} squads')
+
+    if not EloEvent.select().exists() and Game.select().where((Game.is_confirmed == 1) & (Game.is_ranked == 1)).exists():
+        # First start since elo_event was added - reverse_elo_changes() and the rating history graphs read the ledger
+        logger.warning(f'Populated elo_event with {EloEvent.rebuild()} events')
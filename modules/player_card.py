@@ -0,0 +1,161 @@
+"""Statistics shown on the player card ($player), gathered by PlayerCardStats in a handful of queries.
+
+Every win/loss record on the card (local, global, pre-moonrise and PolyChampions season records) and the game counts come
+from one aggregate over the member's lineups, with one FILTERed COUNT per figure. Both ELO histories come from one query on
+elo_event. Leaderboard ranks come from rating_index, which answers from memory once its index is built. With advanced_stats(),
+favorite tribes, the player lookup and the recent games list a card takes fewer than ten round-trips.
+
+Built cards are cached in memory by (player_id, alltime_flag, rating_version). DiscordMember.rating_version is bumped by every
+rating or game change that shows on the member's card, so a changed card is simply looked up under a new key. Entries also
+expire after MAX_AGE, which covers profile edits such as names and Polytopia codes. Only the parts that depend on who is
+asking, the avatar thumbnail and the requester's 1v1 record, are worked out again for a cached card.
+"""
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from peewee import fn, JOIN, SQL
+
+import settings
+from modules import rating_index
+from modules.models import DiscordMember, EloEvent, Game, Lineup, moonrise_or_air_date_range, Player, Team
+
+logger = logging.getLogger('polybot.' + __name__)
+
+RECENT_DAYS = 30
+RECENT_GAMES_SHOWN = 5
+
+MAX_AGE = 60 * 10  # seconds
+MAX_ENTRIES = 500
+
+_lock = threading.Lock()
+_cards = OrderedDict()  # key -> (built_at, card), least recently used first
+stats = {'hits': 0, 'misses': 0}
+
+
+def card_key(player_id: int, alltime_flag: bool, rating_version: int):
+    return (player_id, bool(alltime_flag), rating_version)
+
+
+def get(key):
+    # Returns the cached card for key, or None. A card is (content_str, embed dict, graph PNG bytes or None)
+    with _lock:
+        entry = _cards.get(key)
+        if entry and timer() - entry[0] < MAX_AGE:
+            _cards.move_to_end(key)
+            stats['hits'] += 1
+            return entry[1]
+        _cards.pop(key, None)
+        stats['misses'] += 1
+        return None
+
+
+def put(key, card):
+    with _lock:
+        _cards[key] = (timer(), card)
+        _cards.move_to_end(key)
+        while len(_cards) > MAX_ENTRIES:
+            _cards.popitem(last=False)
+
+
+def summary():
+    with _lock:
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f'{100 * stats["hits"] / lookups:.1f}%' if lookups else 'n/a'
+        return f'{len(_cards)} cached player cards, {stats["hits"]} hits / {stats["misses"]} misses ({hit_rate})'
+
+
+class PlayerCardStats:
+
+    def __init__(self, player: Player, alltime_flag: bool = False):
+        self.player_id = player.id
+        self.alltime_flag = alltime_flag
+        self.player = None
+
+    def build(self):
+        # Runs every query. Call from an executor thread with a database connection
+        self.player = Player.select(Player, DiscordMember, Team).join(DiscordMember).join_from(Player, Team, JOIN.LEFT_OUTER).where(
+            Player.id == self.player_id
+        ).get()
+        member = self.player.discord_member
+
+        self.load_records()
+        self.rank, self.lb_length = rating_index.rank(self.player.guild_id, self.player.id)
+        self.rank_g, self.lb_length_g = rating_index.rank(None, member.id)
+        self.advanced_stats = member.advanced_stats()
+        self.favorite_tribes = list(member.favorite_tribes(limit=3))
+        self.load_elo_history()
+        self.recent_games = list(Game.search(player_filter=[self.player]).limit(RECENT_GAMES_SHOWN)) if self.games_total else []
+        return self
+
+    def load_records(self):
+        # One pass over the member's lineups in every guild. Each figure is counted the same way as the method named beside it
+        version = 'alltime' if self.alltime_flag else None
+        server_list = settings.servers_included_in_global_lb()
+        recent_cutoff = datetime.datetime.now() + datetime.timedelta(days=-RECENT_DAYS)
+
+        confirmed_ranked = (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_ranked == 1)
+        local = (Lineup.player == self.player_id)
+        won, lost = (Game.winner == Lineup.gameside), (Game.winner != Lineup.gameside)
+
+        def in_range(version):
+            date_min, date_max = moonrise_or_air_date_range(version=version)
+            return (Game.date >= date_min) & (Game.date <= date_max)
+
+        # DiscordMember.get_polychamps_record()
+        season_game = (Game.season.is_null(False) & (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_pending == 0))
+        pro_season, junior_season = (Game.league == 'P'), (Game.league == 'J')
+
+        counts = {
+            'wins': confirmed_ranked & local & won & in_range(version),  # Player.get_record()
+            'losses': confirmed_ranked & local & lost & in_range(version),
+            'wins_g': confirmed_ranked & Game.guild_id.in_(server_list) & won & in_range(version),  # DiscordMember.get_record()
+            'losses_g': confirmed_ranked & Game.guild_id.in_(server_list) & lost & in_range(version),
+            'air_wins': confirmed_ranked & local & won & in_range('air'),
+            'air_losses': confirmed_ranked & local & lost & in_range('air'),
+            'air_wins_g': confirmed_ranked & Game.guild_id.in_(server_list) & won & in_range('air'),
+            'air_losses_g': confirmed_ranked & Game.guild_id.in_(server_list) & lost & in_range('air'),
+            'pc_wins': season_game & won,
+            'pc_losses': season_game & lost,
+            'pc_pro_wins': season_game & pro_season & won,
+            'pc_pro_losses': season_game & pro_season & lost,
+            'pc_junior_wins': season_game & junior_season & won,
+            'pc_junior_losses': season_game & junior_season & lost,
+            'games_total': local,  # Game.search(player_filter=[player])
+            'games_recent': local & ((Game.date > recent_cutoff) | (Game.completed_ts > recent_cutoff)),  # Player.games_played(in_days=30)
+        }
+
+        query = Lineup.select(*[fn.COUNT(SQL('*')).filter(condition).alias(name) for name, condition in counts.items()]).join(
+            Game, on=(Lineup.game == Game.id)
+        ).join_from(Lineup, Player).where(Player.discord_member == self.player.discord_member_id)
+        row = query.dicts().get()
+
+        self.record = (row['wins'], row['losses'])
+        self.record_g = (row['wins_g'], row['losses_g'])
+        self.air_record = (row['air_wins'], row['air_losses'])
+        self.air_record_g = (row['air_wins_g'], row['air_losses_g'])
+        if row['pc_wins'] or row['pc_losses']:
+            self.polychamps_record = {
+                'full_record': (row['pc_wins'], row['pc_losses']),
+                'pro_record': (row['pc_pro_wins'], row['pc_pro_losses']),
+                'junior_record': (row['pc_junior_wins'], row['pc_junior_losses'])
+            }
+        else:
+            self.polychamps_record = None
+        self.games_total, self.games_recent = row['games_total'], row['games_recent']
+
+    def load_elo_history(self):
+        # (completed_ts, elo) lists for the local and global graphs, as EloEvent.history() returns them, in one query
+        flavors = ['elo_alltime'] if self.alltime_flag else ['elo', 'elo_moonrise']
+        query = EloEvent.select(EloEvent.entity_type, EloEvent.completed_ts, EloEvent.rating_after).where(
+            (((EloEvent.entity_type == 'player') & (EloEvent.entity_id == self.player.id)) |
+             ((EloEvent.entity_type == 'discordmember') & (EloEvent.entity_id == self.player.discord_member_id))) &
+            (EloEvent.flavor.in_(flavors)) & (EloEvent.rating_after.is_null(False))
+        ).order_by(EloEvent.completed_ts)
+
+        self.local_elo_history, self.global_elo_history = [], []
+        for entity_type, completed_ts, rating_after in query.tuples():
+            history = self.local_elo_history if entity_type == 'player' else self.global_elo_history
+            history.append((completed_ts, rating_after))
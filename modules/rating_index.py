@@ -0,0 +1,145 @@
+"""In-memory sorted index of the default individual leaderboards - one per guild, plus the global leaderboard.
+
+Each RatingIndex holds the same entries, in the same order, as Player/DiscordMember.leaderboard(settings.date_cutoff)
+for the current ELO version: ordered by rating descending, then id. Entries are packed into one sorted array of
+integer keys, so rank and top-K lookups are bisections rather than queries.
+
+An index is built from its leaderboard query the first time it is needed. After that, Game.declare_winner() calls
+record_ratings() to move the game's players within it. Any other change to ratings or eligibility calls invalidate(),
+which drops the index so that it is rebuilt lazily: reversals, deletions, recalculations and ELO bans. Indexes are
+also rebuilt after MAX_AGE, because players leave the leaderboard when their last game passes the activity cutoff.
+
+Indexes are built outside the lock, so invalidate() and record_ratings() bump a generation counter and get_index() does
+not store an index that was built under an older generation, which may have missed the change - as in leaderboard_cache.
+"""
+import logging
+import threading
+from array import array
+from bisect import bisect_left, insort
+from timeit import default_timer as timer
+
+import settings
+
+logger = logging.getLogger('polybot.' + __name__)
+
+MAX_AGE = 60 * 60 * 6  # seconds
+
+_lock = threading.Lock()
+_indexes = {}  # guild_id, or None for global -> RatingIndex
+_generation = 0
+
+
+class RatingIndex:
+    # Sorted array of keys packing (-rating, id), so ascending key order is leaderboard order
+
+    def __init__(self, entries):
+        # entries is an iterable of (id, rating)
+        self.ratings = dict(entries)
+        self.keys = array('q', sorted(self.key(entity_id, rating) for entity_id, rating in self.ratings.items()))
+        self.built_at = timer()
+
+    def key(self, entity_id: int, rating: int):
+        return (-rating << 32) | entity_id
+
+    def rank(self, entity_id: int):
+        # 1-based rank, or None if not on the leaderboard
+        rating = self.ratings.get(entity_id)
+        if rating is None:
+            return None
+        return bisect_left(self.keys, self.key(entity_id, rating)) + 1
+
+    def total(self):
+        return len(self.keys)
+
+    def top(self, k: int = 1):
+        # [(id, rating)] of the first k entries
+        return [(key & 0xFFFFFFFF, -(key >> 32)) for key in self.keys[:k]]
+
+    def update(self, entity_id: int, rating: int):
+        # Adds the entity or moves it to its new rating
+        self.remove(entity_id)
+        self.ratings[entity_id] = rating
+        insort(self.keys, self.key(entity_id, rating))
+
+    def remove(self, entity_id: int):
+        rating = self.ratings.pop(entity_id, None)
+        if rating is not None:
+            del self.keys[bisect_left(self.keys, self.key(entity_id, rating))]
+
+
+def current_field():
+    from modules import models  # imported here since models imports this module
+    return 'elo_moonrise' if models.is_post_moonrise() else 'elo'
+
+
+def build(guild_id: int = None):
+    from modules import models  # imported here since models imports this module
+
+    start = timer()
+    if guild_id is None:
+        query = models.DiscordMember.leaderboard(date_cutoff=settings.date_cutoff)
+    else:
+        query = models.Player.leaderboard(date_cutoff=settings.date_cutoff, guild_id=guild_id)
+    index = RatingIndex((row['id'], row['elo_field']) for row in query.dicts())
+    logger.debug(f'rating_index: built index for guild {guild_id} with {index.total()} entries in {timer() - start:.3f}s')
+    return index
+
+
+def get_index(guild_id: int = None):
+    # The index for guild_id (None for global), built if missing or expired
+    with _lock:
+        index = _indexes.get(guild_id)
+        if index and timer() - index.built_at < MAX_AGE:
+            return index
+        built_generation = _generation
+    index = build(guild_id)
+    with _lock:
+        if built_generation != _generation:
+            logger.debug(f'rating_index: discarded index for guild {guild_id} invalidated while it was being built')
+        else:
+            _indexes[guild_id] = index
+    return index
+
+
+def rank(guild_id: int, entity_id: int):
+    # Returns (rank, leaderboard size), as Player/DiscordMember.leaderboard_rank(settings.date_cutoff) would.
+    # Use guild_id None and a DiscordMember id for the global leaderboard
+    index = get_index(guild_id)
+    with _lock:
+        return (index.rank(entity_id), index.total())
+
+
+def top(guild_id: int = None, k: int = 1):
+    # [(id, rating)] for the first k entries of the leaderboard
+    index = get_index(guild_id)
+    with _lock:
+        return index.top(k)
+
+
+def record_ratings(guild_id: int, players, members):
+    # Called by the ELO write path with the Player and DiscordMember records of a game that was just rated, their rating
+    # fields already updated. Only indexes that are already built are touched. A player who was rated has just completed
+    # a ranked game, so they are on the leaderboard unless banned.
+    global _generation
+    field = current_field()
+    with _lock:
+        _generation += 1  # an index being built may have read the ratings from before this game
+        for index_key, records in ((guild_id, players), (None, members)):
+            index = _indexes.get(index_key)
+            if index is None:
+                continue
+            for record in records:
+                if record.is_banned or (index_key is not None and record.discord_member.is_banned):
+                    index.remove(record.id)
+                else:
+                    index.update(record.id, getattr(record, field))
+
+
+def invalidate(guild_id: int = None):
+    # Drops the index of guild_id and the global index, or every index if guild_id is None
+    global _generation
+    with _lock:
+        _generation += 1
+        for index_key in list(_indexes):
+            if guild_id is None or index_key is None or index_key == guild_id:
+                del _indexes[index_key]
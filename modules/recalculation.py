@@ -0,0 +1,812 @@
+"""In-memory replay of ranked game history, used for full ELO recalculation.
+
+Game.recalculate_all_elo() replays history by calling Game.declare_winner() once per game, which costs
+dozens of queries per game. EloReplay loads the same set of games, sides and lineups up front, replays every
+ELO flavor against array-backed rating tables and writes the results back with a handful of bulk UPDATEs.
+
+The arithmetic comes from modules.elo, the same pure functions behind Game.declare_winner(), so both paths agree.
+parity_check() compares them against each other.
+
+parallel_recalculate_all_elo() splits a full replay across processes: local (Player/Team/Squad) ratings never cross guilds,
+so each guild is replayed in its own worker, while the DiscordMember ratings that couple guilds get a single global pass.
+
+A replay can also start from a RatingCheckpoint (a packed snapshot of every rating as of a given game) instead of from
+scratch, which is how recalculate_from_checkpoint() replaces per-game reversal in Game.recalculate_elo_since().
+"""
+import datetime
+import logging
+import zlib
+from array import array
+from collections import namedtuple
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from timeit import default_timer as timer
+
+from peewee import fn
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import settings
+from modules import graphs, leaderboard_cache, rating_index
+from modules.elo import calc_version, host_bonus, player_elo_delta, side_win_chances, team_elo_delta
+from modules.models import db, DiscordMember, EloEvent, Game, GameSide, Lineup, Player, MemberStats, RatingCheckpoint, Squad, SquadStats, Team
+
+
+logger = logging.getLogger('polybot.' + __name__)
+elo_logger = logging.getLogger('polybot.elo')
+
+RATING_FIELDS = ('elo', 'elo_max', 'elo_alltime', 'elo_max_alltime', 'elo_moonrise', 'elo_max_moonrise')
+COUNT_FIELDS = ('ranked_game_count', 'ranked_game_count_moonrise')
+TEAM_FIELDS = ('elo', 'elo_alltime')
+SQUAD_FIELDS = ('elo', )
+LINEUP_FIELDS = ('elo_change_player', 'elo_change_discordmember', 'elo_change_player_alltime', 'elo_change_discordmember_alltime',
+                 'elo_change_player_moonrise', 'elo_change_discordmember_moonrise', 'elo_after_game', 'elo_after_game_global',
+                 'elo_after_game_alltime', 'elo_after_game_global_alltime', 'elo_after_game_moonrise', 'elo_after_game_global_moonrise')
+GLOBAL_LINEUP_FIELDS = tuple(field for field in LINEUP_FIELDS if 'discordmember' in field or 'global' in field)
+LOCAL_LINEUP_FIELDS = tuple(field for field in LINEUP_FIELDS if field not in GLOBAL_LINEUP_FIELDS)
+GAMESIDE_FIELDS = ('elo_change_squad', 'elo_change_team', 'elo_change_team_alltime', 'team_elo_after_game', 'team_elo_after_game_alltime')
+
+# (elo field, max field, lineup change field, lineup after-game field) for each flavor handled by Lineup.change_elo_after_game()
+LOCAL_ALLTIME = ('elo_alltime', 'elo_max_alltime', 'elo_change_player_alltime', 'elo_after_game_alltime')
+GLOBAL_ALLTIME = ('elo_alltime', 'elo_max_alltime', 'elo_change_discordmember_alltime', 'elo_after_game_global_alltime')
+LOCAL_MOONRISE = ('elo_moonrise', 'elo_max_moonrise', 'elo_change_player_moonrise', 'elo_after_game_moonrise')
+GLOBAL_MOONRISE = ('elo_moonrise', 'elo_max_moonrise', 'elo_change_discordmember_moonrise', 'elo_after_game_global_moonrise')
+LOCAL_AIR = ('elo', 'elo_max', 'elo_change_player', 'elo_after_game')
+GLOBAL_AIR = ('elo', 'elo_max', 'elo_change_discordmember', 'elo_after_game_global')
+
+ReplayGame = namedtuple('ReplayGame', ['id', 'guild_id', 'date', 'size', 'winner_id', 'completed_ts', 'sides'])
+ReplaySide = namedtuple('ReplaySide', ['id', 'team', 'squad', 'lineups'])  # team/squad are row numbers in the rating tables, or None
+ReplayLineup = namedtuple('ReplayLineup', ['id', 'player', 'member'])  # player/member are row numbers in the rating tables
+
+# Replay scopes. SCOPE_LOCAL covers Player/Team/Squad ratings for a single guild, SCOPE_GLOBAL covers DiscordMember ratings
+SCOPE_ALL, SCOPE_LOCAL, SCOPE_GLOBAL = 'all', 'local', 'global'
+
+# Checkpoint retention: the last checkpoint of each day for this many days, and the last checkpoint of each month for this many months
+CHECKPOINT_DAILY_DAYS = 14
+CHECKPOINT_MONTHLY_MONTHS = 12
+
+
+def replay_filter():
+    # Games replayed by Game.recalculate_all_elo(): confirmed ranked games, plus ranked games with a winner that were never marked completed
+    return ((Game.is_ranked == 1) & (Game.completed_ts.is_null(False)) & (Game.winner.is_null(False)) &
+            ((Game.is_confirmed == 1) | (Game.is_completed == 0)))
+
+
+def after_checkpoint(checkpoint: RatingCheckpoint):
+    # Games ordered after the last game included in checkpoint
+    return ((Game.completed_ts > checkpoint.completed_ts) |
+            ((Game.completed_ts == checkpoint.completed_ts) & (Game.id > checkpoint.last_game_id)))
+
+
+def checkpoint_wanted(day: datetime.date, next_day: datetime.date = None, today: datetime.date = None):
+    # Retention policy: should a checkpoint taken after the last game of day be kept, given the day of the following game (None if no more games)
+    today = today or datetime.date.today()
+    if next_day == day:
+        return False
+    age = (today - day).days
+    if age <= CHECKPOINT_DAILY_DAYS:
+        return True
+    end_of_month = next_day is None or (next_day.year, next_day.month) != (day.year, day.month)
+    return end_of_month and age <= CHECKPOINT_MONTHLY_MONTHS * 31
+
+
+def average_elo(column, rows):
+    return int(round(sum(column[row] for row in rows) / len(rows)))
+
+
+class RatingTable:
+    # Dense array-backed ratings for one entity type. Row n holds the values for the entity with id ids[n]
+
+    def __init__(self, ids, fields):
+        # fields is a dict of {column name: initial value}
+        self.ids = array('q', ids)
+        self.index = {entity_id: row for row, entity_id in enumerate(self.ids)}
+        self.columns = {field: array('l', [initial]) * len(self.ids) for field, initial in fields.items()}
+
+    def from_model(model, fields):
+        # Table holding the values currently stored in the database for every record of model
+        rows = list(model.select(model.id, *[getattr(model, field) for field in fields]).order_by(model.id).tuples())
+        table = RatingTable([r[0] for r in rows], {field: 0 for field in fields})
+        for n, field in enumerate(fields, start=1):
+            table.columns[field] = array('l', [r[n] for r in rows])
+        return table
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, entity_id):
+        return self.index[entity_id] if entity_id is not None else None
+
+    def values(self, row, fields):
+        return {field: self.columns[field][row] for field in fields}
+
+    def pack(self, fields):
+        # Compact form stored in RatingCheckpoint: a header line naming the fields, then the ids and each column as packed integers
+        header = ','.join(fields).encode() + b'\n'
+        body = self.ids.tobytes() + b''.join(array('i', self.columns[field]).tobytes() for field in fields)
+        return zlib.compress(header + body)
+
+    def overlay(self, packed: bytes):
+        # Copies values from the output of pack() into this table. Ids that are not in this table are ignored
+        header, body = zlib.decompress(packed).split(b'\n', 1)
+        fields = header.decode().split(',')
+        count = len(body) // (array('q').itemsize + array('i').itemsize * len(fields))
+
+        ids = array('q')
+        ids.frombytes(body[:count * ids.itemsize])
+        rows = [self.index.get(entity_id) for entity_id in ids]
+        offset = count * ids.itemsize
+        for field in fields:
+            column = array('i')
+            column.frombytes(body[offset:offset + count * column.itemsize])
+            offset += count * column.itemsize
+            if field not in self.columns:
+                continue
+            target = self.columns[field]
+            for row, value in zip(rows, column):
+                if row is not None:
+                    target[row] = value
+
+
+class EloReplay:
+
+    def __init__(self, checkpoint: RatingCheckpoint = None, scope: str = SCOPE_ALL, guild_id: int = None, component: tuple = None):
+        # With a checkpoint, ratings start from the snapshot and only the games after it are replayed.
+        # scope limits the replay to one guild's local ratings (SCOPE_LOCAL, with guild_id) or to global ratings (SCOPE_GLOBAL).
+        # component is (game ids, entity ids) from influence_component(), limiting a checkpoint replay to those games and ratings
+        self.checkpoint = checkpoint
+        self.scope = scope
+        self.guild_id = guild_id
+        self.component = component
+        self.global_guilds = set(settings.servers_included_in_global_lb())
+        self.game_filter = replay_filter() & after_checkpoint(checkpoint) if checkpoint else replay_filter()
+        if scope == SCOPE_LOCAL:
+            self.game_filter &= (Game.guild_id == guild_id)
+        elif scope == SCOPE_GLOBAL:
+            self.game_filter &= (Game.guild_id.in_(list(self.global_guilds)))
+        if component is not None:
+            self.game_filter &= (Game.id.in_(list(component[0])))
+        self.games = []
+        self.players = self.members = self.teams = self.squads = None
+        self.bot_players = set()  # player rows belonging to the ELO bot, whose ratings never change
+        self.lineup_changes = {}  # lineup id: {field: value} for every lineup field written during the replay
+        self.side_changes = {}  # gameside id: {field: value}
+        self.skipped_game_ids = []  # games with an empty side, which declare_winner() refuses and leaves incomplete
+        self.revived_game_ids = []  # replayed games that were not already flagged completed + confirmed
+        self.checkpoints = []  # RatingCheckpoint records taken during replay(), saved by write()
+        self.merged_ids = {}  # ids merged from scoped replays by merge_results(), by table
+
+    def load(self):
+        start = timer()
+        self.load_tables()
+        self.load_games()
+        logger.info(f'EloReplay ({self.scope}) loaded {len(self.games)} games, {len(self.players)} players, {len(self.members)} members in {timer() - start:.2f}s')
+
+    def load_tables(self):
+        # Rating tables for every entity, holding the starting values of the replay
+        db.connect(reuse_if_open=True)
+        bot_ids = [settings.bot_id, settings.bot_id_beta]
+
+        member_rows = list(DiscordMember.select(DiscordMember.id, DiscordMember.discord_id).order_by(DiscordMember.id).tuples())
+        self.members = RatingTable([m[0] for m in member_rows], self.rating_fields())
+        for member_id, discord_id in member_rows:
+            if discord_id in bot_ids:
+                self.reset_row(self.members, self.members.row(member_id), 0)
+
+        player_rows = list(Player.select(Player.id, Player.discord_member).order_by(Player.id).tuples())
+        self.players = RatingTable([p[0] for p in player_rows], self.rating_fields())
+        self.player_members = array('l', [self.members.row(p[1]) for p in player_rows])
+        bot_members = {row for row, (member_id, discord_id) in enumerate(member_rows) if discord_id in bot_ids}
+        for player_row, member_row in enumerate(self.player_members):
+            if member_row in bot_members:
+                self.bot_players.add(player_row)
+                self.reset_row(self.players, player_row, 0)
+
+        self.teams = RatingTable([t[0] for t in Team.select(Team.id).order_by(Team.id).tuples()], {field: 1000 for field in TEAM_FIELDS})
+        self.squads = RatingTable([s[0] for s in Squad.select(Squad.id).order_by(Squad.id).tuples()], {'elo': 1000, 'games': 0})
+
+        if self.checkpoint:
+            self.players.overlay(self.checkpoint.player_data)
+            self.members.overlay(self.checkpoint.discordmember_data)
+            self.teams.overlay(self.checkpoint.team_data)
+            self.squads.overlay(self.checkpoint.squad_data)
+
+        self.load_static_counts()
+
+        # Unconfirmed wins are never replayed, but count towards every K-factor as in declare_winner() - {row: {count field: games}}
+        self.player_claims, self.member_claims = {}, {}
+        for entity, table, claims in ((Player.id, self.players, self.player_claims), (Player.discord_member, self.members, self.member_claims)):
+            for entity_id, counts in Game.unconfirmed_claim_counts(entity).items():
+                claims[table.row(entity_id)] = dict(zip(COUNT_FIELDS, counts))
+
+    def load_games(self):
+        if self.scope == SCOPE_GLOBAL:
+            reset_fields = GLOBAL_LINEUP_FIELDS
+        elif self.scope == SCOPE_LOCAL:
+            reset_fields = LOCAL_LINEUP_FIELDS
+        else:
+            reset_fields = LINEUP_FIELDS
+
+        lineups_by_side = {}
+        lineup_query = Lineup.select(Lineup.id, Lineup.gameside, Lineup.player).join(Game).where(self.game_filter).order_by(Lineup.id)
+        for lineup_id, side_id, player_id in lineup_query.tuples():
+            player_row = self.players.row(player_id)
+            lineups_by_side.setdefault(side_id, []).append(ReplayLineup(lineup_id, player_row, self.player_members[player_row]))
+            if self.checkpoint:
+                # Replaying part of the history stands in for Game.reverse_elo_changes(), so start from its cleared values
+                self.lineup_changes[lineup_id] = {field: (0 if field.startswith('elo_change') else None) for field in reset_fields}
+
+        sides_by_game = {}
+        side_query = GameSide.select(GameSide.id, GameSide.game, GameSide.team, GameSide.squad).join(Game, on=(GameSide.game == Game.id)).where(
+            self.game_filter).order_by(GameSide.game, GameSide.position, GameSide.id)
+        for side_id, game_id, team_id, squad_id in side_query.tuples():
+            if self.checkpoint and self.scope != SCOPE_GLOBAL:
+                self.side_changes[side_id] = {field: (0 if field.startswith('elo_change') else None) for field in GAMESIDE_FIELDS}
+            sides_by_game.setdefault(game_id, []).append(
+                ReplaySide(side_id, self.teams.row(team_id), self.squads.row(squad_id), lineups_by_side.get(side_id, []))
+            )
+
+        game_query = Game.select(Game.id, Game.guild_id, Game.date, Game.size, Game.winner, Game.completed_ts, Game.is_completed, Game.is_confirmed).where(
+            self.game_filter).order_by(Game.completed_ts, Game.id)
+        for game_id, guild_id, date, size, winner_id, completed_ts, is_completed, is_confirmed in game_query.tuples():
+            self.games.append(ReplayGame(game_id, guild_id, date, size, winner_id, completed_ts, sides_by_game.get(game_id, [])))
+            if not (is_completed and is_confirmed):
+                self.revived_game_ids.append(game_id)
+
+    def rating_fields(self):
+        fields = {field: 1000 for field in RATING_FIELDS}
+        fields.update({field: 0 for field in COUNT_FIELDS})
+        return fields
+
+    def game_count(self, table, claims, row, field):
+        # Number of games that picks the K-factor: games counted so far, plus unconfirmed wins
+        return table[field][row] + claims.get(row, {}).get(field, 0)
+
+    def reset_row(self, table, row, value):
+        for field in RATING_FIELDS:
+            table[field][row] = value
+
+    def load_static_counts(self):
+        # Ranked games flagged completed that are not part of the replay (ie. unconfirmed wins, or games before the checkpoint)
+        # still count towards Squad.completed_game_count() during a recalculation, so seed the squad counters with them.
+        static_filter = (Game.is_ranked == 1) & (Game.is_completed == 1) & ~(self.game_filter)
+
+        side_query = GameSide.select(GameSide.squad).join(Game, on=(GameSide.game == Game.id)).where(static_filter & GameSide.squad.is_null(False))
+        for (squad_id, ) in side_query.tuples():
+            self.squads['games'][self.squads.row(squad_id)] += 1
+
+    def replay(self, take_checkpoints: bool = False):
+        # take_checkpoints: snapshot the ratings after every game where checkpoint_wanted() says a retained checkpoint belongs
+        start = timer()
+        team_elo_reset_date = datetime.datetime.strptime(settings.team_elo_reset_date, "%m/%d/%Y").date()
+        for n, game in enumerate(self.games):
+            self.replay_game(game, team_elo_reset_date)
+            if take_checkpoints:
+                next_day = self.games[n + 1].completed_ts.date() if n + 1 < len(self.games) else None
+                if checkpoint_wanted(game.completed_ts.date(), next_day):
+                    self.checkpoints.append(self.snapshot(game, game_count=n + 1))
+        logger.info(f'EloReplay replayed {len(self.games)} games in {timer() - start:.2f}s, taking {len(self.checkpoints)} checkpoints')
+
+    def snapshot(self, game: ReplayGame, game_count: int):
+        return RatingCheckpoint(completed_ts=game.completed_ts, last_game_id=game.id, game_count=game_count,
+                                player_data=self.players.pack(RATING_FIELDS + COUNT_FIELDS),
+                                discordmember_data=self.members.pack(RATING_FIELDS + COUNT_FIELDS),
+                                team_data=self.teams.pack(TEAM_FIELDS), squad_data=self.squads.pack(SQUAD_FIELDS))
+
+    def export_results(self):
+        # Picklable results of a scoped replay, for merging into the parent process with merge_results()
+        touched_players = {lineup.player for game in self.games for side in game.sides for lineup in side.lineups}
+        touched_members = {lineup.member for game in self.games for side in game.sides for lineup in side.lineups}
+        touched_teams = {side.team for game in self.games for side in game.sides if side.team is not None}
+        touched_squads = {side.squad for game in self.games for side in game.sides if side.squad is not None}
+        if self.checkpoint:
+            # Every rating in scope was restored from the checkpoint, including those whose only later games were since unwon or deleted
+            touched_members = range(len(self.members))
+            touched_players = {self.players.row(p) for (p, ) in Player.select(Player.id).where(Player.guild_id == self.guild_id).tuples()}
+            touched_teams = {self.teams.row(t) for (t, ) in Team.select(Team.id).where(Team.guild_id == self.guild_id).tuples()}
+            touched_squads = {self.squads.row(s) for (s, ) in Squad.select(Squad.id).where(Squad.guild_id == self.guild_id).tuples()}
+            if self.component is not None:
+                # only the ratings in the component were restored - see influence_component()
+                entity_ids = self.component[1]
+                touched_members = {self.members.row(m) for m in entity_ids['discord_member']}
+                touched_players &= {self.players.row(p) for p in entity_ids['player']}
+                touched_teams &= {self.teams.row(t) for t in entity_ids['team']}
+                touched_squads &= {self.squads.row(s) for s in entity_ids['squad']}
+
+        results = {'games': len(self.games), 'lineup_changes': self.lineup_changes, 'side_changes': self.side_changes,
+                   'skipped_game_ids': self.skipped_game_ids, 'revived_game_ids': self.revived_game_ids}
+        if self.scope == SCOPE_GLOBAL:
+            results['members'] = {self.members.ids[row]: self.members.values(row, RATING_FIELDS + COUNT_FIELDS) for row in touched_members}
+        else:
+            results['players'] = {self.players.ids[row]: self.players.values(row, RATING_FIELDS + COUNT_FIELDS) for row in touched_players}
+            results['teams'] = {self.teams.ids[row]: self.teams.values(row, TEAM_FIELDS) for row in touched_teams}
+            results['squads'] = {self.squads.ids[row]: self.squads.values(row, SQUAD_FIELDS) for row in touched_squads}
+        return results
+
+    def merge_results(self, results: dict):
+        # Copies the output of a scoped replay's export_results() into this replay's tables. Returns False if a rating
+        # was already merged from another scope, which would mean the guilds were not actually independent
+        for key, table in (('players', self.players), ('members', self.members), ('teams', self.teams), ('squads', self.squads)):
+            merged = self.merged_ids.setdefault(key, set())
+            for entity_id, values in results.get(key, {}).items():
+                if entity_id in merged:
+                    logger.error(f'merge_results: {key} {entity_id} was replayed by more than one worker')
+                    return False
+                merged.add(entity_id)
+                row = table.row(entity_id)
+                for field, value in values.items():
+                    table[field][row] = value
+
+        for record_changes, merged_changes in ((results['lineup_changes'], self.lineup_changes), (results['side_changes'], self.side_changes)):
+            for record_id, values in record_changes.items():
+                merged_changes.setdefault(record_id, {}).update(values)
+        self.skipped_game_ids = sorted(set(self.skipped_game_ids) | set(results['skipped_game_ids']))
+        self.revived_game_ids = sorted(set(self.revived_game_ids) | set(results['revived_game_ids']))
+        return True
+
+    def entity_tables(self):
+        return ((Player, self.players, RATING_FIELDS + COUNT_FIELDS), (DiscordMember, self.members, RATING_FIELDS + COUNT_FIELDS),
+                (Team, self.teams, TEAM_FIELDS), (Squad, self.squads, SQUAD_FIELDS))
+
+    def stored_records(self, model, fields):
+        # {id: {field: value}} for the lineups or gamesides of every replayed game, as currently stored
+        query = model.select(model.id, *[getattr(model, f) for f in fields]).join(Game, on=(model.game == Game.id)).where(self.game_filter)
+        return {row[0]: dict(zip(fields, row[1:])) for row in query.tuples()}
+
+    def replay_game(self, game: ReplayGame, team_elo_reset_date: datetime.date):
+        # Equivalent of Game.declare_winner(winning_side, confirm=True) for a ranked game
+        if min(game.size) <= 0:
+            logger.error(f'Cannot replay game {game.id}: Side with 0 players detected.')
+            self.skipped_game_ids.append(game.id)
+            return
+
+        version = calc_version(game.date)
+        bonus = host_bonus(version, game.size)
+
+        if self.scope != SCOPE_GLOBAL:
+            self.replay_local(game, version, bonus, team_elo_reset_date)
+        if self.scope != SCOPE_LOCAL and game.guild_id in self.global_guilds:
+            self.replay_global(game, version, bonus)
+
+    def replay_local(self, game: ReplayGame, version: int, bonus: int, team_elo_reset_date: datetime.date):
+        # Player, Team and Squad ratings - these only ever interact with other ratings from the same guild
+        players, teams, squads = self.players, self.teams, self.squads
+        largest_side, smallest_side = max(game.size), min(game.size)
+        post_moonrise = game.date >= settings.moonrise_reset_date
+        era_field = 'elo_moonrise' if post_moonrise else 'elo'
+        sides = game.sides
+        side_sizes = [len(side.lineups) for side in sides]
+
+        side_elos = [average_elo(players[era_field], [lineup.player for lineup in side.lineups]) for side in sides]
+        side_elos_alltime = [average_elo(players['elo_alltime'], [lineup.player for lineup in side.lineups]) for side in sides]
+        side_elos[0] += bonus
+        side_elos_alltime[0] += bonus
+
+        team_elos = [teams['elo'][side.team] if side.team is not None else None for side in sides]
+        team_elos_alltime = [teams['elo_alltime'][side.team] if side.team is not None else None for side in sides]
+        squad_elos = [squads['elo'][side.squad] if side.squad is not None else None for side in sides]
+
+        chances = side_win_chances(largest_side, side_sizes, side_elos, version)
+        chances_alltime = side_win_chances(largest_side, side_sizes, side_elos_alltime, version)
+
+        team_chances, team_chances_alltime, squad_chances = None, None, None
+        if smallest_side > 1:
+            if None not in team_elos:
+                team_chances = side_win_chances(largest_side, side_sizes, team_elos, version)
+                team_chances_alltime = side_win_chances(largest_side, side_sizes, team_elos_alltime, version)
+            if None not in squad_elos:
+                squad_chances = side_win_chances(largest_side, side_sizes, squad_elos, version)
+        if game.date < team_elo_reset_date:
+            team_chances = None
+
+        skip_local_era = post_moonrise and smallest_side == 1 and game.guild_id == settings.server_ids['polychampions']
+
+        for i, side in enumerate(sides):
+            is_winner = side.id == game.winner_id
+            for lineup in side.lineups:
+                if lineup.player in self.bot_players:
+                    continue  # keep elobot's elo at 0 always - for penalty games
+
+                self.change_elo(players, lineup.player, lineup.id, LOCAL_ALLTIME, self.game_count(players, self.player_claims, lineup.player, 'ranked_game_count'), chances_alltime[i], is_winner)
+                if not post_moonrise:
+                    self.change_elo(players, lineup.player, lineup.id, LOCAL_AIR, self.game_count(players, self.player_claims, lineup.player, 'ranked_game_count'), chances[i], is_winner)
+                elif not skip_local_era:
+                    self.change_elo(players, lineup.player, lineup.id, LOCAL_MOONRISE, self.game_count(players, self.player_claims, lineup.player, 'ranked_game_count_moonrise'), chances[i], is_winner)
+
+            if team_chances:
+                elo_delta = team_elo_delta(team_chances[i], is_winner)
+                teams['elo'][side.team] += elo_delta
+                self.side_changes.setdefault(side.id, {}).update(elo_change_team=elo_delta, team_elo_after_game=teams['elo'][side.team])
+            if team_chances_alltime:
+                elo_delta = team_elo_delta(team_chances_alltime[i], is_winner)
+                teams['elo_alltime'][side.team] += elo_delta
+                self.side_changes.setdefault(side.id, {}).update(elo_change_team_alltime=elo_delta, team_elo_after_game_alltime=teams['elo_alltime'][side.team])
+            if squad_chances:
+                elo_delta = team_elo_delta(squad_chances[i], is_winner, max_elo_delta=50 if squads['games'][side.squad] < 6 else 32)
+                squads['elo'][side.squad] += elo_delta
+                self.side_changes.setdefault(side.id, {})['elo_change_squad'] = elo_delta
+
+        # game is now completed, so it counts towards the K-factor game counts for the rest of the replay
+        for side in sides:
+            if side.squad is not None:
+                squads['games'][side.squad] += 1
+            for lineup in side.lineups:
+                players['ranked_game_count'][lineup.player] += 1
+                if post_moonrise:
+                    players['ranked_game_count_moonrise'][lineup.player] += 1
+
+    def replay_global(self, game: ReplayGame, version: int, bonus: int):
+        # DiscordMember ratings, for games from servers included in the global leaderboard
+        members = self.members
+        largest_side = max(game.size)
+        post_moonrise = game.date >= settings.moonrise_reset_date
+        era_field = 'elo_moonrise' if post_moonrise else 'elo'
+        sides = game.sides
+        side_sizes = [len(side.lineups) for side in sides]
+
+        side_elos_discord = [average_elo(members[era_field], [lineup.member for lineup in side.lineups]) for side in sides]
+        side_elos_discord_alltime = [average_elo(members['elo_alltime'], [lineup.member for lineup in side.lineups]) for side in sides]
+        side_elos_discord[0] += bonus
+        side_elos_discord_alltime[0] += bonus
+
+        chances_discord = side_win_chances(largest_side, side_sizes, side_elos_discord, version)
+        chances_discord_alltime = side_win_chances(largest_side, side_sizes, side_elos_discord_alltime, version)
+
+        for i, side in enumerate(sides):
+            is_winner = side.id == game.winner_id
+            for lineup in side.lineups:
+                if lineup.player in self.bot_players:
+                    continue
+
+                self.change_elo(members, lineup.member, lineup.id, GLOBAL_ALLTIME, self.game_count(members, self.member_claims, lineup.member, 'ranked_game_count'), chances_discord_alltime[i], is_winner)
+                if post_moonrise:
+                    self.change_elo(members, lineup.member, lineup.id, GLOBAL_MOONRISE, self.game_count(members, self.member_claims, lineup.member, 'ranked_game_count_moonrise'), chances_discord[i], is_winner)
+                else:
+                    self.change_elo(members, lineup.member, lineup.id, GLOBAL_AIR, self.game_count(members, self.member_claims, lineup.member, 'ranked_game_count'), chances_discord[i], is_winner)
+
+        for side in sides:
+            for lineup in side.lineups:
+                members['ranked_game_count'][lineup.member] += 1
+                if post_moonrise:
+                    members['ranked_game_count_moonrise'][lineup.member] += 1
+
+    def change_elo(self, table: RatingTable, row: int, lineup_id: int, flavor, num_games: int, chance_of_winning: float, is_winner: bool):
+        elo_field, max_field, change_field, aftergame_field = flavor
+        elo = table[elo_field][row]
+        elo_delta = player_elo_delta(elo, num_games, chance_of_winning, is_winner)
+        new_elo = int(elo + elo_delta)
+
+        table[elo_field][row] = new_elo
+        if new_elo > table[max_field][row]:
+            table[max_field][row] = new_elo
+
+        changes = self.lineup_changes.setdefault(lineup_id, {})
+        changes[change_field] = elo_delta
+        changes[aftergame_field] = new_elo
+
+    def write(self, batch_size: int = 1000):
+        # Writes every rating and lineup/gameside field that differs from what is stored, plus any checkpoints taken, in one transaction
+        start = timer()
+        written = 0
+        with db.atomic():
+            for model, table, fields in self.entity_tables():
+                stored = RatingTable.from_model(model, fields)
+                changed = []
+                for row, entity_id in enumerate(table.ids):
+                    values = table.values(row, fields)
+                    stored_row = stored.row(entity_id) if entity_id in stored.index else None
+                    if stored_row is None or values != stored.values(stored_row, fields):
+                        changed.append(model(id=entity_id, **values))
+                if changed:
+                    model.bulk_update(changed, fields=list(fields), batch_size=batch_size)
+                    written += len(changed)
+
+            # Group records by which fields were written so that untouched fields (ie. moonrise fields on pre-moonrise games) keep their values
+            for model, changes, fields in ((Lineup, self.lineup_changes, LINEUP_FIELDS), (GameSide, self.side_changes, GAMESIDE_FIELDS)):
+                stored = self.stored_records(model, fields)
+                grouped = {}
+                for record_id, values in changes.items():
+                    current = stored.get(record_id, {})
+                    if any(current.get(field) != value for field, value in values.items()):
+                        grouped.setdefault(tuple(sorted(values)), []).append(model(id=record_id, **values))
+                for changed_fields, records in grouped.items():
+                    model.bulk_update(records, fields=list(changed_fields), batch_size=batch_size)
+                    written += len(records)
+
+            # The ledger follows the change columns written above
+            EloEvent.rebuild(after_checkpoint(self.checkpoint) if self.checkpoint else None)
+
+            # Player cards of everyone in a replayed game, whose ratings or history may have moved
+            DiscordMember.bump_rating_versions(Player.select(Player.discord_member).join(Lineup).join(Game, on=(Lineup.game == Game.id)).where(self.game_filter))
+
+            skipped = set(self.skipped_game_ids)
+            revived = [game_id for game_id in self.revived_game_ids if game_id not in skipped]
+            if revived:
+                Game.update(is_completed=1, is_confirmed=1).where(Game.id.in_(revived)).execute()
+            if self.skipped_game_ids:
+                Game.update(is_completed=0, is_confirmed=0).where(Game.id.in_(self.skipped_game_ids)).execute()
+            if revived or self.skipped_game_ids:
+                SquadStats.refresh()
+                MemberStats.rebuild()
+
+            # Checkpoints after the starting point no longer describe the stored ratings
+            stale_checkpoints = RatingCheckpoint.delete()
+            if self.checkpoint:
+                stale_checkpoints = stale_checkpoints.where(
+                    (RatingCheckpoint.completed_ts > self.checkpoint.completed_ts) |
+                    ((RatingCheckpoint.completed_ts == self.checkpoint.completed_ts) & (RatingCheckpoint.last_game_id > self.checkpoint.last_game_id))
+                )
+            stale_checkpoints.execute()
+            for checkpoint in self.checkpoints:
+                checkpoint.save(force_insert=True)
+
+        def invalidate():
+            leaderboard_cache.invalidate(reason='EloReplay.write')
+            graphs.invalidate_team_series(reason='EloReplay.write')
+            rating_index.invalidate()
+        db.on_commit(invalidate)
+        logger.info(f'EloReplay wrote {written} changed records and {len(self.checkpoints)} checkpoints in {timer() - start:.2f}s')
+
+    def compare_with_database(self):
+        # Returns a list of differences between the replay results and what is currently stored in the database
+        mismatches = []
+
+        def compare(label, record_id, expected: dict, actual: dict):
+            for field, value in expected.items():
+                if actual.get(field) != value:
+                    mismatches.append(f'{label} {record_id} {field}: replay {value} database {actual.get(field)}')
+
+        for model, table, fields in self.entity_tables():
+            stored = RatingTable.from_model(model, fields)
+            for row, entity_id in enumerate(table.ids):
+                stored_values = stored.values(stored.row(entity_id), fields) if entity_id in stored.index else {}
+                compare(model.__name__, entity_id, table.values(row, fields), stored_values)
+
+        for model, changes, fields in ((Lineup, self.lineup_changes, LINEUP_FIELDS), (GameSide, self.side_changes, GAMESIDE_FIELDS)):
+            stored = self.stored_records(model, fields)
+            for record_id, values in changes.items():
+                compare(model.__name__, record_id, values, stored.get(record_id, {}))
+
+        return mismatches
+
+
+def recalculate_all_elo():
+    # Drop-in replacement for Game.recalculate_all_elo() using the in-memory replay
+    logger.warning('Resetting and recalculating all ELO (in-memory replay)')
+    elo_logger.info('recalculate_all_elo (in-memory replay)')
+    settings.recalculation_mode = True
+    try:
+        replay = EloReplay()
+        replay.load()
+        replay.replay(take_checkpoints=True)
+        replay.write()
+    finally:
+        settings.recalculation_mode = False
+    elo_logger.info('recalculate_all_elo (in-memory replay) complete')
+    return replay
+
+
+def replay_scope(scope: str, guild_id: int = None):
+    # Worker process entry point for parallel_recalculate_all_elo(). Each worker opens its own database connection
+    start = timer()
+    db.connect(reuse_if_open=True)
+    try:
+        replay = EloReplay(scope=scope, guild_id=guild_id)
+        replay.load()
+        replay.replay()
+        results = replay.export_results()
+    finally:
+        db.close()
+    results.update(scope=scope, guild_id=guild_id, seconds=timer() - start)
+    return results
+
+
+def parallel_recalculate_all_elo(workers: int):
+    # Same result as recalculate_all_elo(), with each guild's local ratings and the global ratings replayed in separate processes.
+    # Returns a list of (label, games replayed, seconds) for each unit of work
+    logger.warning(f'Resetting and recalculating all ELO (in-memory replay, {workers} workers)')
+    elo_logger.info('parallel_recalculate_all_elo')
+    settings.recalculation_mode = True
+    timings = []
+    try:
+        replay = EloReplay()
+        replay.load_tables()
+        guild_ids = [g[0] for g in Game.select(Game.guild_id).where(replay_filter()).distinct().tuples()]
+        db.close()  # forked workers must not share this connection
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(replay_scope, SCOPE_GLOBAL)] + [pool.submit(replay_scope, SCOPE_LOCAL, guild_id) for guild_id in guild_ids]
+            for future in as_completed(futures):
+                results = future.result()
+                label = 'global' if results['scope'] == SCOPE_GLOBAL else f'guild {results["guild_id"]}'
+                timings.append((label, results['games'], results['seconds']))
+                if not replay.merge_results(results):
+                    pool.shutdown(cancel_futures=True)
+                    logger.error('parallel_recalculate_all_elo: guilds share ratings, falling back to a single-process replay')
+                    settings.recalculation_mode = False
+                    recalculate_all_elo()
+                    return timings
+
+        db.connect(reuse_if_open=True)
+        replay.write()
+        create_checkpoint()  # replay() could not take checkpoints across workers, so start over from the final ratings
+    finally:
+        settings.recalculation_mode = False
+    elo_logger.info('parallel_recalculate_all_elo complete')
+    return timings
+
+
+def nearest_checkpoint(timestamp: datetime.datetime):
+    # Latest checkpoint that only includes games completed before timestamp, or None
+    return RatingCheckpoint.select().where(RatingCheckpoint.completed_ts < timestamp).order_by(
+        RatingCheckpoint.completed_ts.desc(), RatingCheckpoint.last_game_id.desc()).first()
+
+
+def influence_component(checkpoint: RatingCheckpoint, seed: dict, guild_filter):
+    # Games after checkpoint (among those matching guild_filter) that have to be replayed when the ratings in seed (see
+    # Game.influence_seed()) are restored from checkpoint, and every rating they reach. A restored rating has to replay all of
+    # its games since the checkpoint, which restores every other rating in those games too, so this grows until nothing changes -
+    # the ratings that play none of these games keep their stored values. Returns (game ids, {entity type: ids})
+    global_guilds = set(settings.servers_included_in_global_lb())
+    query = Lineup.select(Game.id, Game.guild_id, Lineup.player, Player.discord_member, GameSide.team, GameSide.squad).join(
+        Game).join_from(Lineup, Player).join_from(Lineup, GameSide).where(replay_filter() & after_checkpoint(checkpoint) & guild_filter)
+
+    games = {}
+    for game_id, guild_id, player_id, discord_member_id, team_id, squad_id in query.tuples():
+        entities = games.setdefault(game_id, {'player': set(), 'discord_member': set(), 'team': set(), 'squad': set()})
+        entities['player'].add(player_id)
+        if guild_id in global_guilds:
+            entities['discord_member'].add(discord_member_id)
+        if team_id:
+            entities['team'].add(team_id)
+        if squad_id:
+            entities['squad'].add(squad_id)
+
+    affected = {key: set(ids) for key, ids in seed.items()}
+    game_ids, changed = set(), True
+    while changed:
+        changed = False
+        for game_id, entities in games.items():
+            if game_id not in game_ids and any(entities[key] & affected[key] for key in entities):
+                game_ids.add(game_id)
+                changed = True
+                for key in entities:
+                    affected[key].update(entities[key])
+    return game_ids, affected
+
+
+def recalculate_from_checkpoint(checkpoint: RatingCheckpoint, guild_id: int = None, seed: dict = None):
+    # Restores the ratings in checkpoint and replays every game after it. Used by Game.recalculate_elo_since() in place of reversing games one by one.
+    # With guild_id, only that guild's local ratings are restored and replayed, plus the global ratings if the guild is on the global leaderboard -
+    # and with seed as well, only the ratings and games that seed reaches (see influence_component()). Returns the number of games replayed
+    elo_logger.info(f'recalculate_from_checkpoint {checkpoint.id} as of game {checkpoint.last_game_id} ({checkpoint.completed_ts}) guild {guild_id}')
+    if guild_id is None:
+        replay = EloReplay(checkpoint=checkpoint)
+        replay.load()
+        replay.replay(take_checkpoints=True)
+        replay.write()
+        return len(replay.games)
+
+    # Scoped replays cannot snapshot every guild's ratings, so start from the stored ratings and merge the scoped results in
+    replay = EloReplay()
+    replay.load_tables()
+    replay.checkpoint = checkpoint
+    is_global = guild_id in replay.global_guilds
+    guild_filter = (Game.guild_id.in_(list(replay.global_guilds))) if is_global else (Game.guild_id == guild_id)
+    component = influence_component(checkpoint, seed, guild_filter) if seed is not None else None
+
+    scopes = [EloReplay(checkpoint=checkpoint, scope=SCOPE_LOCAL, guild_id=guild_id, component=component)]
+    if is_global:
+        scopes.append(EloReplay(checkpoint=checkpoint, scope=SCOPE_GLOBAL, component=component))
+    replay.game_filter = replay_filter() & after_checkpoint(checkpoint) & guild_filter
+    if component is not None:
+        replay.game_filter &= (Game.id.in_(list(component[0])))
+
+    game_ids = set()
+    for scoped_replay in scopes:
+        scoped_replay.load()
+        scoped_replay.replay()
+        replay.merge_results(scoped_replay.export_results())
+        game_ids.update(game.id for game in scoped_replay.games)
+    replay.write()  # drops the later checkpoints - administration.task_rating_checkpoint takes the next one
+    return len(game_ids)
+
+
+def create_checkpoint():
+    # Snapshot of the stored ratings, as of the latest confirmed ranked game. Run daily by administration.task_rating_checkpoint.
+    # Needs a transaction of its own, so it refuses to run inside another one and returns None
+    db.connect(reuse_if_open=True)
+    if db.in_transaction():
+        logger.warning('create_checkpoint: skipped, called inside a transaction')
+        return None
+    if db.connection().get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        db.commit()  # the isolation level can only be set before the first query of a transaction
+    with db.atomic():
+        # ratings and the game they are as of need to come from the same snapshot of the database
+        db.execute_sql('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        last_game = Game.select(Game.id, Game.completed_ts).where(
+            (Game.is_confirmed == 1) & (Game.is_ranked == 1) & (Game.completed_ts.is_null(False)) & (Game.winner.is_null(False))
+        ).order_by(Game.completed_ts.desc(), Game.id.desc()).first()
+        if not last_game:
+            return None
+
+        latest = RatingCheckpoint.select().order_by(RatingCheckpoint.completed_ts.desc(), RatingCheckpoint.last_game_id.desc()).first()
+        if latest and latest.last_game_id == last_game.id:
+            logger.debug(f'create_checkpoint: checkpoint {latest.id} is already current')
+            return latest
+
+        game_count = Game.select().where((Game.is_confirmed == 1) & (Game.is_ranked == 1) & (Game.completed_ts.is_null(False))).count()
+        checkpoint = RatingCheckpoint.create(
+            completed_ts=last_game.completed_ts, last_game_id=last_game.id, game_count=game_count,
+            player_data=RatingTable.from_model(Player, RATING_FIELDS + COUNT_FIELDS).pack(RATING_FIELDS + COUNT_FIELDS),
+            discordmember_data=RatingTable.from_model(DiscordMember, RATING_FIELDS + COUNT_FIELDS).pack(RATING_FIELDS + COUNT_FIELDS),
+            team_data=RatingTable.from_model(Team, TEAM_FIELDS).pack(TEAM_FIELDS),
+            squad_data=RatingTable.from_model(Squad, SQUAD_FIELDS).pack(SQUAD_FIELDS)
+        )
+    logger.info(f'create_checkpoint: saved checkpoint {checkpoint.id} as of game {last_game.id}')
+    return checkpoint
+
+
+def prune_checkpoints(today: datetime.date = None):
+    # Applies the checkpoint_wanted() retention policy to stored checkpoints. Returns number of checkpoints deleted
+    latest_by_day = {}
+    for checkpoint_id, completed_ts in RatingCheckpoint.select(RatingCheckpoint.id, RatingCheckpoint.completed_ts).order_by(
+            RatingCheckpoint.completed_ts, RatingCheckpoint.last_game_id).tuples():
+        latest_by_day[completed_ts.date()] = checkpoint_id
+
+    days = sorted(latest_by_day)
+    keep = [latest_by_day[day] for n, day in enumerate(days) if checkpoint_wanted(day, days[n + 1] if n + 1 < len(days) else None, today=today)]
+
+    deleted = RatingCheckpoint.delete().where(RatingCheckpoint.id.not_in(keep)).execute()
+    logger.info(f'prune_checkpoints: kept {len(keep)} checkpoints, deleted {deleted}')
+    return deleted
+
+
+def parity_check():
+    # Runs the in-memory replay and the legacy Game.recalculate_all_elo() against the same data, rolling back the legacy
+    # run afterwards so the database is left unchanged. Returns a list of mismatches, which should be empty.
+
+    replay = EloReplay()
+    replay.load()
+    replay.replay()
+
+    db.connect(reuse_if_open=True)
+    with db.atomic() as transaction:
+        start = timer()
+        Game.recalculate_all_elo()
+        logger.info(f'parity_check: legacy recalculation took {timer() - start:.2f}s')
+        mismatches = replay.compare_with_database()
+        transaction.rollback()
+
+    logger.info(f'parity_check: {len(mismatches)} mismatches across {len(replay.games)} games')
+    return mismatches
+
+
+def check_game_counts(rebuild: bool = False):
+    # Compares the maintained Player/DiscordMember.ranked_game_count columns against a fresh count of confirmed ranked games.
+    # Returns a list of mismatches. If rebuild is True the stored counts are overwritten with the fresh counts.
+    db.connect(reuse_if_open=True)
+    confirmed_ranked = (Game.is_completed == 1) & (Game.is_confirmed == 1) & (Game.is_ranked == 1)
+    moonrise_games = Game.date >= settings.moonrise_reset_date
+
+    player_counts = Lineup.select(Lineup.player, fn.COUNT(Lineup.id), fn.COUNT(Lineup.id).filter(moonrise_games)).join(Game).where(
+        confirmed_ranked).group_by(Lineup.player)
+    member_counts = Lineup.select(Player.discord_member, fn.COUNT(Lineup.id), fn.COUNT(Lineup.id).filter(moonrise_games)).join(Game).join_from(
+        Lineup, Player).where(confirmed_ranked & Game.guild_id.in_(settings.servers_included_in_global_lb())).group_by(Player.discord_member)
+
+    mismatches = []
+    with db.atomic():
+        for label, model, counts in (('Player', Player, player_counts), ('DiscordMember', DiscordMember, member_counts)):
+            expected = {row[0]: row[1:] for row in counts.tuples()}
+            stale = []
+            for record_id, *stored in model.select(model.id, model.ranked_game_count, model.ranked_game_count_moonrise).tuples():
+                fresh = expected.get(record_id, (0, 0))
+                if tuple(stored) != tuple(fresh):
+                    mismatches.append(f'{label} {record_id} ranked_game_count: stored {stored[0]}/{stored[1]} counted {fresh[0]}/{fresh[1]}')
+                    stale.append(model(id=record_id, ranked_game_count=fresh[0], ranked_game_count_moonrise=fresh[1]))
+            if rebuild and stale:
+                model.bulk_update(stale, fields=list(COUNT_FIELDS), batch_size=1000)
+                logger.info(f'check_game_counts: rebuilt ranked game counts for {len(stale)} {label} records')
+
+    return mismatches
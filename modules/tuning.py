@@ -0,0 +1,133 @@
+"""Offline tuning of the ELO parameters in modules.elo against the ranked game history.
+
+load_history() reads every ranked game once (through EloReplay) and flattens it into a few integer arrays. evaluate()
+replays those arrays under one EloParams and scores the win chance predicted before each game against its result,
+so a candidate can be judged without touching the database. tune() runs a grid of candidates over a process pool.
+
+Scores use local all-time Player ELO, the one rating that covers the whole history:
+    log_loss - mean of -ln(predicted chance of the side that won)
+    brier    - mean over games of sum((predicted chance - actual result) ** 2) across all sides
+Lower is better for both. Only ratings are replayed - team and squad ELO are not part of the score.
+"""
+import itertools
+import logging
+import math
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+
+from modules import elo
+from modules.models import db
+from modules.recalculation import EloReplay
+
+logger = logging.getLogger('polybot.' + __name__)
+
+# Game g has sides game_sides[g]:game_sides[g + 1], side s has players side_players[s]:side_players[s + 1] (rows in player_rows).
+# winners[g] is the position of the winning side within the game.
+History = namedtuple('History', ['player_count', 'bot_rows', 'versions', 'winners', 'game_sides', 'side_players', 'player_rows'])
+
+# Default grid - every combination is evaluated, so keep it small
+PARAM_GRID = {
+    'k_factors': [(75, 50, 32), (60, 40, 32), (75, 50, 24), (50, 40, 24), (90, 60, 40)],
+    'boost': [.60, .30, 0],
+    'handicap_v2': [100, 150, 200],
+    'host_bonus': [50, 25, 0],
+}
+
+_history = None  # set in each worker by init_worker(), so the arrays are shipped once per process rather than once per task
+
+
+def load_history():
+    replay = EloReplay()
+    replay.load()
+    bot_rows = array('l', sorted(replay.bot_players))
+    versions, winners = array('b'), array('b')
+    game_sides, side_players, player_rows = array('l', [0]), array('l', [0]), array('l')
+
+    for game in replay.games:
+        if not game.sides or min(len(side.lineups) for side in game.sides) <= 0:
+            continue  # skipped by declare_winner() as well
+        side_ids = [side.id for side in game.sides]
+        if game.winner_id not in side_ids:
+            logger.warning(f'load_history: skipping game {game.id}, whose winner {game.winner_id} is not one of its sides')
+            continue
+        winner = side_ids.index(game.winner_id)
+        versions.append(elo.calc_version(game.date))
+        winners.append(winner)
+        for side in game.sides:
+            player_rows.extend(lineup.player for lineup in side.lineups)
+            side_players.append(len(player_rows))
+        game_sides.append(len(side_players) - 1)
+
+    logger.info(f'load_history: {len(winners)} games, {len(player_rows)} lineups')
+    return History(len(replay.players), bot_rows, versions, winners, game_sides, side_players, player_rows)
+
+
+def evaluate(history: History, params: elo.EloParams = elo.DEFAULT_PARAMS, burn_in: int = 0):
+    # Replays the history under params and scores every game after the first burn_in games
+    ratings = array('l', [1000]) * history.player_count
+    game_counts = array('l', [0]) * history.player_count
+    for row in history.bot_rows:
+        ratings[row] = 0
+    bots = set(history.bot_rows)
+
+    log_loss, brier, scored = 0.0, 0.0, 0
+    for g in range(len(history.winners)):
+        sides = range(history.game_sides[g], history.game_sides[g + 1])
+        rows = [history.player_rows[history.side_players[s]:history.side_players[s + 1]] for s in sides]
+        side_sizes = [len(side) for side in rows]
+        version, winner = history.versions[g], history.winners[g]
+
+        side_elos = [elo.side_average([ratings[row] for row in side]) for side in rows]
+        side_elos[0] += elo.host_bonus(version, side_sizes, params)
+        chances = elo.side_win_chances(max(side_sizes), side_sizes, side_elos, version, params)
+
+        if g >= burn_in:
+            log_loss -= math.log(max(chances[winner], 1e-15))
+            brier += sum((chance - (1 if i == winner else 0)) ** 2 for i, chance in enumerate(chances))
+            scored += 1
+
+        for i, side in enumerate(rows):
+            for row in side:
+                if row not in bots:
+                    ratings[row] += elo.player_elo_delta(ratings[row], game_counts[row], chances[i], i == winner, params)
+            for row in side:
+                game_counts[row] += 1
+
+    return {'games': scored, 'log_loss': log_loss / scored if scored else None, 'brier': brier / scored if scored else None}
+
+
+def param_grid(grid: dict = None):
+    # Every combination of the values in grid, with any parameter not in grid left at its default
+    grid = grid or PARAM_GRID
+    keys = list(grid)
+    return [elo.DEFAULT_PARAMS._replace(**dict(zip(keys, values))) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def init_worker(history: History):
+    global _history
+    _history = history
+
+
+def evaluate_in_worker(params: elo.EloParams, burn_in: int):
+    start = timer()
+    result = evaluate(_history, params, burn_in)
+    result.update(params=params, seconds=timer() - start)
+    return result
+
+
+def tune(candidates=None, workers: int = 4, burn_in: int = 0):
+    # Scores each candidate EloParams (default: param_grid()) in a process pool. Returns results sorted by log loss, best first
+    candidates = candidates or param_grid()
+    if elo.DEFAULT_PARAMS not in candidates:
+        candidates = [elo.DEFAULT_PARAMS] + list(candidates)  # always include the current values as a baseline
+    history = load_history()
+    db.close()  # forked workers must not share this connection, and never need the database
+
+    start = timer()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(history, )) as pool:
+        results = list(pool.map(evaluate_in_worker, candidates, itertools.repeat(burn_in), chunksize=max(1, len(candidates) // (workers * 4))))
+    logger.info(f'tune: evaluated {len(candidates)} parameter sets in {timer() - start:.2f}s with {workers} workers')
+
+    return sorted(results, key=lambda r: (r['log_loss'] is None, r['log_loss']))
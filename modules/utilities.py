@@ -326,25 +326,42 @@ def export_player_data(player_list, member_list):
     return filename
 
 
-async def paginate(bot, ctx, title, message_list, page_start=0, page_end=10, page_size=10):
+async def paginate(bot, ctx, title, message_list=None, page_start=0, page_end=10, page_size=10, page_provider=None, total: int = None):
     # Allows user to page through a long list of messages with reactions
     # message_list should be a [(List of, two-item tuples)]. Each tuple will be split into an embed field name/value
+    # Alternatively pass page_provider(start, end), returning the same kind of tuples for entries start through end - 1, and the
+    # total number of entries. Pages are then only built when someone turns to them. A plain function is run in the executor
+    # (so it can query the database), a coroutine function is awaited. Each page is built at most once per message.
+
+    if page_provider is None:
+        total = len(message_list)
+    pages = {}
+
+    async def get_page(start, end):
+        if page_provider is None:
+            return message_list[start:end]
+        if (start, end) not in pages:
+            if asyncio.iscoroutinefunction(page_provider):
+                pages[(start, end)] = await page_provider(start, end)
+            else:
+                pages[(start, end)] = await bot.loop.run_in_executor(None, page_provider, start, end)
+        return pages[(start, end)]
 
-    page_end = page_end if len(message_list) > page_end else len(message_list)
+    page_end = page_end if total > page_end else total
 
     first_loop = True
     reaction, user = None, None
 
     while True:
         embed = discord.Embed(title=title)
-        for entry in range(page_start, page_end):
-            embed.add_field(name=message_list[entry][0][:256], value=message_list[entry][1][:1024], inline=False)
-        if page_size < len(message_list):
-            embed.set_footer(text=f'{page_start + 1} - {page_end} of {len(message_list)}')
+        for name, value in await get_page(page_start, page_end):
+            embed.add_field(name=name[:256], value=value[:1024], inline=False)
+        if page_size < total:
+            embed.set_footer(text=f'{page_start + 1} - {page_end} of {total}')
 
         if first_loop is True:
             sent_message = await ctx.send(embed=embed)
-            if len(message_list) > page_size:
+            if total > page_size:
                 await sent_message.add_reaction('⏪')
                 await sent_message.add_reaction('⬅')
                 await sent_message.add_reaction('➡')
@@ -361,10 +378,10 @@ async def paginate(bot, ctx, title, message_list, page_start=0, page_end=10, pag
         def check(reaction, user):
             e = str(reaction.emoji)
             compare = False
-            if page_size < len(message_list):
+            if page_size < total:
                 if page_start > 0 and e in '⏪⬅':
                     compare = True
-                elif page_end < len(message_list) and e in '➡⏩':
+                elif page_end < total and e in '➡⏩':
                     compare = True
             return ((user == ctx.message.author) and (reaction.message.id == sent_message.id) and compare)
 
@@ -386,7 +403,7 @@ def check(reaction, user):
 
             if '⏩' in str(reaction.emoji):
                 # last page
-                page_end = len(message_list)
+                page_end = total
                 page_start = page_end - page_size
 
             if '➡' in str(reaction.emoji):
@@ -403,8 +420,8 @@ def check(reaction, user):
                 page_start = 0
                 page_end = page_start + page_size
 
-            if page_end > len(message_list):
-                page_end = len(message_list)
+            if page_end > total:
+                page_end = total
                 page_start = page_end - page_size if (page_end - page_size) >= 0 else 0
 
             first_loop = False